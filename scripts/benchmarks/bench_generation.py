@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Benchmark the question generation pipeline against local stand-ins.
+
+The shared generation engine is run end to end against a fake OpenAI server and
+a fake PostgREST server (see stub_servers.py), with no preflight checks, so no
+API credit is spent and nothing is written to Supabase. Latency, server errors
+and 429s can be injected on either side.
+
+Each configuration reports questions/second, p50/p99 latency per stage and
+request counts. Stages are timed on the client:
+- rate_limit_wait: waiting for the requests/tokens-per-minute budget
+- llm_call: one chat completion attempt (retries are timed separately)
+- parse_validate: parsing and validating a response
+- insert_request: one bulk insert, including bisection retries
+- call_total: one generation call from scheduling to upload, including the wait
+  for a concurrency slot
+
+Comma-separated values for --concurrency, --questions-per-call and --batch-size
+are swept, so changes can be compared side by side. --batch-api also runs the
+Batch API phases (plan, submit, collect) once against the fake /files and
+/batches endpoints.
+
+Example:
+    python scripts/benchmarks/bench_generation.py --concurrency 4,8,16 --llm-latency 0.5
+    python scripts/benchmarks/bench_generation.py --questions-per-call 1,5 --cache warm --json results.json
+    python scripts/benchmarks/bench_generation.py --stream --llm-wrong-section-rate 0.2
+    python scripts/benchmarks/bench_generation.py --batch-api
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import itertools
+import threading
+import contextlib
+from collections import defaultdict
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS_DIR)
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "generate_questions"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_servers import FaultProfile, FakeOpenAI, FakePostgREST
+
+STAGES = ("rate_limit_wait", "llm_call", "parse_validate", "insert_request", "call_total")
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class StageTimer:
+    """Collects wall-clock durations per pipeline stage (thread-safe)"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            with self.time(stage):
+                return func(*args, **kwargs)
+        return timed
+
+    def summary(self):
+        return {
+            stage: {
+                "count": len(self.samples[stage]),
+                "p50_ms": percentile(self.samples[stage], 0.50) * 1000,
+                "p99_ms": percentile(self.samples[stage], 0.99) * 1000,
+            }
+            for stage in STAGES
+        }
+
+
+def instrument(engine, timer):
+    """
+    Patch timing hooks into the engine's collaborators for one run.
+    Returns the original attributes so they can be restored.
+    """
+    originals = {name: getattr(engine, name) for name in
+                 ("chat_completion", "stream_chat_completion", "questions_from_content", "generate_and_upload", "RateLimiter", "BulkInserter")}
+
+    class TimedRateLimiter(originals["RateLimiter"]):
+        async def acquire(self, tokens=0):
+            start = time.perf_counter()
+            await super().acquire(tokens)
+            timer.record("rate_limit_wait", time.perf_counter() - start)
+
+    class TimedBulkInserter(originals["BulkInserter"]):
+        def _insert_batch(self, batch):
+            # Includes any requests that isolate rejected rows
+            with timer.time("insert_request"):
+                return super()._insert_batch(batch)
+
+    async def timed_generate_and_upload(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await originals["generate_and_upload"](*args, **kwargs)
+        finally:
+            timer.record("call_total", time.perf_counter() - start)
+
+    engine.chat_completion = timer.wrap("llm_call", originals["chat_completion"])
+    engine.stream_chat_completion = timer.wrap("llm_call", originals["stream_chat_completion"])
+    engine.questions_from_content = timer.wrap("parse_validate", originals["questions_from_content"])
+    engine.generate_and_upload = timed_generate_and_upload
+    engine.RateLimiter = TimedRateLimiter
+    engine.BulkInserter = TimedBulkInserter
+    return originals
+
+
+def run_once(engine, exams, config, args, llm, db, cache_path):
+    """Run the pipeline once against the stubs and return the measurements"""
+    from utils.llm_cache import ResponseCache
+    from utils.question_schema import RejectionStats
+    from utils.dedup_index import NearDuplicateIndex
+
+    llm.counts.clear()
+    db.counts.clear()
+    cache = None
+    if args.cache != "off":
+        cache = ResponseCache(cache_path)
+    if args.cache == "warm":
+        # Priming pass: fills the cache so the measured pass replays it
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(engine.run_generation(exams, config["concurrency"], args.rpm, args.tpm,
+                                              config["batch_size"], cache, None, config["questions_per_call"],
+                                              stream=args.stream))
+        llm.counts.clear()
+        db.counts.clear()
+        cache.hits = cache.misses = 0
+
+    timer = StageTimer()
+    originals = instrument(engine, timer)
+    engine.REJECTIONS = RejectionStats()
+    dedup = NearDuplicateIndex() if args.dedup else None
+    output = io.StringIO()
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+            uploaded = asyncio.run(engine.run_generation(
+                exams, config["concurrency"], args.rpm, args.tpm, config["batch_size"], cache, None,
+                config["questions_per_call"], dedup, stream=args.stream))
+        elapsed = time.perf_counter() - start
+    finally:
+        for name, value in originals.items():
+            setattr(engine, name, value)
+
+    result = {
+        "config": dict(config, cache=args.cache, dedup=args.dedup, stream=args.stream),
+        "questions": uploaded,
+        "seconds": elapsed,
+        "questions_per_second": uploaded / elapsed if elapsed else 0.0,
+        "stages": timer.summary(),
+        "llm_requests": dict(llm.counts),
+        "db_requests": dict(db.counts),
+        "rejections": engine.REJECTIONS.as_dict(),
+    }
+    if cache is not None:
+        result["cache"] = cache.stats()
+        cache.close()
+    return result
+
+
+def run_batch_round_trip(engine, exams, args, llm, db, workdir):
+    """Plan, submit and collect one Batch API run against the stubs and return the measurements"""
+    from utils.question_schema import RejectionStats
+
+    llm.counts.clear()
+    db.counts.clear()
+    engine.REJECTIONS = RejectionStats()
+    batch_file = os.path.join(workdir, "batch_requests.jsonl")
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+        requests = engine.plan_batch(exams, batch_file, questions_per_call=args.questions_per_call[0])
+        engine.submit_batch(exams, batch_file)
+        uploaded = engine.collect_batch(exams, batch_file, args.batch_size[0], poll_interval=0)
+    elapsed = time.perf_counter() - start
+    return {
+        "config": {"batch_api": True, "questions_per_call": args.questions_per_call[0],
+                   "batch_size": args.batch_size[0]},
+        "batch_requests": requests,
+        "questions": uploaded,
+        "seconds": elapsed,
+        "llm_requests": dict(llm.counts),
+        "db_requests": dict(db.counts),
+        "rejections": engine.REJECTIONS.as_dict(),
+    }
+
+
+def print_batch_result(result):
+    print(f"\n=== Batch API round trip, {result['config']['questions_per_call']} questions/request ===")
+    print(f"Planned {result['batch_requests']} batch requests; uploaded {result['questions']} questions "
+          f"in {result['seconds']:.2f}s")
+    print(f"LLM requests: {result['llm_requests']}")
+    print(f"DB requests:  {result['db_requests']}")
+
+
+def print_result(result):
+    config = result["config"]
+    print(f"\n=== concurrency {config['concurrency']}, {config['questions_per_call']} questions/call, "
+          f"insert batch {config['batch_size']}, cache {config['cache']}"
+          f"{', streaming' if config['stream'] else ''} ===")
+    print(f"Uploaded {result['questions']} questions in {result['seconds']:.2f}s "
+          f"({result['questions_per_second']:.1f} questions/s)")
+    print(f"{'stage':<18}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for stage, stats in result["stages"].items():
+        print(f"{stage:<18}{stats['count']:>8}{stats['p50_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    print(f"LLM requests: {result['llm_requests']}")
+    print(f"DB requests:  {result['db_requests']}")
+    if "cache" in result:
+        print(f"Cache: {result['cache']['hits']} hits, {result['cache']['misses']} misses")
+
+
+def int_list(value):
+    return [int(part) for part in value.split(",")]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark question generation against local API stand-ins")
+    parser.add_argument("--exam", action="append", dest="exams",
+                        help="Exam config to generate (repeatable; default: edutest)")
+    parser.add_argument("--questions-per-difficulty", type=int, default=2,
+                        help="Override the exam's per-cell target to keep runs short")
+    parser.add_argument("--concurrency", type=int_list, default=[8], help="Comma-separated values to sweep")
+    parser.add_argument("--questions-per-call", type=int_list, default=[5], help="Comma-separated values to sweep")
+    parser.add_argument("--batch-size", type=int_list, default=[50], help="Comma-separated values to sweep")
+    parser.add_argument("--rpm", type=int, default=100000, help="Client requests per minute budget")
+    parser.add_argument("--tpm", type=int, default=100000000, help="Client tokens per minute budget")
+    parser.add_argument("--cache", choices=["off", "cold", "warm"], default="off",
+                        help="Response cache: off, empty (cold) or primed by a first pass (warm)")
+    parser.add_argument("--dedup", action="store_true", help="Enable the near-duplicate check")
+    parser.add_argument("--stream", action="store_true", help="Stream completions with early abort")
+    parser.add_argument("--batch-api", action="store_true",
+                        help="Also run a Batch API plan/submit/collect round trip")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Fake OpenAI base latency (seconds)")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="Fake OpenAI extra random latency (seconds)")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction of OpenAI calls failing with 500")
+    parser.add_argument("--llm-429-rate", type=float, default=0.0, help="Fraction of OpenAI calls answered with 429")
+    parser.add_argument("--llm-wrong-section-rate", type=float, default=0.0,
+                        help="Fraction of fake questions that name the wrong section")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="Fake PostgREST base latency (seconds)")
+    parser.add_argument("--db-jitter", type=float, default=0.01, help="Fake PostgREST extra random latency (seconds)")
+    parser.add_argument("--db-error-rate", type=float, default=0.0, help="Fraction of PostgREST calls failing with 500")
+    parser.add_argument("--db-429-rate", type=float, default=0.0, help="Fraction of PostgREST calls answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After seconds sent with injected 429s")
+    parser.add_argument("--json", help="Write all results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # The stubs live for the whole session: the OpenAI client keeps the base URL it was created with
+    llm = FakeOpenAI(FaultProfile(args.llm_latency, args.llm_jitter, args.llm_error_rate, args.llm_429_rate,
+                                  args.retry_after, seed=1),
+                    wrong_section_rate=args.llm_wrong_section_rate).start()
+    db = FakePostgREST(FaultProfile(args.db_latency, args.db_jitter, args.db_error_rate, args.db_429_rate,
+                                    args.retry_after, seed=2)).start()
+
+    # The engine reads credentials at import time; point everything at the stubs first
+    os.environ["OPENAI_API_KEY"] = "sk-benchmark"
+    os.environ["OPENAI_BASE_URL"] = f"{llm.url}/v1"
+    os.environ["SUPABASE_KEY"] = "benchmark"
+    os.environ["SUPABASE_URL"] = db.url
+    import engine
+
+    exams = []
+    for name in args.exams or ["edutest"]:
+        exam = engine.load_exam_config(name)
+        exam["questions_per_difficulty"] = args.questions_per_difficulty
+        exams.append(exam)
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        sweep = itertools.product(args.concurrency, args.questions_per_call, args.batch_size)
+        for index, (concurrency, questions_per_call, batch_size) in enumerate(sweep):
+            config = {"concurrency": concurrency, "questions_per_call": questions_per_call, "batch_size": batch_size}
+            result = run_once(engine, exams, config, args, llm, db, os.path.join(workdir, f"cache_{index}.sqlite3"))
+            print_result(result)
+            results.append(result)
+        if args.batch_api:
+            result = run_batch_round_trip(engine, exams, args, llm, db, workdir)
+            print_batch_result(result)
+            results.append(result)
+
+    llm.stop()
+    db.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote results to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the OpenAI and Supabase (PostgREST) HTTP APIs.
+
+Both servers run in a background thread on 127.0.0.1 and can inject latency,
+server errors and 429 rate-limit responses, so the generation pipeline can be
+benchmarked without spending API credit or writing to the real database.
+"""
+
+import re
+import json
+import time
+import random
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("river", "planet", "garden", "ladder", "signal", "marble", "orchard", "lantern", "harbour",
+         "pencil", "meadow", "engine", "canyon", "violet", "copper", "falcon", "timber", "saddle")
+
+
+def parse_multipart(content_type, data):
+    """Fields of a multipart/form-data body as {name: bytes}"""
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + data)
+    return {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+            for part in message.iter_parts()}
+
+
+class FaultProfile:
+    """
+    Latency and failure injection for a stub server.
+
+    Each request waits `latency` seconds (plus uniform `jitter`), then fails with
+    a 500 at `error_rate` or a 429 carrying Retry-After at `rate_limit_rate`.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=0.1,
+                 seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def roll(self):
+        """Return (delay, status) for one request; status is None for success"""
+        with self._lock:
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            draw = self._rng.random()
+        if draw < self.rate_limit_rate:
+            return delay, 429
+        if draw < self.rate_limit_rate + self.error_rate:
+            return delay, 500
+        return delay, None
+
+
+class StubServer(ABC):
+    """Base class: a threaded HTTP server with request counters"""
+
+    def __init__(self, faults=None):
+        self.faults = faults or FaultProfile()
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] += amount
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, body=None, headers=None):
+                data = b"" if body is None else json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_bytes(self, status, data, content_type="application/octet-stream"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def read_body(self):
+                """A JSON body parsed, or a multipart form as {name: bytes}"""
+                length = int(self.headers.get("Content-Length") or 0)
+                if not length:
+                    return None
+                data = self.rfile.read(length)
+                content_type = self.headers.get("Content-Type", "")
+                if content_type.startswith("multipart/form-data"):
+                    return parse_multipart(content_type, data)
+                return json.loads(data)
+
+            def handle_request(self, method):
+                body = self.read_body() if method == "POST" else None
+                delay, failure = stub.faults.roll()
+                if delay:
+                    time.sleep(delay)
+                if failure == 429:
+                    stub.count("rate_limited")
+                    self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                                   {"Retry-After": str(stub.faults.retry_after)})
+                    return
+                if failure == 500:
+                    stub.count("server_errors")
+                    self.send_json(500, {"error": {"message": "Injected server error"}})
+                    return
+                stub.handle(self, method, body)
+
+            def do_GET(self):
+                self.handle_request("GET")
+
+            def do_HEAD(self):
+                self.handle_request("HEAD")
+
+            def do_POST(self):
+                self.handle_request("POST")
+
+            def do_PATCH(self):
+                self.handle_request("PATCH")
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    @abstractmethod
+    def handle(self, handler, method, body):
+        """Answer one request; subclasses implement their endpoints here"""
+
+
+class FakeOpenAI(StubServer):
+    """
+    Answers /v1/chat/completions with valid generated questions, or a reading
+    passage when one is requested. The requested section, sub-skills and
+    question count are read back from the prompt, so responses pass the same
+    validation as real ones.
+
+    The Batch API is served by /v1/files (upload and content) and /v1/batches
+    (create and retrieve). A batch is answered as soon as it is created, with
+    one chat completion per request line, so its status is already "completed"
+    when first polled.
+
+    A fraction `wrong_section_rate` of questions name another section, so the
+    cost of invalid output can be measured. Streamed requests (stream=true) are
+    answered with server-sent events of `stream_chunk_chars` characters,
+    `stream_chunk_delay` seconds apart; a client that disconnects early is
+    counted in `streams_cancelled`.
+    """
+
+    def __init__(self, faults=None, completion_tokens_per_question=350, wrong_section_rate=0.0,
+                 stream_chunk_chars=16, stream_chunk_delay=0.002):
+        super().__init__(faults)
+        self.completion_tokens_per_question = completion_tokens_per_question
+        self.wrong_section_rate = wrong_section_rate
+        self.stream_chunk_chars = stream_chunk_chars
+        self.stream_chunk_delay = stream_chunk_delay
+        self._serial = 0
+        self._files = {}
+        self._batches = {}
+
+    def next_serial(self):
+        with self._lock:
+            self._serial += 1
+            return self._serial
+
+    def make_question(self, section, sub_skill):
+        serial = self.next_serial()
+        rng = random.Random(serial)
+        if rng.random() < self.wrong_section_rate:
+            section = "Wrong Section"
+        words = " ".join(rng.choice(WORDS) for _ in range(12))
+        options = [f"{rng.choice(WORDS)} {serial}-{i}" for i in range(4)]
+        return {
+            "test_section": section,
+            "sub_skill": sub_skill,
+            "question_type": "Multiple Choice",
+            "input_type": "Text",
+            "question": f"Question {serial}: which word completes the pattern {words}?",
+            "options": options,
+            "correct_answer": options[rng.randrange(4)],
+            "explanation": f"The pattern in question {serial} repeats every third word.",
+            "linked_passage_id": f"passage-{serial % 50}",
+        }
+
+    def make_passage(self):
+        serial = self.next_serial()
+        rng = random.Random(serial)
+        paragraphs = [" ".join(rng.choice(WORDS) for _ in range(60)).capitalize() + "." for _ in range(4)]
+        return {"title": f"Passage {serial}", "text_type": "informative", "passage": "\n\n".join(paragraphs)}
+
+    def completion(self, body):
+        """Content and token counts answering one chat completion request body"""
+        prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+        section = re.search(r"- Section: (.+)", prompt)
+        sub_skill = re.search(r"- Sub-skill: (.+)", prompt)
+        count = re.search(r"exactly (\d+) objects", prompt)
+        count = int(count.group(1)) if count else 1
+        # Questions about a passage name one sub-skill per line of the request
+        sub_skills = re.findall(r"- Question \d+: (.+)", prompt) or [sub_skill.group(1) if sub_skill else ""] * count
+
+        if "one passage" in prompt:
+            self.count("passages")
+            count = 1
+            content = json.dumps(self.make_passage())
+        else:
+            questions = [self.make_question(section.group(1).strip() if section else "", name.strip())
+                         for name in sub_skills[:count]]
+            content = json.dumps(questions if count > 1 else questions[0])
+        return content, len(prompt) // 4 + 1, self.completion_tokens_per_question * count
+
+    def completion_object(self, body, content, prompt_tokens, completion_tokens):
+        return {
+            "id": f"chatcmpl-{self.next_serial()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def handle(self, handler, method, body):
+        path = handler.path.split("?")[0]
+        if method == "POST" and path.endswith("/chat/completions"):
+            self.count("chat_completions")
+            content, prompt_tokens, completion_tokens = self.completion(body)
+            if body.get("stream"):
+                self.send_stream(handler, body, content, prompt_tokens, completion_tokens)
+                return
+            handler.send_json(200, self.completion_object(body, content, prompt_tokens, completion_tokens))
+        elif method == "POST" and path.endswith("/files"):
+            self.upload_file(handler, body)
+        elif method == "GET" and re.search(r"/files/[^/]+/content$", path):
+            data = self._files.get(path.split("/")[-2])
+            if data is None:
+                handler.send_json(404, {"error": {"message": f"No such file {path}"}})
+                return
+            handler.send_bytes(200, data)
+        elif method == "POST" and path.endswith("/batches"):
+            self.create_batch(handler, body)
+        elif method == "GET" and re.search(r"/batches/[^/]+$", path):
+            batch = self._batches.get(path.rsplit("/", 1)[-1])
+            if batch is None:
+                handler.send_json(404, {"error": {"message": f"No such batch {path}"}})
+                return
+            handler.send_json(200, batch)
+        else:
+            handler.send_json(404, {"error": {"message": f"Unknown endpoint {handler.path}"}})
+
+    def store_file(self, data, filename, purpose):
+        file_id = f"file-{self.next_serial()}"
+        with self._lock:
+            self._files[file_id] = data
+        return {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+
+    def upload_file(self, handler, form):
+        self.count("files")
+        purpose = form.get("purpose", b"batch").decode("utf-8")
+        handler.send_json(200, self.store_file(form["file"], "batch_requests.jsonl", purpose))
+
+    def create_batch(self, handler, body):
+        """Run every request of the input file at once and store the results as the output file"""
+        self.count("batches")
+        data = self._files.get(body["input_file_id"])
+        if data is None:
+            handler.send_json(404, {"error": {"message": f"No such file {body['input_file_id']}"}})
+            return
+        lines = []
+        for line in data.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            self.count("batch_requests")
+            completion = self.completion_object(request["body"], *self.completion(request["body"]))
+            lines.append(json.dumps({"id": f"batch_req_{self.next_serial()}", "custom_id": request["custom_id"],
+                                     "response": {"status_code": 200, "body": completion}, "error": None}))
+        output = self.store_file(("\n".join(lines) + "\n").encode("utf-8"), "batch_output.jsonl", "batch_output")
+        now = int(time.time())
+        batch = {
+            "id": f"batch_{self.next_serial()}", "object": "batch", "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"], "completion_window": body["completion_window"],
+            "status": "completed", "output_file_id": output["id"], "error_file_id": None,
+            "created_at": now, "completed_at": now, "metadata": body.get("metadata"),
+            "request_counts": {"total": len(lines), "completed": len(lines), "failed": 0},
+        }
+        with self._lock:
+            self._batches[batch["id"]] = batch
+        handler.send_json(200, batch)
+
+    def send_stream(self, handler, body, content, prompt_tokens, completion_tokens):
+        """Send `content` as chat.completion.chunk events, stopping if the client goes away"""
+        completion_id = f"chatcmpl-{self.next_serial()}"
+
+        def event(choices, usage=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": body.get("model", ""), "choices": choices, "usage": usage}
+            return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.close_connection = True
+        sent = 0
+        try:
+            for start in range(0, len(content), self.stream_chunk_chars):
+                piece = content[start:start + self.stream_chunk_chars]
+                handler.wfile.write(event([{"index": 0, "finish_reason": None, "delta": {"content": piece}}]))
+                handler.wfile.flush()
+                sent += len(piece)
+                time.sleep(self.stream_chunk_delay)
+            handler.wfile.write(event([{"index": 0, "finish_reason": "stop", "delta": {}}]))
+            handler.wfile.write(event([], {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                           "total_tokens": prompt_tokens + completion_tokens}))
+            handler.wfile.write(b"data: [DONE]\n\n")
+            handler.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # A client may stop reading once the JSON is complete; only a cut-off answer counts as cancelled
+            if sent < len(content):
+                self.count("streams_cancelled")
+                self.count("characters_not_sent", len(content) - sent)
+
+
+class FakePostgREST(StubServer):
+    """
+    Accepts PostgREST inserts into any table and counts the rows.
+    Reads return an empty table and HEAD counts report the rows inserted so far.
+    """
+
+    def __init__(self, faults=None):
+        super().__init__(faults)
+        self.rows = 0
+
+    def handle(self, handler, method, body):
+        if method == "POST":
+            self.count("inserts")
+            rows = body if isinstance(body, list) else [body]
+            with self._lock:
+                self.rows += len(rows)
+            handler.send_json(201)
+        elif method == "HEAD":
+            self.count("counts")
+            handler.send_json(200, headers={"Content-Range": f"*/{self.rows}"})
+        else:
+            self.count("reads" if method == "GET" else "updates")
+            handler.send_json(200, [])
+
@@ -1,12 +1,21 @@
 #!/usr/bin/env python3
 """
 Check what questions exist in the educoach_questions table
+
+Pass --snapshot to read a local snapshot (see snapshot_questions.py) instead of Supabase.
 """
 
 import os
-import json
-import requests
+import argparse
+from itertools import islice
 from dotenv import load_dotenv
+from utils.supabase_helpers import rollup_inventory
+from utils.snapshot import open_source, DEFAULT_SNAPSHOT_PATH
+
+parser = argparse.ArgumentParser(description="Check what questions exist in the educoach_questions table")
+parser.add_argument("--snapshot", nargs="?", const=DEFAULT_SNAPSHOT_PATH,
+                    help="Read from a local snapshot (default path if no value is given)")
+args = parser.parse_args()
 
 # Load environment variables
 load_dotenv()
@@ -15,26 +24,17 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
+if not args.snapshot and (not SUPABASE_URL or not SUPABASE_KEY):
     print("Error: Supabase credentials not found in environment variables")
     exit(1)
 
-# Headers for Supabase API requests
-headers = {
-    "apikey": SUPABASE_KEY,
-    "Authorization": f"Bearer {SUPABASE_KEY}",
-    "Content-Type": "application/json"
-}
-
-# Endpoint for the educoach_questions table
-endpoint = f"{SUPABASE_URL}/rest/v1/educoach_questions"
+# Questions are read from Supabase or from the local snapshot
+source = open_source(args.snapshot)
 
 # Check how many questions total
 try:
-    response = requests.get(endpoint, headers=headers, params={"select": "count"})
-    response.raise_for_status()
-    total_count = response.json()
-    print(f"Total questions in database: {len(total_count)}")
+    total_count = source.count_rows()
+    print(f"Total questions in database: {total_count}")
 except Exception as e:
     print(f"Error: {e}")
     exit(1)
@@ -42,9 +42,7 @@ except Exception as e:
 # Examine the actual schema from a sample question
 try:
     print("\nExamining database schema from sample question...")
-    response = requests.get(endpoint, headers=headers, params={"select": "*", "limit": 1})
-    response.raise_for_status()
-    sample = response.json()
+    sample = list(islice(source.iter_rows(select="*", page_size=1), 1))
     
     if sample:
         print("Fields in the questions table:")
@@ -58,15 +56,11 @@ except Exception as e:
 # Check all available test types
 try:
     print("\nListing unique test_type values (case sensitive):")
-    response = requests.get(endpoint, headers=headers, params={"select": "test_type"})
-    response.raise_for_status()
-    test_type_data = response.json()
-    
-    test_types = {}
-    for item in test_type_data:
-        test_type = item.get('test_type')
-        if test_type:
-            test_types[test_type] = test_types.get(test_type, 0) + 1
+    test_types = {
+        cell['test_type']: cell['question_count']
+        for cell in rollup_inventory(source.fetch_inventory(), ['test_type'])
+        if cell['test_type']
+    }
     
     for test_type, count in sorted(test_types.items()):
         print(f"  - '{test_type}': {count} questions")
@@ -76,31 +70,21 @@ except Exception as e:
 # Check specifically for the exact capitalization of "EduTest"
 try:
     print("\nChecking for 'EduTest' questions (exact match):")
-    response = requests.get(endpoint, headers=headers, params={"select": "count", "test_type": "eq.EduTest"})
-    response.raise_for_status()
-    edutest_exact = response.json()
-    print(f"  Questions with test_type = 'EduTest': {len(edutest_exact)}")
+    edutest_exact = source.count_rows(filters={"test_type": "eq.EduTest"})
+    print(f"  Questions with test_type = 'EduTest': {edutest_exact}")
     
     # Also check lowercase
-    response = requests.get(endpoint, headers=headers, params={"select": "count", "test_type": "eq.edutest"})
-    response.raise_for_status()
-    edutest_lower = response.json()
-    print(f"  Questions with test_type = 'edutest': {len(edutest_lower)}")
+    edutest_lower = source.count_rows(filters={"test_type": "eq.edutest"})
+    print(f"  Questions with test_type = 'edutest': {edutest_lower}")
     
     # Check if any questions have set_id already assigned
-    response = requests.get(endpoint, headers=headers, 
-                          params={"select": "count", "test_type": "eq.EduTest", "set_id": "not.is.null"})
-    response.raise_for_status()
-    with_set_id = response.json()
-    print(f"  'EduTest' questions with set_id already assigned: {len(with_set_id)}")
+    with_set_id = source.count_rows(filters={"test_type": "eq.EduTest", "set_id": "not.is.null"})
+    print(f"  'EduTest' questions with set_id already assigned: {with_set_id}")
     
     # Display a sample of the first few EduTest questions
     print("\nSample of EduTest questions:")
-    response = requests.get(endpoint, headers=headers, 
-                          params={"select": "id,test_type,test_section,sub_skill,difficulty,set_id", 
-                                 "test_type": "eq.EduTest", "limit": 3})
-    response.raise_for_status()
-    samples = response.json()
+    samples = list(islice(source.iter_rows(select="id,test_type,test_section,sub_skill,difficulty,set_id",
+                                           filters={"test_type": "eq.EduTest"}, page_size=3), 3))
     
     for i, sample in enumerate(samples):
         print(f"\nSample {i+1}:")
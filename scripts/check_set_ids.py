@@ -1,11 +1,20 @@
 #!/usr/bin/env python3
 """
 Check what set_id values are currently assigned to EduTest questions
+
+Pass --snapshot to read a local snapshot (see snapshot_questions.py) instead of Supabase.
 """
 
 import os
-import requests
+import argparse
 from dotenv import load_dotenv
+from utils.supabase_helpers import rollup_inventory
+from utils.snapshot import open_source, DEFAULT_SNAPSHOT_PATH
+
+parser = argparse.ArgumentParser(description="Check set_id values assigned to EduTest questions")
+parser.add_argument("--snapshot", nargs="?", const=DEFAULT_SNAPSHOT_PATH,
+                    help="Read from a local snapshot (default path if no value is given)")
+args = parser.parse_args()
 
 # Load environment variables
 load_dotenv()
@@ -14,36 +23,20 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
+if not args.snapshot and (not SUPABASE_URL or not SUPABASE_KEY):
     print("Error: Supabase credentials not found in environment variables")
     exit(1)
 
-# Headers for Supabase API requests
-headers = {
-    "apikey": SUPABASE_KEY,
-    "Authorization": f"Bearer {SUPABASE_KEY}",
-    "Content-Type": "application/json"
-}
-
-# Endpoint for the educoach_questions table
-endpoint = f"{SUPABASE_URL}/rest/v1/educoach_questions"
-
 # Check all EduTest questions and their set_id values
 try:
     print("Checking EduTest questions and their set_id values:")
     
-    # Get all unique set_id values for EduTest questions
-    response = requests.get(endpoint, headers=headers, 
-                          params={"select": "set_id", "test_type": "eq.EduTest"})
-    response.raise_for_status()
-    data = response.json()
-    
-    set_ids = {}
-    for item in data:
-        set_id = item.get('set_id')
-        set_ids[set_id] = set_ids.get(set_id, 0) + 1
+    # One grouped request returns every (section, sub_skill, difficulty, set_id) count
+    cells = open_source(args.snapshot).fetch_inventory({"test_type": "eq.EduTest"})
+    set_ids = {cell['set_id']: cell['question_count'] for cell in rollup_inventory(cells, ['set_id'])}
+    total_questions = sum(set_ids.values())
     
-    print(f"\nFound {len(set_ids)} unique set_id values across {len(data)} EduTest questions:")
+    print(f"\nFound {len(set_ids)} unique set_id values across {total_questions} EduTest questions:")
     
     for set_id, count in sorted(set_ids.items(), key=lambda x: x[1], reverse=True):
         print(f"  - '{set_id}': {count} questions")
@@ -51,15 +44,8 @@ try:
     # Get distribution by test_section for a sample set_id
     if 'raw' in set_ids and set_ids['raw'] > 0:
         print("\nBreakdown of 'raw' set_id by test_section:")
-        response = requests.get(endpoint, headers=headers, 
-                              params={"select": "test_section", "test_type": "eq.EduTest", "set_id": "eq.raw"})
-        response.raise_for_status()
-        raw_data = response.json()
-        
-        sections = {}
-        for item in raw_data:
-            section = item.get('test_section')
-            sections[section] = sections.get(section, 0) + 1
+        raw_cells = [cell for cell in cells if cell['set_id'] == 'raw']
+        sections = {cell['test_section']: cell['question_count'] for cell in rollup_inventory(raw_cells, ['test_section'])}
         
         for section, count in sorted(sections.items(), key=lambda x: x[1], reverse=True):
             print(f"  - {section}: {count} questions")
@@ -0,0 +1,1565 @@
+#!/usr/bin/env python3
+"""
+Shared question generation engine for all exam generators.
+
+Each exam is described by a declarative JSON config in configs/ (taxonomy,
+prompt details, year level and per-cell targets). The engine can run any set of
+exams from a single process: they share one OpenAI connection pool, one response
+cache, one rate-limit budget and one bulk inserter, and their API calls are
+interleaved so the quota is used evenly instead of exams competing for it.
+
+Questions are generated concurrently. The number of in-flight requests is capped
+by --concurrency and the overall request rate by a requests/tokens-per-minute
+token bucket (--rpm / --tpm). Each API call asks for --questions-per-call
+distinct questions as a JSON array. Uploads are buffered and sent to Supabase as
+bulk inserts of --batch-size rows. Completions are cached on disk (--cache-path),
+so rerunning after a crash or a parser change does not pay for them again.
+
+Only the questions the table is short of are generated: the current counts
+per cell are read from the inventory view and compared with the exam's quotas
+(see utils/generation_planner.py). --fixed-plan generates the full quota of every
+cell instead, and --plan-only prints the plan without generating.
+
+Every uploaded question is recorded in a checkpoint journal keyed by
+(test_type, section, sub_skill, difficulty, ordinal). After an interruption,
+rerun with --resume to skip the slots that are already in the database.
+
+For overnight runs, --batch plan|submit|collect|run uses the OpenAI Batch API:
+the work plan is written as a JSONL request file (--batch-file), submitted and
+polled, and the results file is streamed back through the same parsing,
+validation, checkpointing and bulk upload as live runs.
+
+With --stream, completions are streamed and checked while they arrive. A
+response that already violates the schema (wrong section or sub-skill, invalid
+questions, prose instead of JSON, runaway length) is cancelled at once and the
+call is retried, so no completion tokens are spent on output that would be discarded.
+
+Questions with a diagram_spec are rendered to an image before upload (see
+utils/diagram_renderer.py) in a process pool, and image_url points at the asset.
+Identical specs are rendered once. --no-diagrams turns this off.
+
+Answer keys in the sections an exam lists under answer_check_sections are
+recomputed locally before upload (utils/answer_check.py). Questions whose key
+is contradicted are dropped. With --resolve-undecided, the ones no local check
+can decide are solved again by the model and dropped if it disagrees.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import openai
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.rate_limiter import RateLimiter, estimate_tokens
+from utils.supabase_helpers import (BulkInserter, prepare_question_row, fetch_inventory, get_client, in_filter,
+                                    DEFAULT_BATCH_SIZE)
+from utils.generation_planner import (stock_by_cell, plan_deficits, deficit_work_items, highest_ordinals,
+                                      summarise)
+from utils.openai_helpers import chat_completion, stream_chat_completion
+from utils.prompt_templates import PromptTemplate
+from utils.diagram_renderer import DiagramRenderer, DEFAULT_ASSET_DIR, DEFAULT_BASE_URL
+from utils.passages import PassageStore, parse_passage, group_passage_slots, match_slots
+from utils.answer_check import AnswerChecker, VERIFIED, WRONG, answer_key, answers_agree
+from utils.llm_cache import ResponseCache, DEFAULT_CACHE_PATH, DEFAULT_MAX_BYTES, cache_key
+from utils.checkpoint import CheckpointJournal, default_journal_path
+from utils import batch_jobs
+from utils.question_schema import RejectionStats, StreamAborted, StreamGuard, validate_questions
+from utils.dedup_index import load_index, DEFAULT_THRESHOLD
+from utils.metrics import REGISTRY, METRICS_DIR
+from utils.resilience import (AdaptiveConcurrency, CallsStopped, CircuitBreaker, RetryController, RetryPolicy,
+                              classify_error, QUOTA)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs")
+BATCH_DIR = os.path.join(REPO_ROOT, "batches")
+
+# Load environment variables
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+openai.api_key = OPENAI_API_KEY
+# Retries are handled by RetryController so they can adapt concurrency and trip the circuit breaker
+openai.max_retries = 0
+
+# Supabase details
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+SUPABASE_TABLE = "educoach_questions"
+
+# Validation outcomes for the current run, by rejection reason and sub-skill
+REJECTIONS = RejectionStats()
+
+# Generation settings
+MODEL = "gpt-4o"
+DEFAULT_QUESTIONS_PER_CALL = 5
+DEFAULT_CONCURRENCY = 8
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_TOKENS_PER_MINUTE = 30000
+# Completion budget reserved per question when checking the tokens-per-minute limit
+EXPECTED_COMPLETION_TOKENS = 700
+# Retry policy for generation calls
+MAX_ATTEMPTS = 6
+RETRY_BASE_DELAY = 2.0  # seconds
+RETRY_MAX_DELAY = 60.0  # seconds
+# Consecutive throttled/transient failures that pause all generation calls, and for how long
+BREAKER_FAILURE_THRESHOLD = 10
+BREAKER_RESET_TIMEOUT = 30.0  # seconds
+# Streamed calls cancelled by the stream guard that are retried at once before giving up on a batch
+MAX_STREAM_ABORTS = 2
+# set_id given to near-duplicates kept with --duplicates flag, so set structuring never picks them
+DUPLICATE_SET_ID = "near-duplicate"
+# Collected batch questions whose answers are checked and diagrams rendered together before upload
+COLLECT_WINDOW = 200
+# Completion budget reserved for re-solving one question with --resolve-undecided
+RESOLVE_COMPLETION_TOKENS = 50
+# Completion budget reserved for one reading passage
+EXPECTED_PASSAGE_TOKENS = 900
+# sub_skill label of passage calls, whose questions span several sub-skills
+PASSAGE_LABEL = "passage"
+
+# Run metrics, labelled by test_type, section, sub_skill and difficulty
+GENERATION_SECONDS = REGISTRY.histogram("educoach_generation_call_seconds",
+                                        "Latency of one generation call, including cache lookups")
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram("educoach_rate_limit_wait_seconds",
+                                             "Time spent waiting for the requests/tokens-per-minute budget")
+PROMPT_TOKENS = REGISTRY.counter("educoach_prompt_tokens_total", "Prompt tokens used by generation calls")
+COMPLETION_TOKENS = REGISTRY.counter("educoach_completion_tokens_total",
+                                     "Completion tokens used by generation calls")
+GENERATION_CALLS = REGISTRY.counter("educoach_generation_calls_total",
+                                    "Generation calls by source (api, cache, batch or error)")
+LLM_RETRIES = REGISTRY.counter("educoach_llm_retries_total", "Generation calls retried, by error class")
+PARSE_FAILURES = REGISTRY.counter("educoach_parse_failures_total",
+                                  "Generation responses that contained no valid question")
+QUESTIONS_GENERATED = REGISTRY.counter("educoach_questions_generated_total", "Questions that passed validation")
+QUESTIONS_REJECTED = REGISTRY.counter("educoach_questions_rejected_total",
+                                      "Requested questions missing or rejected by validation")
+QUESTIONS_QUEUED = REGISTRY.counter("educoach_questions_queued_total", "Questions queued for upload")
+UPLOAD_FAILURES = REGISTRY.counter("educoach_upload_failures_total", "Questions that could not be uploaded")
+NEAR_DUPLICATES = REGISTRY.counter("educoach_near_duplicates_total", "Near-duplicate questions dropped or flagged")
+CACHED_PROMPT_TOKENS = REGISTRY.counter("educoach_cached_prompt_tokens_total",
+                                       "Prompt tokens served from the provider's prompt cache")
+TEMPLATE_TOKENS = REGISTRY.counter("educoach_prompt_template_tokens_total",
+                                   "Prompt tokens sent per template, by part (static prefix or per-call suffix)")
+STREAM_ABORTS = REGISTRY.counter("educoach_stream_aborts_total",
+                                 "Streamed generation calls cancelled early, by rejection reason")
+WRONG_ANSWERS = REGISTRY.counter("educoach_wrong_answer_keys_total",
+                                 "Questions dropped because their answer key failed a check, by check")
+PASSAGES_GENERATED = REGISTRY.counter("educoach_passages_total",
+                                      "Reading passages generated, by outcome (stored or rejected)")
+ANSWER_RESOLVES = REGISTRY.counter("educoach_answer_resolves_total",
+                                   "Undecided answer keys re-solved by the model, by outcome")
+
+# Answer to one question, asked without the key for --resolve-undecided
+RESOLVE_PROMPT = ("Solve the following question. Reply with only the final answer, "
+                  "copied exactly from the options if there are any. Do not explain.")
+
+REQUIRED_CONFIG_KEYS = (
+    "name", "test_type", "exam_name", "year_level", "student_description",
+    "difficulty_calibration", "visual_sub_skills", "passage_sections",
+    "difficulties", "questions_per_difficulty", "structure",
+)
+
+
+def available_exams():
+    """Names of all exam configs in configs/"""
+    return sorted(name[:-len(".json")] for name in os.listdir(CONFIG_DIR) if name.endswith(".json"))
+
+
+def load_exam_config(name):
+    """Load and check an exam config by name (e.g. "edutest")"""
+    path = os.path.join(CONFIG_DIR, f"{name}.json")
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    missing = [key for key in REQUIRED_CONFIG_KEYS if key not in config]
+    if missing:
+        raise ValueError(f"Exam config {path} is missing: {', '.join(missing)}")
+    config.setdefault("answer_check_sections", [])
+    return config
+
+
+# Per-call part of every prompt; kept at the end so the system prefix is identical across calls
+REQUEST_SUFFIX = """📋 Request:
+- Section: {section}
+- Sub-skill: {sub_skill}
+- Difficulty: {difficulty} (1 = very easy, 5 = very hard)
+
+{output_format}"""
+
+# Per-call part of a request for a reading passage
+PASSAGE_SUFFIX = """📋 Request:
+- Section: {section}
+- Difficulty: {difficulty} (1 = very easy, 5 = very hard)
+- The questions about it will assess: {sub_skills}
+
+Return a single JSON object for one passage."""
+
+# Per-call part of a request for questions about a stored passage; shares the exam's question prefix
+PASSAGE_QUESTIONS_SUFFIX = """📋 Request:
+- Section: {section}
+- Difficulty: {difficulty} (1 = very easy, 5 = very hard)
+
+Passage ("{title}"):
+{passage}
+
+Write one question about this passage for each line below, assessing the sub-skill it names, and set the question's sub_skill to that sub-skill:
+{sub_skill_list}
+
+{output_format}"""
+
+# Compiled prompt templates by name: the exam name for questions, "<exam>/passage" and
+# "<exam>/passage_questions" for passage sections
+PROMPT_TEMPLATES = {}
+
+
+def example_question(exam):
+    """
+    A complete question in the output format, for the static prompt prefix. It is an
+    arithmetic item from the exam's first answer-checked section, so it is correct by construction.
+    """
+    section = (exam["answer_check_sections"] or list(exam["structure"]))[0]
+    example = {
+        "question_id": "",
+        "test_type": exam["test_type"],
+        "year_level": exam["year_level"],
+        "test_section": section,
+        "sub_skill": exam["structure"][section][0],
+        "difficulty": 2,
+        "question_type": "Multiple Choice",
+        "input_type": "Text",
+        "question": "A school orders 6 boxes of 24 pencils and hands out 95 of them. How many pencils are left?",
+        "options": ["39", "49", "59", "144"],
+        "correct_answer": "49",
+        "explanation": "The school orders 6 × 24 = 144 pencils. After handing out 95, 144 − 95 = 49 pencils are "
+                       "left. 59 comes from a subtraction error and 144 ignores the pencils handed out.",
+        "source_url": "custom-generated",
+        "linked_passage_id": "",
+        "diagram_spec": {},
+        "image_url": "",
+    }
+    return json.dumps(example, indent=2, ensure_ascii=False)
+
+
+def compile_prompt_template(exam):
+    """
+    Render an exam's static instructions once into a PromptTemplate.
+    Only the section, sub-skill, difficulty and question count vary per call,
+    and they go in a short suffix after the shared system prefix. Everything that
+    is the same for every call to the exam (the section catalogue, field rules and a
+    worked example) belongs in the prefix, which OpenAI only caches from 1024 tokens.
+    """
+    visual_examples = ", ".join(exam["visual_sub_skills"])
+    passage_sections = " or ".join(f"**{name}**" for name in exam["passage_sections"])
+    calibration = exam["difficulty_calibration"]
+    catalogue = "\n".join(f"- {section}: {', '.join(sub_skills)}" for section, sub_skills in exam["structure"].items())
+
+    prefix = f"""You are a test design expert working for EduCourse, an Australian learning platform that creates high-quality practice questions for selective school and scholarship tests.
+
+🎯 Your task:
+Generate high-quality test questions for the **{exam["exam_name"]}**. Each request gives the section, sub-skill, difficulty and number of questions. Your response will be used in a live student testing platform and must be returned as strict JSON for automatic database ingestion.
+
+---
+
+📋 Exam Parameters:
+- Test Type: {exam["test_type"]}
+- Year Level: {exam["year_level"]}
+
+---
+
+🧠 Guidelines:
+- Each question must assess the **exact sub-skill given in the request** — do not generalize.
+- Use an academic tone appropriate for {exam["student_description"]}.
+- All spelling must follow UK/Australian English.
+- Include **detailed reasoning** in the explanation.
+- If question_type is Multiple Choice, ensure distractors are plausible and reflect common student misconceptions.
+- If the sub-skill requires visual logic or layout (e.g. {visual_examples}), include a `diagram_spec` field.
+  It is rendered automatically, so it must be a JSON scene, not a description: {{"width": 300, "height": 300, "shapes": [...]}}.
+  Shapes use SVG coordinates and are one of {{"type": "rect", "x", "y", "width", "height"}}, {{"type": "circle", "cx", "cy", "r"}},
+  {{"type": "ellipse", "cx", "cy", "rx", "ry"}}, {{"type": "line", "x1", "y1", "x2", "y2"}}, {{"type": "polygon" | "polyline", "points": [[x, y], ...]}}
+  or {{"type": "text", "x", "y", "text"}}, each with optional "fill", "stroke", "stroke_width" and "transform".
+- If the section is {passage_sections}, the request includes a reading passage: every question must be answerable from that passage alone and must not restate it.
+- When several questions are requested, each must be distinct: vary the context, numbers and wording, and the position of the correct answer. Never repeat a question stem.
+
+---
+
+📚 Sections and sub-skills of the {exam["exam_name"]}:
+{catalogue}
+
+Requests always name one of these sections and sub-skills. Copy them exactly, including capitalisation, into test_section and sub_skill.
+
+---
+
+🧾 Output Requirements (JSON only):
+Each question is a JSON object in the following format:
+
+```json
+{{
+  "question_id": "",  // leave blank — we will auto-generate
+  "test_type": "{exam["test_type"]}",
+  "year_level": "{exam["year_level"]}",
+  "test_section": "",  // the section from the request
+  "sub_skill": "",     // the sub-skill from the request
+  "difficulty": 0,     // the difficulty from the request
+  "question_type": "Multiple Choice" | "Short Answer" | "Written Prompt",
+  "input_type": "Text" | "Image + Text" | "Diagram" | "Numeric Entry",
+  "question": "",
+  "options": ["", "", "", ""],  // Optional, only for MCQ
+  "correct_answer": "",
+  "explanation": "",
+  "source_url": "custom-generated",
+  "linked_passage_id": "",  // leave blank — set from the request's passage ({" / ".join(exam["passage_sections"])})
+  "diagram_spec": {{}},        // Only for visual sub-skills: the JSON scene described above
+  "image_url": ""            // Optional – only if referencing a known asset
+}}
+```
+⛔ Do not include any explanations, commentary, or Markdown formatting outside the JSON. Only return the JSON block.
+
+🔎 Field rules:
+- question: the full stem a student reads, self-contained apart from the passage or diagram it refers to. Do not number it or prefix it with "Question".
+- question_type: "Multiple Choice" for items with four options, "Short Answer" for a single word or number, "Written Prompt" for writing tasks.
+- input_type: "Text" unless the question needs a `diagram_spec` ("Diagram" or "Image + Text") or a typed number ("Numeric Entry").
+- options: exactly four distinct options for Multiple Choice, without letters such as "A)". Omit for other question types.
+- correct_answer: the exact text of the correct option for Multiple Choice, the expected answer for Short Answer, and "" for a Written Prompt.
+- explanation: the worked solution step by step, then why the most tempting wrong options are wrong. For a Written Prompt, give the marking criteria instead.
+- Numbers in questions, options and explanations must be exact; every calculation in the explanation must be correct.
+
+✅ Example of one complete question (it shows the format only; take the section, sub-skill and difficulty from the request):
+
+```json
+{example_question(exam)}
+```
+
+🧩 Difficulty calibration:
+Level 1: {calibration["1"]}
+Level 3: {calibration["3"]}
+Level 5: {calibration["5"]}
+Levels 2 and 4 sit between their neighbours.
+"""
+    return PromptTemplate(exam["name"], prefix, REQUEST_SUFFIX, model=MODEL)
+
+
+def compile_passage_template(exam):
+    """
+    Render the static instructions for writing one reading passage. The
+    questions about it are asked for separately, with the exam's question prefix.
+    """
+    calibration = exam["difficulty_calibration"]
+
+    prefix = f"""You are a test design expert working for EduCourse, an Australian learning platform that creates high-quality practice questions for selective school and scholarship tests.
+
+🎯 Your task:
+Write an original reading passage for the **{exam["exam_name"]}**. Several comprehension questions will be written about it afterwards, one for each sub-skill given in the request, so the passage must give each of them enough material. Each request gives the section, difficulty and sub-skills.
+
+---
+
+📋 Exam Parameters:
+- Test Type: {exam["test_type"]}
+- Year Level: {exam["year_level"]}
+
+---
+
+🧠 Guidelines:
+- Write for {exam["student_description"]}; the topic, vocabulary and sentence length must suit the difficulty.
+- All spelling must follow UK/Australian English.
+- Choose a text type that suits the sub-skills: narrative, informative, persuasive, procedural, a letter or a poem.
+- Length: 200-300 words at difficulty 1 or 2, 300-450 words at difficulty 3, 450-600 words at difficulty 4 or 5.
+- The passage must be original; never reproduce or paraphrase a published text.
+- Include what the sub-skills need: a clear main idea, details that support inference, words whose meaning follows from context, a recognisable purpose and tone.
+- Do not write any questions.
+
+---
+
+🧾 Output Requirements (JSON only):
+
+```json
+{{
+  "title": "",
+  "text_type": "",  // e.g. narrative, informative, persuasive
+  "passage": ""     // paragraphs separated by \\n\\n
+}}
+```
+⛔ Do not include any explanations, commentary, or Markdown formatting outside the JSON. Only return the JSON block.
+
+🧩 Difficulty calibration:
+Level 1: {calibration["1"]}
+Level 3: {calibration["3"]}
+Level 5: {calibration["5"]}
+"""
+    return PromptTemplate(f"{exam['name']}/passage", prefix, PASSAGE_SUFFIX, model=MODEL)
+
+
+def compile_passage_questions_template(exam):
+    """Questions about a given passage: the exam's question prefix with a passage request suffix"""
+    return PromptTemplate(f"{exam['name']}/passage_questions", prompt_template(exam).prefix,
+                          PASSAGE_QUESTIONS_SUFFIX, model=MODEL)
+
+
+TEMPLATE_COMPILERS = {
+    "": compile_prompt_template,
+    "/passage": compile_passage_template,
+    "/passage_questions": compile_passage_questions_template,
+}
+
+
+def prompt_template(exam, kind=""):
+    """The compiled template of `kind` ("", "/passage" or "/passage_questions") for an exam, built on first use"""
+    name = exam["name"] + kind
+    template = PROMPT_TEMPLATES.get(name)
+    if template is None:
+        template = PROMPT_TEMPLATES[name] = TEMPLATE_COMPILERS[kind](exam)
+    return template
+
+
+def request_values(section, sub_skill, difficulty, count=1):
+    """Values for the per-call suffix of a prompt template"""
+    if count == 1:
+        output_format = "Return a single JSON object for one question."
+    else:
+        output_format = f"Return a JSON array of exactly {count} objects, one per distinct question."
+    return {"section": section, "sub_skill": sub_skill, "difficulty": difficulty, "output_format": output_format}
+
+
+def passage_request_values(section, difficulty, sub_skills):
+    """Values for the suffix of a passage request; `sub_skills` are those of the questions to follow"""
+    return {"section": section, "difficulty": difficulty, "sub_skills": ", ".join(dict.fromkeys(sub_skills))}
+
+
+def passage_questions_values(section, difficulty, passage, sub_skills):
+    """Values for the suffix of a request for one question per entry of `sub_skills` about `passage`"""
+    values = request_values(section, None, difficulty, len(sub_skills))
+    values.update({
+        "title": passage["title"],
+        "passage": passage["passage"],
+        "sub_skill_list": "\n".join(f"- Question {number}: {sub_skill}"
+                                    for number, sub_skill in enumerate(sub_skills, 1)),
+    })
+    return values
+
+
+def build_messages(exam, section, sub_skill, difficulty, count=1):
+    """Chat messages for one generation call (shared by the live and batch paths)"""
+    return prompt_template(exam).messages(**request_values(section, sub_skill, difficulty, count))
+
+
+def validation_context(exam, section, sub_skill, sub_skills=None):
+    """
+    What a response for this cell is checked against. Questions about a shared
+    passage may each name any of the requested `sub_skills`; their passage id is
+    set after validation, so the model is not asked for one.
+    """
+    if sub_skills:
+        return {"test_section": section, "sub_skills": list(sub_skills), "requires_passage": False}
+    return {
+        "test_section": section,
+        "sub_skill": sub_skill,
+        "requires_passage": section in exam["passage_sections"],
+    }
+
+
+def questions_from_content(exam, content, section, sub_skill, difficulty, count=1, sub_skills=None, passage_id=None):
+    """
+    Parse a model response into validated question rows.
+    Invalid elements are dropped (and counted in REJECTIONS); the rest are returned.
+    For questions about a shared passage, `sub_skill` is None, each question keeps the
+    one of `sub_skills` it names, and `passage_id` is linked.
+    """
+    context = validation_context(exam, section, sub_skill, sub_skills)
+    questions = validate_questions(content, context, count, REJECTIONS)
+    if not questions:
+        print(f"ERROR: No valid questions in response for {sub_skill or section} (difficulty {difficulty})")
+        print(f"Response content: {content[:500]}")
+
+    for question_data in questions:
+        # Add additional fields
+        question_data.update({
+            "test_type": exam["test_type"],
+            "year_level": exam["year_level"],
+            "test_section": section,
+            "sub_skill": sub_skill or question_data["sub_skill"],
+            "difficulty": difficulty,
+            "set_id": "raw",
+            "source_url": "custom-generated",
+            "correct_answer_source": "GPT-4"
+        })
+        if passage_id is not None:
+            question_data["linked_passage_id"] = passage_id
+
+    labels = metric_labels(exam, section, sub_skill or PASSAGE_LABEL, difficulty)
+    QUESTIONS_GENERATED.inc(len(questions), **labels)
+    QUESTIONS_REJECTED.inc(count - len(questions), **labels)
+    if not questions:
+        PARSE_FAILURES.inc(**labels)
+
+    return questions
+
+
+def metric_labels(exam, section, sub_skill, difficulty):
+    return {"test_type": exam["test_type"], "section": section, "sub_skill": sub_skill, "difficulty": difficulty}
+
+
+def record_usage(labels, usage):
+    """Add a response's token usage to the run metrics"""
+    PROMPT_TOKENS.inc(usage.get("prompt_tokens", 0), **labels)
+    COMPLETION_TOKENS.inc(usage.get("completion_tokens", 0), **labels)
+    # Live calls report cached_tokens directly; Batch API results keep OpenAI's nested usage details
+    cached = usage.get("cached_tokens")
+    if cached is None:
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    CACHED_PROMPT_TOKENS.inc(cached, **labels)
+
+
+def count_template_call(template, values):
+    """Count the prefix and suffix tokens of one call sent to the API"""
+    suffix_tokens = template.record_call(**values)
+    TEMPLATE_TOKENS.inc(template.prefix_tokens, template=template.name, part="prefix")
+    TEMPLATE_TOKENS.inc(suffix_tokens, template=template.name, part="suffix")
+
+
+def record_template_call(exam, section, sub_skill, difficulty, count=1):
+    """Count the tokens of one question call sent to the API"""
+    count_template_call(prompt_template(exam), request_values(section, sub_skill, difficulty, count))
+
+
+def complete(template, values, labels, description, sample_index=0, cache=None, guard=None):
+    """
+    One completion of a prompt template, with metrics. Returns the content.
+
+    With `guard` (a function returning a fresh StreamGuard), the completion is
+    streamed, checked as it arrives and cancelled as soon as it violates the
+    schema, raising StreamAborted; see run_streamed for repeating it.
+    API errors are raised so the caller can classify and retry them.
+    """
+    messages = template.messages(**values)
+    start = time.perf_counter()
+    try:
+        if guard is not None:
+            response = stream_chat_completion(messages, model=MODEL, cache=cache, sample_index=sample_index,
+                                              guard=guard())
+        else:
+            response = chat_completion(messages, model=MODEL, cache=cache, sample_index=sample_index)
+    except StreamAborted as e:
+        GENERATION_SECONDS.observe(time.perf_counter() - start, **labels)
+        GENERATION_CALLS.inc(source="aborted", **labels)
+        STREAM_ABORTS.inc(reason=e.reason, **labels)
+        record_usage(labels, e.usage)
+        count_template_call(template, values)
+        print(f"  {description}: stream aborted after {len(e.content)} characters ({e.reason})")
+        raise
+    except Exception:
+        GENERATION_SECONDS.observe(time.perf_counter() - start, **labels)
+        GENERATION_CALLS.inc(source="error", **labels)
+        raise
+
+    GENERATION_SECONDS.observe(time.perf_counter() - start, **labels)
+    GENERATION_CALLS.inc(source="cache" if response["cached"] else "api", **labels)
+    if not response["cached"]:
+        record_usage(labels, response["usage"])
+        count_template_call(template, values)
+    return response["content"]
+
+
+def discard_cached(cache, template, values, sample_index=0):
+    """
+    Forget a cached completion that yielded nothing usable, so the slot is asked
+    again on --resume instead of replaying the same failure.
+    """
+    if cache is not None:
+        cache.delete(cache_key(MODEL, template.messages(**values), {}, sample_index))
+
+
+def reject_aborted(labels, sub_skill, count, reason):
+    """Count the questions of a call whose streamed completion was cancelled every time"""
+    REJECTIONS.reject(f"aborted_{reason}", sub_skill, count)
+    QUESTIONS_REJECTED.inc(count, **labels)
+    PARSE_FAILURES.inc(**labels)
+
+
+async def run_streamed(controller, labels, sub_skill, count, func, *args, before_attempt=None):
+    """
+    Run a question call through `controller`, repeating it up to MAX_STREAM_ABORTS
+    times when its stream is cancelled. Every repeat is a new controller run, so it
+    waits for its own rate-limit budget. Returns [] if every stream was cancelled.
+    """
+    for _ in range(MAX_STREAM_ABORTS + 1):
+        try:
+            return await controller.run(func, *args, before_attempt=before_attempt)
+        except StreamAborted as e:
+            reason = e.reason
+    reject_aborted(labels, sub_skill, count, reason)
+    return []
+
+
+def generate_questions(exam, section, sub_skill, difficulty, count=1, sample_index=0, cache=None, stream=False):
+    """
+    Generate up to `count` questions in one OpenAI GPT-4o call.
+    Each returned element is validated on its own; invalid ones are dropped and the
+    rest are returned. `sample_index` identifies the batch so reruns are served from `cache`.
+    API errors are raised so the caller can classify and retry them.
+
+    With `stream`, the completion is checked as it arrives and cancelled as soon as
+    it violates the schema, raising StreamAborted (see run_streamed).
+    """
+    labels = metric_labels(exam, section, sub_skill, difficulty)
+    template, values = prompt_template(exam), request_values(section, sub_skill, difficulty, count)
+    guard = (lambda: StreamGuard(validation_context(exam, section, sub_skill), count)) if stream else None
+    content = complete(template, values, labels, f"{exam['test_type']} {sub_skill} (difficulty {difficulty})",
+                       sample_index, cache, guard)
+    questions = questions_from_content(exam, content, section, sub_skill, difficulty, count)
+    if not questions:
+        discard_cached(cache, template, values, sample_index)
+    return questions
+
+
+def generate_passage(exam, section, difficulty, sub_skills, sample_index=0, cache=None, passages=None):
+    """
+    Generate one reading passage that questions on `sub_skills` can be asked
+    about, and store it with `passages` (a PassageStore) before any question
+    links to it. Returns the passage with its id, or None if the response is not a usable passage.
+    """
+    labels = metric_labels(exam, section, PASSAGE_LABEL, difficulty)
+    template, values = prompt_template(exam, "/passage"), passage_request_values(section, difficulty, sub_skills)
+    content = complete(template, values, labels, f"{exam['test_type']} {section} passage (difficulty {difficulty})",
+                       sample_index, cache)
+    passage, reason = parse_passage(content)
+    if passage is None:
+        discard_cached(cache, template, values, sample_index)
+        REJECTIONS.reject(f"passage_{reason}", PASSAGE_LABEL)
+        PASSAGES_GENERATED.inc(outcome="rejected", **labels)
+        print(f"ERROR: No usable passage in response for {section} (difficulty {difficulty}): {reason}")
+        return None
+    passage["id"] = passages.add(passage, test_type=exam["test_type"], year_level=exam["year_level"],
+                                 test_section=section, difficulty=difficulty)
+    PASSAGES_GENERATED.inc(outcome="stored", **labels)
+    return passage
+
+
+def generate_passage_questions(exam, passage, slots, cache=None, stream=False):
+    """
+    Generate one question per slot about a stored `passage` in a single call.
+    Slots may differ in sub-skill; each question names the sub-skill it assesses
+    and is linked to the passage. Other arguments are as for generate_questions.
+    """
+    test_type, section, _, difficulty, first_ordinal = slots[0]
+    sub_skills = [slot[2] for slot in slots]
+    count = len(slots)
+    labels = metric_labels(exam, section, PASSAGE_LABEL, difficulty)
+    context = validation_context(exam, section, None, sub_skills)
+    guard = (lambda: StreamGuard(context, count)) if stream else None
+    template = prompt_template(exam, "/passage_questions")
+    values = passage_questions_values(section, difficulty, passage, sub_skills)
+    content = complete(template, values, labels, f"{test_type} {section} passage questions (difficulty {difficulty})",
+                       first_ordinal, cache, guard)
+    questions = questions_from_content(exam, content, section, None, difficulty, count,
+                                       sub_skills=sub_skills, passage_id=passage["id"])
+    if not questions:
+        discard_cached(cache, template, values, first_ordinal)
+    return questions
+
+
+def build_retry_controller(concurrency, stop=None):
+    """
+    Retry policy, AIMD concurrency limit and circuit breaker shared by all generation calls.
+    No call is started once `stop` is set.
+    """
+    def report_retry(kind, attempt, delay, error):
+        LLM_RETRIES.inc(kind=kind)
+        print(f"  OpenAI {kind} error ({str(error)[:120]}); retry {attempt} in {delay:.1f}s")
+
+    breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT, name="openai")
+    policy = RetryPolicy(MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, on_retry=report_retry)
+    return RetryController(policy, AdaptiveConcurrency(concurrency), breaker, stop)
+
+
+def screen_duplicates(exam, pairs, dedup, flag_duplicates=False):
+    """
+    Check new (slot, question) pairs against the near-duplicate index (which also
+    covers earlier questions from this run). Returns the pairs to upload:
+    duplicates are dropped, or kept under DUPLICATE_SET_ID when `flag_duplicates` is set.
+    Kept questions are reserved under their slot; see track_dedup_uploads.
+    """
+    pairs = list(pairs)
+    if dedup is None:
+        return pairs
+
+    kept = []
+    for slot, question_data in pairs:
+        match = dedup.reserve((exam["test_type"], question_data["sub_skill"]), question_data["question"], slot)
+        if match is None:
+            kept.append((slot, question_data))
+            continue
+        ref, similarity = match
+        NEAR_DUPLICATES.inc(action="flagged" if flag_duplicates else "rejected",
+                            **metric_labels(exam, question_data["test_section"], question_data["sub_skill"],
+                                            question_data["difficulty"]))
+        print(f"  Near-duplicate of {ref} ({similarity:.0%} similar): {question_data['question'][:80]}")
+        if flag_duplicates:
+            question_data["set_id"] = DUPLICATE_SET_ID
+            kept.append((slot, question_data))
+    return kept
+
+
+def track_dedup_uploads(dedup, on_success, on_failure):
+    """
+    Wrap BulkInserter callbacks so questions reserved by screen_duplicates join the
+    near-duplicate index once stored, and are released if their insert fails.
+    """
+    if dedup is None:
+        return on_success, on_failure
+
+    def inserted(tags):
+        dedup.confirm(tags)
+        on_success(tags)
+
+    def failed(failure):
+        dedup.release([failure["tag"]])
+        on_failure(failure)
+
+    return inserted, failed
+
+
+def build_dedup_index(exams, threshold=DEFAULT_THRESHOLD):
+    """Index the questions already stored for the selected exams, one partition per sub-skill"""
+    print("Loading existing questions into the near-duplicate index...")
+    index = load_index(filters={"test_type": in_filter(exam["test_type"] for exam in exams)}, threshold=threshold)
+    print(f"Indexed {len(index)} existing questions.")
+    return index
+
+
+def screen_answers(exam, questions, verdicts):
+    """
+    Apply local answer-check verdicts to `questions` (in order). Questions with a
+    contradicted key are dropped; verified ones are marked in correct_answer_source.
+    Returns (kept, undecided), where undecided is the subset of kept no check could decide.
+    """
+    kept, undecided = [], []
+    for question_data, (verdict, check) in zip(questions, verdicts):
+        if verdict == WRONG:
+            WRONG_ANSWERS.inc(check=check, **metric_labels(exam, question_data["test_section"],
+                                                           question_data["sub_skill"], question_data["difficulty"]))
+            print(f"  Wrong answer key ({check}): {question_data['question'][:80]}")
+            continue
+        if verdict == VERIFIED:
+            question_data["correct_answer_source"] = "GPT-4, checked locally"
+        else:
+            undecided.append(question_data)
+        kept.append(question_data)
+    return kept, undecided
+
+
+def check_answers(exam, questions, checker):
+    """
+    Check the answer keys of the questions in the exam's answer_check_sections.
+    Returns (questions without the dropped ones, undecided) as screen_answers.
+    """
+    checked = [question_data for question_data in questions
+               if question_data["test_section"] in exam["answer_check_sections"]]
+    if checker is None or not checked:
+        return questions, []
+    kept, undecided = screen_answers(exam, checked, checker.check(checked))
+    dropped = {id(question_data) for question_data in checked} - {id(question_data) for question_data in kept}
+    return [question_data for question_data in questions if id(question_data) not in dropped], undecided
+
+
+def resolve_messages(question_data):
+    lines = [question_data["question"]]
+    for letter, option in zip("ABCD", question_data.get("options") or []):
+        lines.append(f"{letter}) {option}")
+    return [{"role": "system", "content": RESOLVE_PROMPT}, {"role": "user", "content": "\n".join(lines)}]
+
+
+def resolve_answer(exam, question_data, cache=None):
+    """
+    The slow check: ask the model for the answer without showing it the key.
+    Returns True if the model's answer agrees with the key.
+    """
+    labels = metric_labels(exam, question_data["test_section"], question_data["sub_skill"],
+                           question_data["difficulty"])
+    response = chat_completion(resolve_messages(question_data), model=MODEL, cache=cache,
+                               temperature=0, max_tokens=RESOLVE_COMPLETION_TOKENS)
+    if not response["cached"]:
+        record_usage(labels, response["usage"])
+    answer = response["content"].strip()
+    agrees = answers_agree(answer, answer_key(question_data))
+    ANSWER_RESOLVES.inc(outcome="agreed" if agrees else "disagreed", **labels)
+    if agrees:
+        question_data["correct_answer_source"] = "GPT-4, re-solved"
+    else:
+        WRONG_ANSWERS.inc(check="resolved", **labels)
+        print(f"  Wrong answer key (model answered {answer[:40]!r}): {question_data['question'][:80]}")
+    return agrees
+
+
+def diagram_questions(questions):
+    """Questions with a diagram_spec and no image yet"""
+    return [question_data for question_data in questions
+            if question_data.get("diagram_spec") and not question_data.get("image_url")]
+
+
+def attach_diagrams_sync(renderer, questions):
+    """attach_diagrams for blocking code: the diagrams still render in parallel in the pool"""
+    pending = diagram_questions(questions)
+    for question_data, url in zip(pending, renderer.render_all(q["diagram_spec"] for q in pending)):
+        if url:
+            question_data["image_url"] = url
+
+
+async def attach_diagrams(renderer, questions):
+    """Render the diagrams of `questions` concurrently and set their image_url"""
+    pending = diagram_questions(questions)
+    urls = await asyncio.gather(*[renderer.render_async(question_data["diagram_spec"]) for question_data in pending])
+    for question_data, url in zip(pending, urls):
+        if url:
+            question_data["image_url"] = url
+
+
+def upload_to_supabase(question_data, inserter, tag=None):
+    """Queue a question for bulk insertion into Supabase"""
+    try:
+        row = prepare_question_row(question_data)
+        inserter.add(row, tag)
+        QUESTIONS_QUEUED.inc(test_type=question_data.get("test_type"), section=question_data.get("test_section"),
+                             sub_skill=question_data.get("sub_skill"), difficulty=question_data.get("difficulty"))
+        return True
+    except Exception as e:
+        print("ERROR: Failed to queue question for upload")
+        print(f"Error: {str(e)}")
+        return False
+
+
+def report_inserted(tags):
+    """BulkInserter callback: a batch of questions was written"""
+    print(f"  Inserted batch of {len(tags)} questions ✅")
+
+
+def report_failed(failure):
+    """BulkInserter callback: a single question was rejected"""
+    test_type, section, sub_skill, difficulty, ordinal = failure["tag"]
+    UPLOAD_FAILURES.inc(test_type=test_type, section=section, sub_skill=sub_skill, difficulty=difficulty,
+                        status=failure["status"] or "error")
+    print(f"  Failed to upload: {test_type} {sub_skill} (difficulty {difficulty}, question {ordinal}) "
+          f"- status {failure['status']}: {str(failure['error'])[:200]}")
+
+
+def build_work_items(exam):
+    """List every (test_type, section, sub_skill, difficulty, ordinal) slot to generate for an exam"""
+    return [
+        (exam["test_type"], section, sub_skill, difficulty, ordinal)
+        for section, sub_skills in exam["structure"].items()
+        for sub_skill in sub_skills
+        for difficulty in exam["difficulties"]
+        for ordinal in range(1, exam["questions_per_difficulty"] + 1)
+    ]
+
+
+def group_into_calls(work_items, questions_per_call):
+    """
+    Group slots into per-call batches. A batch holds up to `questions_per_call`
+    slots that share the same test type, section, sub-skill and difficulty.
+    """
+    batches = []
+    for slot in work_items:
+        if (batches and len(batches[-1]) < questions_per_call
+                and batches[-1][-1][:4] == slot[:4]):
+            batches[-1].append(slot)
+        else:
+            batches.append([slot])
+    return batches
+
+
+def interleave(batches_by_exam):
+    """Round-robin the per-exam call lists so every exam makes progress at the same rate"""
+    queues = [list(batches) for batches in batches_by_exam]
+    interleaved = []
+    index = 0
+    while any(queues):
+        for queue in queues:
+            if index < len(queue):
+                interleaved.append(queue[index])
+        index += 1
+        queues = [queue for queue in queues if index < len(queue)]
+    return interleaved
+
+
+def fetch_stock(exams):
+    """Current question counts per cell for the selected exams, from the inventory view"""
+    inventory = fetch_inventory(filters={"test_type": in_filter(exam["test_type"] for exam in exams)})
+    return stock_by_cell(inventory, unusable_set_ids=(DUPLICATE_SET_ID,))
+
+
+def print_plan(exams, stock, verbose=False):
+    """Summarise what the inventory-driven plan will generate, per exam (and per short cell if `verbose`)"""
+    for exam in exams:
+        deficits = plan_deficits(exam, stock)
+        summary = summarise(deficits)
+        print(f"{exam['test_type']}: {summary['free']} free and {summary['placed']} placed questions; "
+              f"{summary['short_cells']}/{summary['cells']} cells short by {summary['missing']} questions")
+        if verbose:
+            for deficit in deficits:
+                if deficit.missing:
+                    _, section, sub_skill, difficulty = deficit.cell
+                    print(f"  {section} / {sub_skill} / difficulty {difficulty}: {deficit.stock.free} free, "
+                          f"{deficit.stock.placed} placed, target {deficit.target} -> {deficit.missing} to generate")
+
+
+def group_passage_calls(exam, work_items):
+    """
+    Group the slots of an exam's passage sections into one call per shared passage.
+    A passage gets `questions_per_passage` questions (from the config), by default
+    one per sub-skill of its section.
+    """
+    batches = []
+    for section in exam["passage_sections"]:
+        per_passage = exam.get("questions_per_passage") or len(exam["structure"].get(section, ())) or 1
+        batches.extend(group_passage_slots([slot for slot in work_items if slot[1] == section], per_passage))
+    return batches
+
+
+def plan_calls(exams, journal=None, questions_per_call=DEFAULT_QUESTIONS_PER_CALL, stock=None, passages=True):
+    """
+    Build the interleaved list of API calls for all exams, skipping slots in `journal`.
+    With `stock` (from fetch_stock), only the cells short of their quota are planned,
+    under ordinals past every stored and journaled one; without it, every cell gets its full quota. Slots of passage sections are grouped
+    per shared passage, or left out of the plan if `passages` is False.
+    Returns (calls, number of questions).
+    """
+    batches_by_exam = []
+    total = 0
+    used_ordinals = highest_ordinals(journal.completed) if journal is not None else None
+    for exam in exams:
+        if stock is None:
+            work_items = build_work_items(exam)
+        else:
+            work_items = deficit_work_items(plan_deficits(exam, stock), used_ordinals)
+        if journal is not None:
+            work_items = [slot for slot in work_items if slot not in journal]
+        passage_items = [slot for slot in work_items if slot[1] in exam["passage_sections"]]
+        work_items = [slot for slot in work_items if slot[1] not in exam["passage_sections"]]
+        batches = group_into_calls(work_items, questions_per_call)
+        if passages:
+            batches.extend(group_passage_calls(exam, passage_items))
+            work_items += passage_items
+        total += len(work_items)
+        batches_by_exam.append(batches)
+    return interleave(batches_by_exam), total
+
+
+async def generate_and_upload(exam, slots, limiter, controller, inserter, cache=None,
+                              dedup=None, flag_duplicates=False, stop=None, stream=False, renderer=None,
+                              checker=None, resolve_undecided=False, passages=None):
+    """
+    Generate and upload the questions for a batch of slots with one API call,
+    respecting the concurrency and rate limits. Throttled and transient errors
+    are retried by `controller`; a quota error sets `stop` so no new calls start.
+    A batch of a passage section takes two calls: a passage is generated and
+    stored with `passages` (a PassageStore), then all its questions are asked together.
+    Answer keys are checked with `checker` before upload; with `resolve_undecided`
+    the questions it cannot decide are re-solved by the model.
+    """
+    if stop is not None and stop.is_set():
+        return 0
+    test_type, section, sub_skill, difficulty, first_ordinal = slots[0]
+    count = len(slots)
+    passage_batch = section in exam["passage_sections"]
+    if passage_batch:
+        label = f"{test_type} {section} passage (difficulty {difficulty}, {count} questions)"
+    else:
+        label = (f"{test_type} {sub_skill} (difficulty {difficulty}, questions "
+                 f"{first_ordinal}-{slots[-1][4]}/{exam['questions_per_difficulty']})")
+
+    async def acquire(tokens):
+        wait_start = time.perf_counter()
+        await limiter.acquire(tokens)
+        RATE_LIMIT_WAIT_SECONDS.observe(time.perf_counter() - wait_start, test_type=test_type)
+
+    def budget(template, values, completion_tokens):
+        """Rate-limit budget for one templated call; a response already in the cache costs none"""
+        key = cache_key(MODEL, template.messages(**values), {}, first_ordinal) if cache is not None else None
+        tokens = template.prompt_tokens(**values) + completion_tokens
+
+        async def wait_for_budget():
+            if key is not None and await asyncio.to_thread(cache.contains, key):
+                return
+            await acquire(tokens)
+        return wait_for_budget
+
+    try:
+        if passage_batch:
+            sub_skills = [slot[2] for slot in slots]
+            passage = await controller.run(
+                generate_passage, exam, section, difficulty, sub_skills, first_ordinal, cache, passages,
+                before_attempt=budget(prompt_template(exam, "/passage"),
+                                      passage_request_values(section, difficulty, sub_skills),
+                                      EXPECTED_PASSAGE_TOKENS))
+            if passage is None:
+                print(f"  {label}: Failed to generate a passage, skipping.")
+                return 0
+            questions = await run_streamed(
+                controller, metric_labels(exam, section, PASSAGE_LABEL, difficulty), PASSAGE_LABEL, count,
+                generate_passage_questions, exam, passage, slots, cache, stream,
+                before_attempt=budget(prompt_template(exam, "/passage_questions"),
+                                      passage_questions_values(section, difficulty, passage, sub_skills),
+                                      EXPECTED_COMPLETION_TOKENS * count))
+        else:
+            questions = await run_streamed(
+                controller, metric_labels(exam, section, sub_skill, difficulty), sub_skill, count,
+                generate_questions, exam, section, sub_skill, difficulty, count, first_ordinal, cache, stream,
+                before_attempt=budget(prompt_template(exam), request_values(section, sub_skill, difficulty, count),
+                                      EXPECTED_COMPLETION_TOKENS * count))
+    except CallsStopped:
+        return 0
+    except Exception as e:
+        if classify_error(e) == QUOTA:
+            if stop is not None and not stop.is_set():
+                stop.set()
+                print("\n\n⚠️ API QUOTA EXCEEDED! Please check your OpenAI billing and upgrade your plan.")
+                print("No new calls will be started; rerun with --resume once the quota is restored.")
+            return 0
+        print(f"  {label}: Failed to generate ({classify_error(e)} error: {str(e)[:200]}), skipping.")
+        return 0
+
+    if not questions:
+        print(f"  {label}: Failed to generate, skipping.")
+        return 0
+
+    generated = len(questions)
+    if passage_batch:
+        # Questions about a passage fill the slots of the sub-skills they name
+        pairs, unmatched = match_slots(slots, questions)
+        for question_data in unmatched:
+            REJECTIONS.reject("surplus_sub_skill", question_data["sub_skill"])
+    else:
+        pairs = list(zip(slots, questions))
+
+    questions, undecided = await asyncio.to_thread(check_answers, exam, [q for _, q in pairs], checker)
+    if resolve_undecided:
+        for question_data in undecided:
+            resolve_tokens = estimate_tokens(json.dumps(resolve_messages(question_data))) + RESOLVE_COMPLETION_TOKENS
+            try:
+                agrees = await controller.run(resolve_answer, exam, question_data, cache,
+                                              before_attempt=lambda: acquire(resolve_tokens))
+            except CallsStopped:
+                # Keep the rest unchecked, as if no model were available
+                break
+            except Exception as e:
+                # The local check found nothing wrong, so the question is kept unchecked
+                print(f"  {label}: could not re-solve a question ({classify_error(e)} error: {str(e)[:120]})")
+                continue
+            if not agrees:
+                questions.remove(question_data)
+    kept_ids = {id(question_data) for question_data in questions}
+    pairs = [(slot, question_data) for slot, question_data in pairs if id(question_data) in kept_ids]
+
+    # Slots left without a question stay out of the journal and are retried on --resume
+    uploaded = 0
+    kept = screen_duplicates(exam, pairs, dedup, flag_duplicates)
+    if renderer is not None:
+        await attach_diagrams(renderer, [question_data for _, question_data in kept])
+    for slot, question_data in kept:
+        if await asyncio.to_thread(upload_to_supabase, question_data, inserter, slot):
+            uploaded += 1
+        elif dedup is not None:
+            dedup.release([slot])
+    print(f"  Generated: {label} - {generated}/{count} valid, {len(pairs)} kept")
+    return uploaded
+
+
+def print_dedup_stats(dedup, flag_duplicates=False):
+    if dedup is not None:
+        action = "flagged" if flag_duplicates else "rejected"
+        print(f"Near-duplicates: {dedup.duplicates} {action} (threshold {dedup.threshold:.0%})")
+
+
+def print_template_stats():
+    for name, template in sorted(PROMPT_TEMPLATES.items()):
+        stats = template.stats()
+        if stats["calls"]:
+            print(f"Prompt template {name}: {stats['prefix_tokens']}-token static prefix, "
+                  f"{stats['mean_suffix_tokens']:.0f}-token mean suffix, {stats['input_tokens']} input tokens "
+                  f"over {stats['calls']} calls")
+
+
+def template_summary():
+    """Per-template token statistics for the JSON run summary"""
+    return {name: template.stats() for name, template in sorted(PROMPT_TEMPLATES.items())}
+
+
+def print_diagram_stats(renderer):
+    if renderer is not None:
+        stats = renderer.stats()
+        print(f"Diagrams: {stats['rendered']} rendered, {stats['cached']} reused, {stats['failed']} not renderable")
+
+
+def print_answer_check_stats(checker):
+    if checker is not None:
+        stats = checker.stats()
+        print(f"Answer keys: {stats['verified']} verified locally, {stats['wrong']} wrong, "
+              f"{stats['undecided']} undecided")
+
+
+def print_passage_stats(passages):
+    stats = passages.stats()
+    if stats["created"] or stats["reused"]:
+        print(f"Passages: {stats['created']} stored, {stats['reused']} generated again and reused")
+
+
+def print_cache_stats(cache):
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Response cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['entries']} entries, {stats['bytes'] / 1024 / 1024:.1f} MB)")
+
+
+async def run_generation(exams,
+                         concurrency=DEFAULT_CONCURRENCY,
+                         requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                         tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                         batch_size=DEFAULT_BATCH_SIZE,
+                         cache=None,
+                         journal=None,
+                         questions_per_call=DEFAULT_QUESTIONS_PER_CALL,
+                         dedup=None,
+                         flag_duplicates=False,
+                         stream=False,
+                         renderer=None,
+                         checker=None,
+                         resolve_undecided=False,
+                         stock=None):
+    """
+    Generate and upload questions for every exam config in `exams` concurrently.
+    Questions of passage sections are asked about shared passages, stored before them.
+    Slots already recorded in `journal` are skipped; new uploads are recorded in it.
+    If a near-duplicate index `dedup` is given, repeated questions are dropped (or flagged).
+    With `stream`, malformed completions are cancelled early and retried.
+    With a DiagramRenderer, diagram specs are rendered and linked before upload.
+    With an AnswerChecker, answer keys are checked before upload (see generate_and_upload).
+    With `stock`, only the questions the inventory is short of are generated.
+    """
+    # Blocking OpenAI/Supabase calls run in worker threads; size the pool to the concurrency limit
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    stop = asyncio.Event()
+    controller = build_retry_controller(concurrency, stop)
+    exams_by_type = {exam["test_type"]: exam for exam in exams}
+
+    def on_inserted(tags):
+        if journal is not None:
+            journal.mark_done(tags)
+        report_inserted(tags)
+
+    on_success, on_failure = track_dedup_uploads(dedup, on_inserted, report_failed)
+    inserter = BulkInserter(SUPABASE_TABLE, batch_size=batch_size,
+                            on_success=on_success, on_failure=on_failure)
+    passages = PassageStore()
+    if journal is not None and len(journal):
+        print(f"\nResuming: {len(journal)} questions already completed according to {journal.path}")
+    calls, total = plan_calls(exams, journal, questions_per_call, stock)
+    if not calls:
+        print("\nEvery cell is at its quota; nothing to generate.")
+        return 0
+
+    print(f"\n=== Generating {total} questions for {', '.join(exams_by_type)} in {len(calls)} API calls "
+          f"(concurrency {concurrency}, {requests_per_minute} requests/min, {tokens_per_minute} tokens/min) ===")
+
+    try:
+        await asyncio.gather(*[
+            generate_and_upload(exams_by_type[slots[0][0]], slots, limiter, controller, inserter, cache,
+                                dedup, flag_duplicates, stop, stream, renderer, checker, resolve_undecided,
+                                passages)
+            for slots in calls
+        ])
+    finally:
+        # Questions that were already paid for are written (and checkpointed) even on Ctrl-C or exit
+        inserter.close()
+
+    print(f"\nFinished: {inserter.inserted}/{total} questions uploaded "
+          f"in {inserter.requests} insert requests ({len(inserter.failures)} rejected).")
+    if stop.is_set():
+        print("Stopped early because the OpenAI quota is exhausted.")
+    if controller.concurrency.decreases or controller.breaker.trips:
+        print(f"Throttling: concurrency reduced {controller.concurrency.decreases} times "
+              f"(ended at {int(controller.concurrency.limit)}), circuit opened {controller.breaker.trips} times")
+    REJECTIONS.report()
+    print_dedup_stats(dedup, flag_duplicates)
+    print_cache_stats(cache)
+    print_template_stats()
+    print_diagram_stats(renderer)
+    print_answer_check_stats(checker)
+    print_passage_stats(passages)
+    return inserter.inserted
+
+
+def batch_custom_id(slots):
+    """Encode a per-call batch of slots as a batch request custom_id"""
+    return "::".join(str(part) for part in slots[0]) + f"::{len(slots)}"
+
+
+def slots_from_custom_id(custom_id):
+    """Inverse of batch_custom_id"""
+    test_type, section, sub_skill, difficulty, first_ordinal, count = custom_id.split("::")
+    difficulty, first_ordinal, count = int(difficulty), int(first_ordinal), int(count)
+    return [(test_type, section, sub_skill, difficulty, ordinal)
+            for ordinal in range(first_ordinal, first_ordinal + count)]
+
+
+def plan_batch(exams, batch_file, journal=None, questions_per_call=DEFAULT_QUESTIONS_PER_CALL, stock=None):
+    """
+    Phase 1: write every outstanding generation call to a batch request file.
+    Passage sections need a passage before their questions can be asked, so
+    they are left to live runs.
+    """
+    exams_by_type = {exam["test_type"]: exam for exam in exams}
+    calls, total = plan_calls(exams, journal, questions_per_call, stock, passages=False)
+    skipped = [exam["test_type"] for exam in exams if exam["passage_sections"]]
+    if skipped:
+        print(f"Passage sections of {', '.join(skipped)} are not batched; generate them with a live run.")
+    written = batch_jobs.write_batch_file(batch_file, (
+        batch_jobs.batch_request(batch_custom_id(slots), MODEL,
+                                 build_messages(exams_by_type[slots[0][0]], *slots[0][1:4], len(slots)))
+        for slots in calls
+    ))
+    print(f"Wrote {written} batch requests covering {total} questions to {batch_file}")
+    return written
+
+
+def submit_batch(exams, batch_file):
+    """Phase 2: upload the request file and start the batch"""
+    batch_id = batch_jobs.submit_batch(
+        batch_file, metadata={"exams": ",".join(exam["name"] for exam in exams)})
+    print(f"Submitted batch {batch_id} for {batch_file}")
+    return batch_id
+
+
+def collect_batch(exams, batch_file, batch_size=DEFAULT_BATCH_SIZE, cache=None, journal=None,
+                  poll_interval=batch_jobs.DEFAULT_POLL_INTERVAL, dedup=None, flag_duplicates=False,
+                  renderer=None, checker=None):
+    """
+    Phase 3: wait for the batch to finish, then stream its results through
+    parsing, validation and bulk upload. Results are also written to the
+    response cache so later live runs can replay them. Answer keys are checked
+    locally; undecided questions are uploaded unchecked, as there is no live
+    model call in this phase.
+    """
+    batch_id = batch_jobs.load_batch_id(batch_file)
+    if batch_id is None:
+        print(f"No submitted batch found for {batch_file}. Run with --batch submit first.")
+        return 0
+
+    batch = batch_jobs.wait_for_batch(batch_id, poll_interval)
+    if batch.status != "completed":
+        print(f"Batch {batch_id} ended with status '{batch.status}'; collecting whatever results exist.")
+
+    def on_inserted(tags):
+        if journal is not None:
+            journal.mark_done(tags)
+        report_inserted(tags)
+
+    exams_by_type = {exam["test_type"]: exam for exam in exams}
+    on_success, on_failure = track_dedup_uploads(dedup, on_inserted, report_failed)
+    inserter = BulkInserter(SUPABASE_TABLE, batch_size=batch_size,
+                            on_success=on_success, on_failure=on_failure)
+    generated = 0
+    window = []
+
+    def upload_window():
+        # Results are screened and rendered a window at a time, so the worker pools get large batches
+        kept = []
+        for exam in exams:
+            pairs = [(slot, question_data) for slot, question_data in window if slot[0] == exam["test_type"]]
+            if checker is not None:
+                remaining = {id(question_data) for question_data in
+                             check_answers(exam, [question_data for _, question_data in pairs], checker)[0]}
+                pairs = [(slot, question_data) for slot, question_data in pairs if id(question_data) in remaining]
+            kept.extend(screen_duplicates(exam, pairs, dedup, flag_duplicates))
+        window.clear()
+        if renderer is not None:
+            attach_diagrams_sync(renderer, [question_data for _, question_data in kept])
+        uploaded = 0
+        for slot, question_data in kept:
+            if upload_to_supabase(question_data, inserter, slot):
+                uploaded += 1
+            elif dedup is not None:
+                dedup.release([slot])
+        return uploaded
+
+    with inserter:
+        for custom_id, content, usage, error in batch_jobs.iter_batch_results(batch):
+            slots = slots_from_custom_id(custom_id)
+            test_type, section, sub_skill, difficulty, first_ordinal = slots[0]
+            if error:
+                print(f"  {test_type} {sub_skill} (difficulty {difficulty}): request failed - {error}")
+                continue
+            exam = exams_by_type.get(test_type)
+            if exam is None:
+                print(f"  Skipping result for {test_type}: not one of the selected exams")
+                continue
+
+            labels = metric_labels(exam, section, sub_skill, difficulty)
+            GENERATION_CALLS.inc(source="batch", **labels)
+            record_usage(labels, usage or {})
+            record_template_call(exam, section, sub_skill, difficulty, len(slots))
+            questions = questions_from_content(exam, content, section, sub_skill, difficulty, len(slots))
+            # Only usable results are cached, so a live --resume run asks again for the rest
+            if cache is not None and questions:
+                messages = build_messages(exam, section, sub_skill, difficulty, len(slots))
+                cache.put(cache_key(MODEL, messages, {}, first_ordinal), {"content": content, "usage": usage})
+            window.extend((slot, question_data) for slot, question_data in zip(slots, questions)
+                          if journal is None or slot not in journal)
+            if len(window) >= COLLECT_WINDOW:
+                generated += upload_window()
+        generated += upload_window()
+
+    print(f"\nFinished: {inserter.inserted}/{generated} batch questions uploaded "
+          f"in {inserter.requests} insert requests ({len(inserter.failures)} rejected).")
+    REJECTIONS.report()
+    print_dedup_stats(dedup, flag_duplicates)
+    print_diagram_stats(renderer)
+    print_answer_check_stats(checker)
+    return inserter.inserted
+
+
+def parse_args(argv=None, default_exams=None):
+    parser = argparse.ArgumentParser(description="Generate exam questions and upload them to Supabase")
+    parser.add_argument("--exam", action="append", choices=available_exams(), dest="exams",
+                        help="Exam config to generate (repeatable; default: all exams)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Maximum number of API calls in flight at the same time")
+    parser.add_argument("--rpm", type=int, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help="OpenAI requests per minute budget (shared by all exams)")
+    parser.add_argument("--tpm", type=int, default=DEFAULT_TOKENS_PER_MINUTE,
+                        help="OpenAI tokens per minute budget (shared by all exams)")
+    parser.add_argument("--questions-per-call", type=int, default=DEFAULT_QUESTIONS_PER_CALL,
+                        help="Number of questions requested from the model in one call (1 disables batching)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Number of questions per Supabase insert request")
+    parser.add_argument("--fixed-plan", action="store_true",
+                        help="Generate the full quota of every cell, ignoring the questions already stored")
+    parser.add_argument("--plan-only", action="store_true",
+                        help="Print the per-cell generation plan from the current inventory and exit")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH,
+                        help="SQLite file used to cache OpenAI responses")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="Size cap for the response cache; least recently used entries are evicted")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always call the API, ignoring cached responses")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip questions recorded as uploaded in the checkpoint journal")
+    parser.add_argument("--checkpoint-path",
+                        help="Checkpoint journal file (default: checkpoints/<exams>.jsonl)")
+    parser.add_argument("--duplicates", choices=["reject", "flag", "off"], default="reject",
+                        help="What to do with questions that are near-duplicates of stored or earlier ones: "
+                             f"drop them, upload them with set_id '{DUPLICATE_SET_ID}', or skip the check")
+    parser.add_argument("--duplicate-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Estimated character 5-gram similarity (0-1) at which two questions are near-duplicates")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream completions and cancel them as soon as they violate the question schema")
+    parser.add_argument("--no-diagrams", action="store_true",
+                        help="Upload diagram_spec as generated without rendering it to an image")
+    parser.add_argument("--diagram-dir", default=DEFAULT_ASSET_DIR,
+                        help="Directory rendered diagrams are written to, named by the hash of their spec")
+    parser.add_argument("--diagram-base-url", default=DEFAULT_BASE_URL,
+                        help="URL prefix under which --diagram-dir is served; image_url is <prefix>/<hash>.<format>")
+    parser.add_argument("--diagram-format", choices=["svg", "png"], default="svg",
+                        help="Image format for image_url (png needs cairosvg)")
+    parser.add_argument("--diagram-workers", type=int,
+                        help="Processes used to render diagrams (default: one per CPU)")
+    parser.add_argument("--no-answer-check", action="store_true",
+                        help="Upload answer keys without checking them locally")
+    parser.add_argument("--answer-check-workers", type=int,
+                        help="Processes used to check answer keys of large batches (default: one per CPU)")
+    parser.add_argument("--resolve-undecided", action="store_true",
+                        help="Ask the model to solve questions whose key no local check can decide, "
+                             "and drop them if it disagrees (one extra small call per such question)")
+    parser.add_argument("--metrics-dir", default=METRICS_DIR,
+                        help="Directory for the Prometheus textfile and JSON run summary written at exit")
+    parser.add_argument("--batch", choices=["plan", "submit", "collect", "run"],
+                        help="Use the offline Batch API instead of live calls: "
+                             "plan writes the request file, submit uploads it, collect waits and uploads "
+                             "the results, run does all three")
+    parser.add_argument("--batch-file",
+                        help="Batch request file (default: batches/<exams>_requests.jsonl)")
+    parser.add_argument("--poll-interval", type=int, default=batch_jobs.DEFAULT_POLL_INTERVAL,
+                        help="Seconds between batch status checks")
+    args = parser.parse_args(argv)
+
+    args.exams = args.exams or default_exams or available_exams()
+    run_name = "_".join(args.exams) if len(args.exams) < len(available_exams()) else "all_exams"
+    args.run_name = run_name
+    args.checkpoint_path = args.checkpoint_path or default_journal_path(run_name)
+    args.batch_file = args.batch_file or os.path.join(BATCH_DIR, f"{run_name}_requests.jsonl")
+    return args
+
+
+def build_renderer(args):
+    """The diagram renderer for a run, or None with --no-diagrams"""
+    if args.no_diagrams:
+        return None
+    return DiagramRenderer(args.diagram_dir, args.diagram_base_url, args.diagram_workers, args.diagram_format)
+
+
+def build_answer_checker(args):
+    """The answer-key checker for a run, or None with --no-answer-check"""
+    if args.no_answer_check:
+        return None
+    return AnswerChecker(args.answer_check_workers)
+
+
+def run_batch_command(args, exams):
+    """Run the requested phase(s) of the offline batch workflow"""
+    cache = None if args.no_cache else ResponseCache(args.cache_path, args.cache_max_mb * 1024 * 1024)
+    # Batch phases always honour the journal so planning never re-requests uploaded slots
+    journal = CheckpointJournal(args.checkpoint_path)
+
+    if args.batch in ("plan", "run"):
+        stock = None if args.fixed_plan else fetch_stock(exams)
+        if stock is not None:
+            print_plan(exams, stock)
+        if not plan_batch(exams, args.batch_file, journal, args.questions_per_call, stock):
+            print("Nothing left to generate.")
+            return
+    if args.batch in ("submit", "run"):
+        submit_batch(exams, args.batch_file)
+    if args.batch in ("collect", "run"):
+        dedup = None if args.duplicates == "off" else build_dedup_index(exams, args.duplicate_threshold)
+        renderer = build_renderer(args)
+        checker = build_answer_checker(args)
+        try:
+            collect_batch(exams, args.batch_file, args.batch_size, cache, journal, args.poll_interval,
+                          dedup, args.duplicates == "flag", renderer, checker)
+        finally:
+            if renderer is not None:
+                renderer.close()
+            if checker is not None:
+                checker.close()
+
+
+def preflight_checks(exams):
+    """Check the OpenAI and Supabase connections before spending on generation"""
+    if not OPENAI_API_KEY:
+        print("❌ OPENAI_API_KEY is not set. Add it to your .env file.")
+        return False
+
+    print("Starting question generation with OpenAI API key:", OPENAI_API_KEY[:10] + "..." + OPENAI_API_KEY[-5:])
+    print("Supabase URL:", SUPABASE_URL)
+    print("Supabase Table:", SUPABASE_TABLE)
+
+    # Check if API key is valid by making a test call
+    try:
+        openai.chat.completions.create(
+            model=MODEL,
+            messages=[{"role": "user", "content": "Test connection. Reply with OK."}],
+            max_tokens=5
+        )
+        print("✅ OpenAI connection successful!")
+    except Exception as e:
+        print(f"❌ OpenAI connection failed: {str(e)}")
+        print("Please check your API key and try again.")
+        return False
+
+    # Test Supabase connection
+    try:
+        client = get_client()
+
+        # Try to get a single row to check if table exists
+        response = client.select(SUPABASE_TABLE, limit=1)
+
+        response.raise_for_status()
+        print("✅ Supabase connection and table successful!")
+
+        # Try a test insertion with minimal data to validate the table structure
+        print("Testing Supabase insertion...")
+        try:
+            test_data = {
+                "question": "Test question",
+                "test_type": exams[0]["test_type"],
+                "year_level": exams[0]["year_level"],
+                "test_section": "Test",
+                "sub_skill": "Test",
+                "difficulty": 1,
+                "set_id": "test",
+                "question_type": "Multiple Choice",
+                "input_type": "Text",
+                "correct_answer": "Test",
+                "explanation": "Test explanation",
+                "options": ["A", "B", "C", "D"]
+            }
+
+            test_response = client.insert(SUPABASE_TABLE, test_data)
+
+            if test_response.status_code >= 400:
+                print(f"❌ Test insertion failed: {test_response.status_code}")
+                print(f"Response: {test_response.text}")
+                print("Continuing anyway, but uploads may fail.")
+            else:
+                print("✅ Test insertion successful!")
+
+        except Exception as e:
+            print(f"❌ Test insertion error: {str(e)}")
+            print("Continuing anyway, but uploads may fail.")
+
+    except Exception as e:
+        print(f"❌ Supabase connection failed: {str(e)}")
+        print(f"Please check if the table '{SUPABASE_TABLE}' exists in your Supabase project.")
+        return False
+
+    return True
+
+
+def main(default_exams=None, argv=None):
+    """
+    Generate and upload questions for the selected exams.
+    Per-exam scripts pass `default_exams` so they run only their own config.
+    """
+    args = parse_args(argv, default_exams)
+    exams = [load_exam_config(name) for name in args.exams]
+    REGISTRY.write_at_exit(os.path.join(args.metrics_dir, f"{args.run_name}.prom"),
+                           os.path.join(args.metrics_dir, f"{args.run_name}.json"),
+                           extra=lambda: {"run": args.run_name, "exams": args.exams, "batch": args.batch,
+                                          "validation": REJECTIONS.as_dict(),
+                                          "prompt_templates": template_summary()})
+
+    if args.plan_only:
+        print_plan(exams, fetch_stock(exams), verbose=True)
+        return
+
+    if args.batch:
+        run_batch_command(args, exams)
+        return
+
+    if not preflight_checks(exams):
+        return
+
+    stock = None if args.fixed_plan else fetch_stock(exams)
+    if stock is not None:
+        print_plan(exams, stock)
+
+    # Ask user if they want to continue with question generation
+    response = input("\nDo you want to continue with question generation? (y/n): ")
+    if response.lower() != 'y':
+        print("Exiting.")
+        return
+
+    cache = None if args.no_cache else ResponseCache(args.cache_path, args.cache_max_mb * 1024 * 1024)
+    journal = CheckpointJournal(args.checkpoint_path)
+    if not args.resume:
+        journal.reset()
+    dedup = None if args.duplicates == "off" else build_dedup_index(exams, args.duplicate_threshold)
+    renderer = build_renderer(args)
+    checker = build_answer_checker(args)
+    try:
+        asyncio.run(run_generation(exams, args.concurrency, args.rpm, args.tpm, args.batch_size, cache, journal,
+                                   args.questions_per_call, dedup, args.duplicates == "flag", args.stream,
+                                   renderer, checker, args.resolve_undecided, stock))
+    finally:
+        if renderer is not None:
+            renderer.close()
+        if checker is not None:
+            checker.close()
+
+
+if __name__ == "__main__":
+    main()
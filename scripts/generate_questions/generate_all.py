@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""
+Generate questions for several exams in one run.
+
+By default every exam in configs/ is generated; pass --exam (repeatable) to pick
+a subset. All exams share one OpenAI connection pool, response cache, rate-limit
+budget and Supabase bulk inserter, and their API calls are interleaved
+round-robin so each exam progresses at the same rate.
+
+Example:
+    python generate_all.py --exam edutest --exam nswselective --rpm 120
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from engine import main
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,20 @@
 #!/usr/bin/env python3
 """
 Script to generate questions for VIC Selective Entry tests.
-This script will loop through all sub-skills and generate 50 questions per sub-skill
-(10 per difficulty level from 1 to 5).
+This script tops up every sub-skill to 50 questions (10 per difficulty level
+from 1 to 5), generating only what the table is short of; --fixed-plan
+generates the full 50 regardless.
+
+The taxonomy and prompt details live in configs/vicselective.json; generation is done
+by the shared engine (see engine.py for the available options). To generate
+several exams in one run with a shared rate limit, use generate_all.py.
 """
 
-# Script will be implemented in a future task 
\ No newline at end of file
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from engine import main
+
+if __name__ == "__main__":
+    main(default_exams=["vicselective"])
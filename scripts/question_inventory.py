@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Report how many questions exist per test_type, test_section, sub_skill,
+difficulty and set_id.
+
+Totals come from `Prefer: count=exact` HEAD requests and the breakdown from the
+`educoach_question_inventory` view, so the cost does not grow with table size.
+With --snapshot the counts come from a local snapshot (see snapshot_questions.py).
+
+Usage:
+    python question_inventory.py [--test-type EduTest] [--by test_section,set_id] [--json] [--snapshot]
+"""
+
+import os
+import sys
+import json
+import argparse
+
+try:
+    import requests
+    from dotenv import load_dotenv
+    from utils.supabase_helpers import rollup_inventory, INVENTORY_COLUMNS
+    from utils.snapshot import open_source, DEFAULT_SNAPSHOT_PATH
+except ImportError as e:
+    print(f"Error: Required package not found: {e}")
+    print("Please install required packages using: pip install python-dotenv requests")
+    sys.exit(1)
+
+load_dotenv()
+
+
+def require_credentials():
+    if not os.getenv("SUPABASE_URL") or not os.getenv("SUPABASE_KEY"):
+        print("Error: Supabase credentials not found in environment variables")
+        print("Make sure SUPABASE_URL and SUPABASE_KEY are set in your .env file")
+        sys.exit(1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Show question inventory counts")
+    parser.add_argument("--test-type", help="Only count questions for this test_type (e.g. EduTest)")
+    parser.add_argument("--by", default=",".join(INVENTORY_COLUMNS),
+                        help=f"Comma-separated columns to group by (default: {','.join(INVENTORY_COLUMNS)})")
+    parser.add_argument("--json", action="store_true", help="Print the inventory as JSON")
+    parser.add_argument("--snapshot", nargs="?", const=DEFAULT_SNAPSHOT_PATH,
+                        help="Read from a local snapshot (default path if no value is given)")
+    return parser.parse_args()
+
+
+def build_inventory(test_type=None, dimensions=INVENTORY_COLUMNS, source=None):
+    """Fetch the total and the grouped counts for the requested dimensions"""
+    source = source or open_source()
+    filters = {"test_type": f"eq.{test_type}"} if test_type else {}
+    total = source.count_rows(filters=filters)
+    cells = rollup_inventory(source.fetch_inventory(filters), dimensions)
+    cells.sort(key=lambda cell: tuple(str(cell[dimension]) for dimension in dimensions))
+    return {"test_type": test_type, "total": total, "group_by": dimensions, "cells": cells}
+
+
+def print_inventory(inventory):
+    scope = f"test_type = '{inventory['test_type']}'" if inventory["test_type"] else "all test types"
+    print(f"Total questions ({scope}): {inventory['total']}")
+    print(f"\nBreakdown by {', '.join(inventory['group_by'])}:")
+    for cell in inventory["cells"]:
+        labels = " / ".join(str(cell[dimension]) for dimension in inventory["group_by"])
+        print(f"  - {labels}: {cell['question_count']} questions")
+
+
+def main():
+    args = parse_args()
+    dimensions = [dimension.strip() for dimension in args.by.split(",") if dimension.strip()]
+    unknown = [dimension for dimension in dimensions if dimension not in INVENTORY_COLUMNS]
+    if unknown:
+        print(f"Error: cannot group by {', '.join(unknown)}; choose from {', '.join(INVENTORY_COLUMNS)}")
+        sys.exit(1)
+
+    if not args.snapshot:
+        require_credentials()
+    try:
+        inventory = build_inventory(args.test_type, dimensions, open_source(args.snapshot))
+    except requests.exceptions.RequestException as e:
+        print(f"Error connecting to Supabase: {e}")
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(inventory, indent=2))
+    else:
+        print_inventory(inventory)
+
+
+if __name__ == "__main__":
+    main()
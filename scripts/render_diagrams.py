@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Render the diagram_spec of stored questions that have no image_url yet
+(null or empty).
+
+Questions are streamed from Supabase, their specs are rendered in a process
+pool into the content-addressed asset directory (identical specs are rendered
+once), and the resulting image_url values are written back in bulk through the
+`set_question_image_urls` RPC (supabase/migrations). Rows are read from the
+`educoach_question_diagrams_pending` view, which leaves out empty and free-text
+specs. New questions are rendered by the generation engine before upload, so
+this is for backfilling.
+
+Usage:
+    python render_diagrams.py [--test-type EduTest] [--workers 8] [--dry-run]
+"""
+
+import os
+import sys
+import argparse
+from collections import deque
+
+try:
+    import requests
+    from dotenv import load_dotenv
+    from utils.supabase_helpers import iter_rows, set_image_urls, DIAGRAMS_PENDING_VIEW
+    from utils.diagram_renderer import DiagramRenderer, DiagramSpecError, DEFAULT_ASSET_DIR, DEFAULT_BASE_URL
+    from utils.metrics import REGISTRY, METRICS_DIR
+except ImportError as e:
+    print(f"Error: Required package not found: {e}")
+    print("Please install required packages using: pip install python-dotenv requests")
+    sys.exit(1)
+
+load_dotenv()
+
+if not os.getenv("SUPABASE_URL") or not os.getenv("SUPABASE_KEY"):
+    print("Error: Supabase credentials not found in environment variables")
+    print("Make sure SUPABASE_URL and SUPABASE_KEY are set in your .env file")
+    sys.exit(1)
+
+# image_url updates sent per RPC call
+WRITE_BATCH_SIZE = 500
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Render diagram specs of stored questions and link the images")
+    parser.add_argument("--test-type", help="Only render questions for this test_type (e.g. EduTest)")
+    parser.add_argument("--asset-dir", default=DEFAULT_ASSET_DIR, help="Directory the diagrams are written to")
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL, help="URL prefix under which --asset-dir is served")
+    parser.add_argument("--format", choices=["svg", "png"], default="svg",
+                        help="Image format for image_url (png needs cairosvg)")
+    parser.add_argument("--workers", type=int, help="Render processes (default: one per CPU)")
+    parser.add_argument("--dry-run", action="store_true", help="Render the assets but do not update the database")
+    parser.add_argument("--metrics-dir", default=METRICS_DIR,
+                        help="Directory for the Prometheus textfile and JSON run summary written at exit")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    REGISTRY.write_at_exit(os.path.join(args.metrics_dir, "render_diagrams.prom"),
+                           os.path.join(args.metrics_dir, "render_diagrams.json"),
+                           extra={"run": "render_diagrams", "dry_run": args.dry_run})
+    filters = {"test_type": f"eq.{args.test_type}"} if args.test_type else None
+
+    urls = {}
+    written = 0
+
+    def flush():
+        nonlocal written
+        if urls and not args.dry_run:
+            written += set_image_urls(urls)
+        urls.clear()
+
+    def link(question_id, url):
+        urls[question_id] = url
+        if len(urls) >= WRITE_BATCH_SIZE:
+            flush()
+
+    with DiagramRenderer(args.asset_dir, args.base_url, args.workers, args.format) as renderer:
+        # Keep the pool busy while rows stream in, without queueing the whole table
+        in_flight = deque()
+        window = 4 * renderer.workers
+
+        def collect(wait_for_all=False):
+            while in_flight and (wait_for_all or len(in_flight) >= window or in_flight[0][2].done()):
+                question_id, url, future = in_flight.popleft()
+                try:
+                    future.result()
+                except Exception as e:
+                    renderer.record_failure(f"question {question_id}: {e}")
+                    continue
+                link(question_id, url)
+
+        try:
+            for row in iter_rows(DIAGRAMS_PENDING_VIEW, select="id,diagram_spec", filters=filters):
+                try:
+                    url, future = renderer.submit(row["diagram_spec"])
+                except DiagramSpecError as e:
+                    renderer.record_failure(f"question {row['id']}: {e}")
+                    continue
+                if future is None:
+                    # Already rendered: the asset exists, only the row needs its image_url
+                    link(row["id"], url)
+                else:
+                    in_flight.append((row["id"], url, future))
+                collect()
+            collect(wait_for_all=True)
+            flush()
+        except requests.exceptions.RequestException as e:
+            print(f"Error connecting to Supabase: {e}")
+            sys.exit(1)
+
+        stats = renderer.stats()
+
+    print(f"Diagrams: {stats['rendered']} rendered, {stats['cached']} reused, {stats['failed']} not renderable")
+    if args.dry_run:
+        print("Dry run: image_url not updated.")
+    else:
+        print(f"Updated image_url on {written} questions.")
+
+
+if __name__ == "__main__":
+    main()
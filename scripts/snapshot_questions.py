@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Mirror the educoach_questions table into a local SQLite snapshot.
+
+The first run downloads the whole table; later runs fetch only rows with a new
+id or a newer updated_at. check_questions.py, check_set_ids.py,
+question_inventory.py and structure_edutest_sets.py read from the snapshot
+when given --snapshot.
+
+Usage:
+    python snapshot_questions.py [--path snapshots/educoach_questions.sqlite3] [--full]
+"""
+
+import os
+import sys
+import argparse
+
+try:
+    import requests
+    from dotenv import load_dotenv
+    from utils.snapshot import QuestionSnapshot, DEFAULT_SNAPSHOT_PATH
+except ImportError as e:
+    print(f"Error: Required package not found: {e}")
+    print("Please install required packages using: pip install python-dotenv requests")
+    sys.exit(1)
+
+load_dotenv()
+
+if not os.getenv("SUPABASE_URL") or not os.getenv("SUPABASE_KEY"):
+    print("Error: Supabase credentials not found in environment variables")
+    print("Make sure SUPABASE_URL and SUPABASE_KEY are set in your .env file")
+    sys.exit(1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sync a local snapshot of educoach_questions")
+    parser.add_argument("--path", default=DEFAULT_SNAPSHOT_PATH, help="SQLite snapshot file")
+    parser.add_argument("--full", action="store_true",
+                        help="Rebuild the snapshot from scratch (also removes rows deleted in Supabase)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    snapshot = QuestionSnapshot(args.path)
+    mode = "Rebuilding" if args.full or not len(snapshot) else "Updating"
+    print(f"{mode} snapshot {args.path}...")
+
+    try:
+        result = snapshot.sync(full=args.full)
+    except requests.exceptions.RequestException as e:
+        print(f"Error connecting to Supabase: {e}")
+        sys.exit(1)
+    finally:
+        snapshot.close()
+
+    if result["full"] and mode == "Updating":
+        print("No row has an updated_at, so changed rows cannot be found; the snapshot was rebuilt. Apply "
+              "supabase/migrations/20250520000400_questions_updated_at.sql to keep updated_at current.")
+    print(f"Fetched {result['new']} new and {result['updated']} changed rows in {result['seconds']:.1f}s.")
+    print(f"Snapshot has {result['rows']} rows; Supabase has {result['remote_rows']}.")
+    if result["rows"] > result["remote_rows"]:
+        print("Some rows were deleted in Supabase. Run with --full to remove them from the snapshot.")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,19 +7,43 @@ This script assigns set_id values to EduTest questions in the Supabase database:
 - Practice tests: 5 tests with distribution matching actual EduTest exams
 - Drill sets: Remaining questions organized by sub-skill
 
+Questions are pooled by section, sub-skill and difficulty and every set is
+filled from the pools in one pass. Practice tests follow a difficulty mix and
+spread each section over its sub-skills. Pass --seed to reproduce a previous run.
+
+All assignments are collected first and then applied in a single transaction,
+so an interrupted run never leaves the table half-assigned.
+
+With --top-up, existing sets are kept: their current contents are read from
+the inventory counts, and only the new raw questions needed to fill each set's
+deficit per section, sub-skill and difficulty are assigned. Whatever is left
+goes to the drill sets. Nightly runs therefore write only the new questions
+and students' existing sets do not change.
+
+With --snapshot, questions are read from the local snapshot (see
+snapshot_questions.py), which is synced first unless --dry-run is given. A dry
+run plans the sets and prints the summary without writing anything, so with a
+snapshot it runs entirely offline.
+
 Usage:
-    python structure_edutest_sets.py
+    python structure_edutest_sets.py [--seed 1234] [--top-up] [--snapshot] [--dry-run]
 """
 
 import os
 import random
 import sys
+import argparse
 
 # Check for required packages
 try:
     import requests
     from dotenv import load_dotenv
     from collections import defaultdict
+    from utils.supabase_helpers import assign_set_ids
+    from utils.snapshot import open_source, DEFAULT_SNAPSHOT_PATH
+    from utils.metrics import REGISTRY, METRICS_DIR
+    from utils.set_assembler import (QuestionPools, SetSpec, SetMembership, build_diagnostic, build_set,
+                                     build_drills, top_up_diagnostic, top_up_set)
 except ImportError as e:
     print(f"Error: Required package not found: {e}")
     print("Please install required packages using: pip install python-dotenv requests")
@@ -36,18 +60,11 @@ except Exception as e:
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    print("Error: Supabase credentials not found in environment variables")
-    print("Make sure SUPABASE_URL and SUPABASE_KEY are set in your .env file")
-    sys.exit(1)
-
-# Headers for Supabase API requests
-headers = {
-    "apikey": SUPABASE_KEY,
-    "Authorization": f"Bearer {SUPABASE_KEY}",
-    "Content-Type": "application/json",
-    "Prefer": "return=minimal"  # Don't return the updated records to save bandwidth
-}
+def require_credentials():
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("Error: Supabase credentials not found in environment variables")
+        print("Make sure SUPABASE_URL and SUPABASE_KEY are set in your .env file")
+        sys.exit(1)
 
 # Define test sections and their target question counts for practice tests
 PRACTICE_TEST_STRUCTURE = {
@@ -58,129 +75,130 @@ PRACTICE_TEST_STRUCTURE = {
     "Non-verbal Reasoning": 33  # ~30-35 questions
 }
 
+# Difficulty mix within each practice test section (relative weights)
+PRACTICE_DIFFICULTY_MIX = {1: 1, 2: 2, 3: 4, 4: 2, 5: 1}
+NUM_PRACTICE_TESTS = 5
+PRACTICE_TEST_SPEC = SetSpec(PRACTICE_TEST_STRUCTURE, PRACTICE_DIFFICULTY_MIX)
+
+# Run metrics
+UPDATE_SECONDS = REGISTRY.histogram("educoach_set_update_seconds", "Time to write all set assignments")
+SET_ASSIGNMENTS = REGISTRY.counter("educoach_set_assignments_total", "Questions assigned to sets, by set type")
+
+# Columns needed to plan set assignments
+QUESTION_METADATA_COLUMNS = "id,test_section,sub_skill,difficulty"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Assign raw EduTest questions to diagnostic, practice and drill sets")
+    parser.add_argument("--seed", type=int,
+                        help="Random seed for question selection; the same seed and questions give the same sets")
+    parser.add_argument("--top-up", action="store_true",
+                        help="Keep existing sets and only fill their gaps with new raw questions")
+    parser.add_argument("--snapshot", nargs="?", const=DEFAULT_SNAPSHOT_PATH,
+                        help="Read questions from a local snapshot (default path if no value is given)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Plan the sets and print the summary without writing to the database")
+    parser.add_argument("--metrics-dir", default=METRICS_DIR,
+                        help="Directory for the Prometheus textfile and JSON run summary written at exit")
+    return parser.parse_args()
+
 # Main function
 def main():
+    args = parse_args()
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    REGISTRY.write_at_exit(os.path.join(args.metrics_dir, "structure_edutest_sets.prom"),
+                           os.path.join(args.metrics_dir, "structure_edutest_sets.json"),
+                           extra={"run": "structure_edutest_sets", "seed": seed, "dry_run": args.dry_run,
+                                  "top_up": args.top_up})
+    if not (args.snapshot and args.dry_run):
+        require_credentials()
     try:
-        # Step 1: Fetch all EduTest questions from Supabase
-        print("Fetching EduTest questions from database...")
-        
-        # Endpoint for the educoach_questions table
-        endpoint = f"{SUPABASE_URL}/rest/v1/educoach_questions"
+        # Step 1: Fetch all EduTest questions from Supabase (or the local snapshot)
+        source = open_source(args.snapshot)
+        if args.snapshot and not args.dry_run:
+            # Assignments are written to Supabase, so plan from up-to-date set membership
+            print(f"Syncing snapshot {args.snapshot}...")
+            source.sync()
+        print("Fetching EduTest questions from " + ("snapshot..." if args.snapshot else "database..."))
         
-        # Query parameters to filter for EduTest questions with set_id='raw'
-        params = {
-            "select": "*",
+        # Only the metadata needed for set planning is fetched, page by page
+        filters = {
             "test_type": "eq.EduTest",
             "set_id": "eq.raw"
         }
         
-        # Make the request
+        # Pool questions by test_section, sub_skill, and difficulty as they stream in
+        pools = QuestionPools(seed)
+        total_questions = 0
         try:
-            response = requests.get(endpoint, headers=headers, params=params)
-            response.raise_for_status()  # Raise an exception for 4XX/5XX responses
+            for question in source.iter_rows(select=QUESTION_METADATA_COLUMNS, filters=filters):
+                total_questions += 1
+                test_section = question.get('test_section', 'Unknown')
+                sub_skill = question.get('sub_skill', 'Unknown')
+                difficulty = question.get('difficulty', 0)
+                
+                if not test_section or not sub_skill or not difficulty:
+                    print(f"Warning: Question {question.get('id')} has missing metadata and will be skipped")
+                    continue
+                    
+                pools.add(question)
         except requests.exceptions.RequestException as e:
             print(f"Error connecting to Supabase: {e}")
             return
         
-        # Extract questions from response
-        all_questions = response.json()
-        
-        if not all_questions:
+        if not total_questions:
             print("No EduTest questions found in the database.")
             return
         
-        print(f"Found {len(all_questions)} EduTest questions with set_id='raw'.")
-        
-        # Organize questions by test_section, sub_skill, and difficulty
-        organized_questions = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-        for question in all_questions:
-            test_section = question.get('test_section', 'Unknown')
-            sub_skill = question.get('sub_skill', 'Unknown')
-            difficulty = question.get('difficulty', 0)
-            
-            if not test_section or not sub_skill or not difficulty:
-                print(f"Warning: Question {question.get('id')} has missing metadata and will be skipped")
-                continue
-                
-            organized_questions[test_section][sub_skill][difficulty].append(question)
+        print(f"Found {total_questions} EduTest questions with set_id='raw'.")
+        print(f"Assembling sets with seed {seed} (rerun with --seed {seed} to reproduce).")
         
-        # Track which questions have been assigned
-        assigned_questions = set()
+        assignments = {}
         assignment_stats = {
             'diagnostic': 0,
             'practice_1': 0, 'practice_2': 0, 'practice_3': 0, 'practice_4': 0, 'practice_5': 0,
             'drills': defaultdict(int)
         }
         
-        # Step 2: Create diagnostic test - 1 question per sub-skill per difficulty
-        print("\nCreating diagnostic test set...")
-        diagnostic_questions = []
-        
-        for test_section, skills in organized_questions.items():
-            for sub_skill, difficulties in skills.items():
-                for difficulty in range(1, 6):  # Difficulty levels 1-5
-                    if difficulty in difficulties and difficulties[difficulty]:
-                        # Select one random question for this sub-skill and difficulty
-                        question = random.choice(difficulties[difficulty])
-                        diagnostic_questions.append(question)
-                        assigned_questions.add(question['id'])
-                        assignment_stats['diagnostic'] += 1
-        
-        # Update diagnostic questions in the database
-        update_questions(diagnostic_questions, 'diagnostic')
+        # In top-up mode, existing sets are only filled up to their targets
+        membership = load_membership(source) if args.top_up else None
         
-        # Step 3: Create practice tests
-        print("\nCreating practice test sets...")
-        practice_sets = {f'practice_{i}': [] for i in range(1, 6)}
-        
-        # Distribute questions by test section according to target counts
-        for practice_set_id in practice_sets.keys():
-            for test_section, target_count in PRACTICE_TEST_STRUCTURE.items():
-                # Find all questions for this test section that haven't been assigned yet
-                available_questions = [
-                    q for section in organized_questions.items() if section[0] == test_section
-                    for skill in section[1].values() 
-                    for difficulty in skill.values()
-                    for q in difficulty
-                    if q['id'] not in assigned_questions
-                ]
-                
-                # Randomly select the target number of questions (or as many as available)
-                num_to_select = min(target_count, len(available_questions))
-                if num_to_select == 0:
-                    print(f"Warning: No questions available for {test_section} in {practice_set_id}")
-                    continue
-                    
-                selected_questions = random.sample(available_questions, num_to_select)
-                
-                # Add to practice set and mark as assigned
-                practice_sets[practice_set_id].extend(selected_questions)
-                for q in selected_questions:
-                    assigned_questions.add(q['id'])
-                    assignment_stats[practice_set_id] += 1
+        # Step 2: Create diagnostic test - 1 question per sub-skill per difficulty
+        print("\nTopping up diagnostic test set..." if args.top_up else "\nCreating diagnostic test set...")
+        if args.top_up:
+            diagnostic_questions = top_up_diagnostic(pools, membership)
+        else:
+            diagnostic_questions = build_diagnostic(pools)
+        assignment_stats['diagnostic'] = len(diagnostic_questions)
+        stage_assignments(assignments, diagnostic_questions, 'diagnostic')
         
-        # Update practice test questions in the database
-        for practice_set_id, questions in practice_sets.items():
-            update_questions(questions, practice_set_id)
+        # Step 3: Create practice tests, balanced by difficulty and sub-skill within each section
+        print("\nTopping up practice test sets..." if args.top_up else "\nCreating practice test sets...")
+        for i in range(1, NUM_PRACTICE_TESTS + 1):
+            practice_set_id = f'practice_{i}'
+            if args.top_up:
+                selected_questions, shortfalls = top_up_set(pools, PRACTICE_TEST_SPEC, membership, practice_set_id)
+            else:
+                selected_questions, shortfalls = build_set(pools, PRACTICE_TEST_SPEC, offset=i - 1)
+            for test_section, missing in shortfalls.items():
+                print(f"Warning: {missing} {test_section} questions short in {practice_set_id}")
+            assignment_stats[practice_set_id] = len(selected_questions)
+            stage_assignments(assignments, selected_questions, practice_set_id)
         
         # Step 4: Assign remaining questions to drill sets
         print("\nCreating drill sets...")
-        drill_questions = defaultdict(list)
+        for drill_set_id, questions in build_drills(pools).items():
+            assignment_stats['drills'][drill_set_id] = len(questions)
+            stage_assignments(assignments, questions, drill_set_id)
         
-        # Process remaining unassigned questions
-        for test_section, skills in organized_questions.items():
-            for sub_skill, difficulties in skills.items():
-                for difficulty, questions in difficulties.items():
-                    for question in questions:
-                        if question['id'] not in assigned_questions:
-                            drill_set_id = f"drill-{sub_skill.replace(' ', '-').lower()}"
-                            drill_questions[drill_set_id].append(question)
-                            assigned_questions.add(question['id'])
-                            assignment_stats['drills'][drill_set_id] += 1
+        if args.top_up:
+            print(f"\nTop-up touches {len(assignments)} of the {total_questions} raw questions; "
+                  "existing set members are unchanged.")
         
-        # Update drill set questions in the database
-        for drill_set_id, questions in drill_questions.items():
-            update_questions(questions, drill_set_id)
+        # Step 5: Write every assignment to the database in one request
+        if args.dry_run:
+            print(f"\nDry run: {len(assignments)} set assignments planned, nothing written.")
+        else:
+            update_questions(assignments)
         
         # Print summary statistics
         print_summary(assignment_stats)
@@ -191,37 +209,47 @@ def main():
         traceback.print_exc()
         sys.exit(1)
 
-def update_questions(questions, set_id):
+def load_membership(source):
     """
-    Update questions in the database with the assigned set_id
+    Current contents of every EduTest set, counted by section, sub-skill and difficulty.
+    Read from the grouped inventory counts, so no question rows are transferred.
+    """
+    membership = SetMembership()
+    for cell in source.fetch_inventory({"test_type": "eq.EduTest"}):
+        if cell['set_id'] in (None, 'raw') or not cell['test_section'] or not cell['sub_skill']:
+            continue
+        membership.add(cell['set_id'], cell['test_section'], cell['sub_skill'], cell['difficulty'],
+                       cell['question_count'])
+    return membership
+
+def stage_assignments(assignments, questions, set_id):
+    """
+    Record the set_id for each question in the pending assignment map
     """
     if not questions:
         return
     
     print(f"Assigning {len(questions)} questions to set_id: {set_id}")
+    for question in questions:
+        assignments[question['id']] = set_id
+
+def update_questions(assignments):
+    """
+    Update questions in the database with their assigned set_id
+    """
+    if not assignments:
+        return
     
-    # Endpoint for the educoach_questions table
-    endpoint = f"{SUPABASE_URL}/rest/v1/educoach_questions"
-    
-    # Update questions in batches to avoid request size limits
-    batch_size = 50
-    for i in range(0, len(questions), batch_size):
-        batch = questions[i:i+batch_size]
-        
-        # Process each question in the batch
-        for question in batch:
-            # Prepare the update payload
-            data = {"set_id": set_id}
-            
-            # Make the PATCH request for this question
-            question_endpoint = f"{endpoint}?id=eq.{question['id']}"
-            try:
-                response = requests.patch(question_endpoint, headers=headers, json=data)
-                if response.status_code >= 300:
-                    print(f"Error updating question {question['id']}: {response.status_code}")
-                    print(response.text)
-            except requests.exceptions.RequestException as e:
-                print(f"Request error updating question {question['id']}: {e}")
+    print(f"\nWriting {len(assignments)} set assignments to the database...")
+    for set_id in assignments.values():
+        SET_ASSIGNMENTS.inc(set_type=set_id.split("_")[0].split("-")[0])
+    try:
+        with UPDATE_SECONDS.time(test_type="EduTest"):
+            updated = assign_set_ids(assignments)
+        print(f"Updated {updated} questions.")
+    except requests.exceptions.RequestException as e:
+        print(f"Request error updating questions: {e}")
+        raise
 
 def print_summary(stats):
     """
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The scripts import their helpers as top-level packages (utils, generate_questions)
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS_DIR)
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "generate_questions"))
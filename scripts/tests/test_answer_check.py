@@ -0,0 +1,40 @@
+import pytest
+
+from utils.answer_check import VERIFIED, WRONG, check_answer
+
+
+def question(stem, options, answer, explanation="See working."):
+    return {"question_type": "Multiple Choice", "question": stem, "options": options,
+            "correct_answer": answer, "explanation": explanation}
+
+
+def test_statistic_of_a_closed_list_is_checked():
+    assert check_answer(question("What is the mean of 4, 6 and 8?", ["5", "6", "7", "8"], "6")) == (VERIFIED, "mean")
+    assert check_answer(question("What is the mean of 4, 6 and 8?", ["5", "6", "7", "8"], "7")) == (WRONG, "mean")
+
+
+@pytest.mark.parametrize("stem", [
+    "The mean of 4, 6, 8 and x is 7. What is x?",
+    "The mean of 4, 6, 8 and a fourth number is 7. What is the fourth number?",
+    "The numbers 4, 6 and 8 have a mean of 6. One more number is added and the mean becomes 7. What is it?",
+])
+def test_statistic_with_an_unknown_item_is_not_judged(stem):
+    # The distractor 6 is mean(4, 6, 8), but the question asks for the missing value, 10
+    verdict, check = check_answer(question(stem, ["6", "7", "10", "12"], "10"))
+    assert verdict != WRONG
+
+
+@pytest.mark.parametrize("explanation", [
+    "-3 × 4 = -12, so the temperature falls by 12 degrees.",
+    "Start at -5: -5 + 8 = 3.",
+    "The change is −7 − 2 = −9.",
+])
+def test_worked_steps_with_negative_numbers(explanation):
+    verdict, check = check_answer(question("Which statement is true?", ["-12", "3", "-9", "12"], "3", explanation))
+    assert verdict != WRONG
+
+
+def test_false_worked_step_with_a_negative_number_is_wrong():
+    verdict, check = check_answer(question("Which statement is true?", ["-12", "3", "-9", "12"], "3",
+                                           "Start at -5: -5 + 8 = 13."))
+    assert (verdict, check) == (WRONG, "worked_step")
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from utils import supabase_helpers
+from utils.supabase_helpers import BulkInserter
+
+
+class FakeResponse:
+    def __init__(self, status_code, text=""):
+        self.status_code = status_code
+        self.text = text
+
+
+class FakeClient:
+    """Rejects any insert containing a row for which `rejects(row)` returns an error body"""
+
+    def __init__(self, rejects):
+        self.rejects = rejects
+        self.requests = 0
+
+    def insert(self, table, rows, prefer=None, params=None):
+        self.requests += 1
+        for row in rows:
+            error = self.rejects(row)
+            if error is not None:
+                return FakeResponse(400, error)
+        return FakeResponse(201)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    def install(rejects):
+        fake = FakeClient(rejects)
+        monkeypatch.setattr(supabase_helpers, "get_client", lambda: fake)
+        return fake
+    return install
+
+
+def insert_all(rows):
+    inserter = BulkInserter(batch_size=len(rows))
+    for i, row in enumerate(rows):
+        inserter.add(row, tag=i)
+    inserter.close()
+    return inserter
+
+
+def test_row_error_without_row_details_keeps_the_valid_rows(client):
+    # A check violation's message does not say which row broke it, so every failing split looks the same
+    error = json.dumps({"code": "23514", "message": "new row violates check constraint \"difficulty_range\""})
+    client(lambda row: error if row["difficulty"] > 5 else None)
+    rows = [{"difficulty": 3} for _ in range(16)]
+    rows[5] = rows[12] = {"difficulty": 9}  # one in each half, so both halves fail with the batch's message
+
+    inserter = insert_all(rows)
+
+    assert inserter.inserted == 14
+    assert sorted(failure["tag"] for failure in inserter.failures) == [5, 12]
+
+
+def test_schema_error_fails_the_batch_without_bisecting(client):
+    error = json.dumps({"code": "PGRST204", "message": "Could not find the 'topic' column of 'educoach_questions'"})
+    fake = client(lambda row: error)
+
+    inserter = insert_all([{"topic": "x"} for _ in range(64)])
+
+    assert fake.requests == 1
+    assert inserter.inserted == 0
+    assert len(inserter.failures) == 64
@@ -0,0 +1,43 @@
+from utils.checkpoint import CheckpointJournal
+from utils.generation_planner import CellStock, deficit_work_items, highest_ordinals, plan_deficits
+
+CELL = ("EduTest", "Mathematics", "Number Operations", 3)
+EXAM = {"test_type": "EduTest", "questions_per_difficulty": 10, "difficulties": [3],
+        "structure": {"Mathematics": ["Number Operations"]}}
+
+
+def test_ordinals_continue_after_the_stored_rows():
+    deficits = plan_deficits(EXAM, {CELL: CellStock(7, 7, 0, 0)})
+    assert deficit_work_items(deficits) == [CELL + (8,), CELL + (9,), CELL + (10,)]
+
+
+def test_journal_ahead_of_stock(tmp_path):
+    # Ordinal 6 was rejected on insert, so 9 rows are stored while the journal already holds 10
+    journal = CheckpointJournal(str(tmp_path / "journal.jsonl"))
+    journal.mark_done([CELL + (ordinal,) for ordinal in (1, 2, 3, 4, 5, 7, 8, 9, 10)])
+    deficits = plan_deficits(EXAM, {CELL: CellStock(9, 9, 0, 0)})
+
+    work_items = deficit_work_items(deficits, highest_ordinals(journal.completed))
+
+    assert [deficit.missing for deficit in deficits] == [1]
+    assert work_items == [CELL + (11,)]
+    assert all(slot not in journal for slot in work_items)
+    journal.close()
+
+
+def test_plan_calls_plans_the_shortfall_when_the_journal_is_ahead(tmp_path):
+    import engine
+
+    exam = engine.load_exam_config("edutest")
+    stock = {(exam["test_type"], section, sub_skill, difficulty): CellStock(10, 10, 0, 0)
+             for section, sub_skills in exam["structure"].items()
+             for sub_skill in sub_skills
+             for difficulty in exam["difficulties"]}
+    stock[CELL] = CellStock(9, 9, 0, 0)
+    journal = CheckpointJournal(str(tmp_path / "journal.jsonl"))
+    journal.mark_done([CELL + (ordinal,) for ordinal in range(1, 11)])
+
+    calls, total = engine.plan_calls([exam], journal, stock=stock)
+
+    assert (calls, total) == ([[CELL + (11,)]], 1)
+    journal.close()
@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+Local checks of answer keys for calculation and sequence questions.
+
+The model's correct_answer is recomputed from the question wherever the
+question has a form that can be evaluated exactly: an arithmetic expression,
+an equation in one unknown, the mean/median/mode/range of a list, the next
+term of a number or letter series, or a letter-shift code. Worked steps in
+the explanation ("3 × 4 = 12") are evaluated too. Arithmetic uses exact
+fractions, so 1/3 + 1/6 and 0.5 compare equal.
+
+Each question gets a verdict: VERIFIED (the key is the computed answer and no
+other option is), WRONG (the key is contradicted, e.g. another option is the
+computed answer, or a worked step is false) or UNDECIDED (no check applies, or
+the result does not match any option). Only WRONG is treated as proof of a bad
+item; undecided items are left to a slower check.
+"""
+
+import re
+import ast
+import statistics
+import threading
+from fractions import Fraction
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.metrics import REGISTRY
+
+VERIFIED = "verified"
+WRONG = "wrong"
+UNDECIDED = "undecided"
+
+# Below this many questions a check runs in-process; the pool only pays off for larger batches
+MIN_POOL_BATCH = 64
+POOL_CHUNK_SIZE = 32
+MAX_EXPONENT = 12
+MAX_MAGNITUDE = 10 ** 15
+
+ANSWER_CHECKS = REGISTRY.counter("educoach_answer_checks_total",
+                                 "Answer keys checked locally, by verdict and deciding check")
+
+_OPTION_LABEL = re.compile(r"^\s*\(?([A-Da-d])[).:]\s+")
+_THOUSANDS = re.compile(r"(?<=\d),(?=\d{3}\b)")
+_NUMBER = r"-?(?:\d+(?:\.\d+)?|\.\d+)"
+_ANSWER = re.compile(rf"^(?:[a-z]\s*=\s*)?[$£€]?\s*({_NUMBER})(?:\s+(\d+)\s*/\s*(\d+)|\s*/\s*(\d+))?\s*(%)?"
+                     r"(?:\s*[a-zA-Z²³°$]+\.?){0,3}$")
+# An arithmetic run: numbers joined by operators and brackets, no letters
+_ARITHMETIC = re.compile(r"[\d(][\d\s.+\-*/()]*[\d)]")
+# A single lower-case letter that is not part of a word (the x in "3x + 5")
+_UNKNOWN = r"(?<![A-Za-z])[a-z](?![A-Za-z])"
+# A leading minus belongs to the expression ("-3 × 4 = -12") unless it follows an operand ("2x-3")
+_WORKED_STEP = re.compile(rf"((?:(?<![\w).])-)?[\d(][\d\s.+\-*/()]*[\d)])\s*=\s*({_NUMBER})(?![\d/])")
+_DIRECT_QUESTION = re.compile(r"^\s*(?:what is|calculate|evaluate|work out|find the value of|find|simplify|compute)\b",
+                              re.IGNORECASE)
+_STATISTIC = re.compile(r"\b(mean|average|median|mode|range)\b", re.IGNORECASE)
+_STATISTIC_EXCLUDED = re.compile(r"\b(?:new|added|adds?|removed|missing|if|increase[sd]?|decrease[sd]?|must|another|"
+                                 r"unknown|instead|would|replace[sd]?|error|mistake|extra|other|more|"
+                                 r"third|fourth|fifth|sixth|seventh|eighth|ninth|tenth)\b", re.IGNORECASE)
+# The stem gives the statistic's value ("the mean of 4, 6, 8 and x is 7"), so it asks for something else
+_STATISTIC_STATED = re.compile(r"\b(?:mean|average|median|mode|range)\b[^?]*?(?:\b(?:is|was|equals?)\s+|=\s*)"
+                               r"[$£€]?-?\d", re.IGNORECASE)
+# A letter standing for a value, such as the x in "4, 6, 8 and x" (the words a and I are not variables)
+_LETTER_VARIABLE = re.compile(r"(?<![A-Za-z'’])[b-zB-HJ-Z](?![A-Za-z'’])")
+_NUMBER_LIST = re.compile(rf"{_NUMBER}(?:\s*(?:,|,?\s+and)\s*{_NUMBER}){{2,}}")
+_SERIES_QUESTION = re.compile(r"\b(?:next|comes after|continues?|following (?:number|letter|term))\b", re.IGNORECASE)
+_SERIES = re.compile(r"((?:-?\d+|\b[A-Z]\b)(?:\s*,\s*(?:-?\d+|\b[A-Z]\b)){3,})\s*(?:,\s*)?(?:\?|_+|…|\.\.\.)?")
+_CODE = re.compile(r"\b([A-Z]{2,})\b\s+(?:is|are)\s+(?:written|coded|encoded|represented|shown)\s+(?:as|by)\s+"
+                   r"\b([A-Z]{2,})\b")
+
+
+class CheckError(ValueError):
+    """The text is not something this module can evaluate"""
+
+
+def normalise_math(text):
+    """Rewrite typeset maths (×, ÷, −, ², 15% of, 1,200) as plain Python arithmetic"""
+    text = str(text)
+    for symbol, replacement in (("×", "*"), ("·", "*"), ("∙", "*"), ("÷", "/"), ("−", "-"), ("–", "-"),
+                                ("^", "**"), ("²", "**2"), ("³", "**3")):
+        text = text.replace(symbol, replacement)
+    text = _THOUSANDS.sub("", text)
+    # "3/4 of 20" and "15% of 80" are multiplications
+    text = re.sub(rf"(\d+\s*/\s*\d+|{_NUMBER}\s*%)\s+of\s+(?=[\d(])", r"(\1)*", text)
+    text = re.sub(rf"({_NUMBER})\s*%", r"(\1/100)", text)
+    # Digits between digits written as "x": 3 x 4
+    return re.sub(r"(?<=\d)\s+x\s+(?=\d)", " * ", text)
+
+
+def _implicit_products(expression):
+    """3x -> 3*x, 2(x + 1) -> 2*(x + 1), (x + 1)(x - 1) -> (x + 1)*(x - 1)"""
+    expression = re.sub(r"(?<=[\d)])\s*(?=[a-z(])", "*", expression)
+    return re.sub(r"(?<=[a-z)])\s*(?=[\d(])", "*", expression)
+
+
+def _evaluate_node(node, variables):
+    if isinstance(node, ast.Expression):
+        return _evaluate_node(node.body, variables)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return Fraction(str(node.value))
+    if isinstance(node, ast.Name) and node.id in variables:
+        return variables[node.id]
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _evaluate_node(node.operand, variables)
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp):
+        left = _evaluate_node(node.left, variables)
+        right = _evaluate_node(node.right, variables)
+        if isinstance(node.op, ast.Add):
+            result = left + right
+        elif isinstance(node.op, ast.Sub):
+            result = left - right
+        elif isinstance(node.op, ast.Mult):
+            result = left * right
+        elif isinstance(node.op, ast.Div):
+            if right == 0:
+                raise CheckError("division by zero")
+            result = left / right
+        elif isinstance(node.op, ast.Pow):
+            if right.denominator != 1 or abs(right) > MAX_EXPONENT or (left == 0 and right < 0):
+                raise CheckError("unsupported power")
+            result = left ** int(right)
+        else:
+            raise CheckError("unsupported operator")
+        if abs(result) > MAX_MAGNITUDE:
+            raise CheckError("value out of range")
+        return result
+    raise CheckError(f"cannot evaluate {type(node).__name__}")
+
+
+def evaluate(expression, variables=None):
+    """Exact value (a Fraction) of an arithmetic expression, optionally in one-letter variables"""
+    expression = _implicit_products(normalise_math(expression).strip())
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except (SyntaxError, ValueError):
+        raise CheckError(f"not an expression: {expression!r}")
+    return _evaluate_node(tree, variables or {})
+
+
+def parse_number(text):
+    """
+    Numeric value of an answer such as "42", "$1,200", "3/4", "2 1/2", "x = 5",
+    "12.5 cm" or "45%". Returns (Fraction, is_percent), or None if the text is
+    not a single number.
+    """
+    text = _OPTION_LABEL.sub("", str(text)).strip().rstrip(".")
+    text = _THOUSANDS.sub("", text).replace("−", "-")
+    match = _ANSWER.match(text)
+    if match is None:
+        return None
+    number, whole_numerator, whole_denominator, denominator, percent = match.groups()
+    value = Fraction(number)
+    if whole_numerator:
+        if int(whole_denominator) == 0:
+            return None
+        value += Fraction(int(whole_numerator), int(whole_denominator)) * (1 if value >= 0 else -1)
+    elif denominator:
+        if int(denominator) == 0:
+            return None
+        value /= int(denominator)
+    return value, bool(percent)
+
+
+def _decimals(text):
+    match = re.search(r"\.(\d+)", str(text))
+    return len(match.group(1)) if match else 0
+
+
+def matches_value(value, answer):
+    """True if answer text states `value`, allowing for rounding to the answer's decimal places"""
+    parsed = parse_number(answer)
+    if parsed is None:
+        return False
+    number, percent = parsed
+    candidates = [number, number / 100] if percent else [number]
+    decimals = _decimals(answer)
+    tolerance = Fraction(1, 2 * 10 ** decimals) if decimals else Fraction(0)
+    return any(abs(value - candidate) <= tolerance for candidate in candidates)
+
+
+def _normalise_text(text):
+    return re.sub(r"[^a-z0-9]", "", _OPTION_LABEL.sub("", str(text)).casefold())
+
+
+def answers_agree(first, second):
+    """True if two answers are the same number or the same text (ignoring labels, case and punctuation)"""
+    parsed = parse_number(first)
+    if parsed is not None and parse_number(second) is not None:
+        return matches_value(parsed[0] / 100 if parsed[1] else parsed[0], second) or \
+            matches_value(parsed[0], second)
+    return _normalise_text(first) == _normalise_text(second) != ""
+
+
+def answer_key(question_data):
+    """The correct answer as text; an option letter ("B") is resolved to that option"""
+    answer = str(question_data.get("correct_answer", "")).strip()
+    options = question_data.get("options") or []
+    letter = re.fullmatch(r"\(?([A-Da-d])\)?\.?", answer)
+    if letter and options and answer not in [str(option) for option in options]:
+        index = "abcd".index(letter.group(1).lower())
+        if index < len(options):
+            return str(options[index])
+    return answer
+
+
+def judge(question_data, is_answer, check):
+    """
+    Verdict for a computed answer. `is_answer(text)` says whether an answer text
+    is correct. The key is WRONG when another option is correct instead, or when
+    several options are; it is UNDECIDED when neither the key nor any option is.
+    """
+    key = answer_key(question_data)
+    options = [str(option) for option in question_data.get("options") or []]
+    correct_options = [option for option in options if is_answer(option)]
+    if is_answer(key):
+        if len(correct_options) > 1:
+            return WRONG, f"{check}_ambiguous_options"
+        return VERIFIED, check
+    if correct_options:
+        return WRONG, check
+    return UNDECIDED, f"{check}_no_match"
+
+
+def check_worked_steps(question_data):
+    """WRONG if the explanation states a false calculation such as "7 × 8 = 54"; None otherwise"""
+    explanation = normalise_math(question_data.get("explanation", ""))
+    for match in _WORKED_STEP.finditer(explanation):
+        expression, stated = match.groups()
+        if not re.search(r"\d\s*(?:\*\*|[+\-*/])\s*[\d(]|\)\s*[+\-*/]", expression):
+            continue
+        try:
+            value = evaluate(expression)
+        except CheckError:
+            continue
+        if not matches_value(value, stated):
+            return WRONG, "worked_step"
+    return None
+
+
+def check_expression(question_data):
+    """Questions that ask for the value of one arithmetic expression ("What is 3/4 + 1/8?")"""
+    question = question_data.get("question", "")
+    if not _DIRECT_QUESTION.match(question):
+        return None
+    text = normalise_math(question)
+    # The expression must be the whole object of the question, not a number inside a word problem
+    if re.search(r"\b[a-z]\b\s*=|=\s*\?", text) or re.search(r"[a-zA-Z]\s*[+\-*/]\s*\d", text):
+        return None
+    runs = [run for run in _ARITHMETIC.findall(text) if re.search(r"[\d)]\s*(?:\*\*|[+\-*/])\s*[\d(]", run)]
+    if len(runs) != 1:
+        return None
+    try:
+        value = evaluate(runs[0])
+    except CheckError:
+        return None
+    return judge(question_data, lambda answer: matches_value(value, answer), "expression")
+
+
+def _equation(text):
+    """The first "lhs = rhs" in text whose sides are arithmetic in single-letter unknowns, or None"""
+    allowed = rf"[\d\s.+\-*/()]|{_UNKNOWN}"
+    match = re.search(rf"((?:{allowed})+)=((?:{allowed})+)", text)
+    if match is None:
+        return None
+    lhs, rhs = (side.strip() for side in match.groups())
+    unknowns = set(re.findall(_UNKNOWN, lhs + " " + rhs))
+    if not lhs or not rhs or len(unknowns) != 1 or not re.search(r"\d", lhs + rhs):
+        return None
+    return lhs, rhs, unknowns.pop()
+
+
+def check_equation(question_data):
+    """Questions that ask for the unknown in a one-variable equation ("If 3x + 5 = 20, what is x?")"""
+    text = normalise_math(question_data.get("question", ""))
+    equation = _equation(text)
+    if equation is None:
+        return None
+    lhs, rhs, unknown = equation
+    asks_for_unknown = re.search(rf"\b(?:solve|find|what is|value of|determine|calculate|work out)\b[^.?]*?\b{unknown}\b",
+                                 text, re.IGNORECASE)
+    if not asks_for_unknown:
+        return None
+
+    def is_answer(answer):
+        parsed = parse_number(answer)
+        if parsed is None:
+            return False
+        try:
+            return evaluate(lhs, {unknown: parsed[0]}) == evaluate(rhs, {unknown: parsed[0]})
+        except CheckError:
+            return False
+
+    try:
+        evaluate(lhs, {unknown: Fraction(1)})
+        evaluate(rhs, {unknown: Fraction(1)})
+    except CheckError:
+        return None
+    return judge(question_data, is_answer, "equation")
+
+
+def _numbers(text):
+    return [Fraction(number) for number in re.findall(_NUMBER, _THOUSANDS.sub("", text))]
+
+
+def check_statistic(question_data):
+    """
+    Questions that ask for the mean, median, mode or range of a listed data set.
+    Only a complete list is evaluated: stems that state the statistic, name an
+    unknown item or add items to the list ask for something else.
+    """
+    question = normalise_math(question_data.get("question", ""))
+    statistics_asked = {name.lower() for name in _STATISTIC.findall(question)}
+    lists = _NUMBER_LIST.findall(question)
+    if len(statistics_asked) != 1 or len(lists) != 1 or _STATISTIC_EXCLUDED.search(question):
+        return None
+    if _STATISTIC_STATED.search(question) or _LETTER_VARIABLE.search(question):
+        return None
+    data = _numbers(lists[0])
+    statistic = statistics_asked.pop()
+    if statistic in ("mean", "average"):
+        value = sum(data) / len(data)
+    elif statistic == "median":
+        value = statistics.median(data)
+    elif statistic == "range":
+        value = max(data) - min(data)
+    else:
+        modes = statistics.multimode(data)
+        if len(modes) != 1:
+            return None
+        value = modes[0]
+    return judge(question_data, lambda answer: matches_value(value, answer), statistic)
+
+
+def next_term(terms):
+    """Next term of a sequence with constant differences, constant ratio or constant second differences"""
+    differences = [b - a for a, b in zip(terms, terms[1:])]
+    if len(set(differences)) == 1:
+        return terms[-1] + differences[0]
+    if all(terms) and len({Fraction(b) / a for a, b in zip(terms, terms[1:])}) == 1:
+        return Fraction(terms[-1]) * terms[-1] / terms[-2]
+    second = [b - a for a, b in zip(differences, differences[1:])]
+    if len(second) >= 2 and len(set(second)) == 1:
+        return terms[-1] + differences[-1] + second[0]
+    return None
+
+
+def check_series(question_data):
+    """Questions that ask for the next number or letter of a series ("2, 5, 8, 11, ?")"""
+    question = question_data.get("question", "")
+    if not _SERIES_QUESTION.search(question):
+        return None
+    series = _SERIES.findall(question)
+    if len(series) != 1:
+        return None
+    items = [item.strip() for item in series[0].split(",")]
+    if all(re.fullmatch(r"-?\d+", item) for item in items):
+        value = next_term([int(item) for item in items])
+        if value is None:
+            return None
+        return judge(question_data, lambda answer: matches_value(value, answer), "series")
+    if all(re.fullmatch(r"[A-Z]", item) for item in items):
+        value = next_term([ord(item) - ord("A") for item in items])
+        if value is None or value.denominator != 1 or not 0 <= value < 26:
+            return None
+        letter = chr(ord("A") + int(value))
+        return judge(question_data, lambda answer: _normalise_text(answer) == letter.lower(), "series")
+    return None
+
+
+def check_letter_code(question_data):
+    """Letter-shift codes: "If CAT is written as DBU, how is DOG written?" """
+    question = question_data.get("question", "")
+    match = _CODE.search(question)
+    if match is None:
+        return None
+    plain, coded = match.groups()
+    targets = [word for word in re.findall(r"\b[A-Z]{2,}\b", question[match.end():]) if word not in (plain, coded)]
+    if len(plain) != len(coded) or len(targets) != 1:
+        return None
+    target = targets[0]
+    shifts = [(ord(c) - ord(p)) % 26 for p, c in zip(plain, coded)]
+    if len(set(shifts)) != 1 and len(target) != len(plain):
+        return None
+    if len(set(shifts)) == 1:
+        shifts = shifts[:1] * len(target)
+    encoded = "".join(chr((ord(letter) - ord("A") + shift) % 26 + ord("A")) for letter, shift in zip(target, shifts))
+    return judge(question_data, lambda answer: _normalise_text(answer) == encoded.lower(), "letter_code")
+
+
+# Applied in order; the first check that reaches a verdict decides
+CHECKS = (check_worked_steps, check_expression, check_equation, check_statistic, check_series, check_letter_code)
+
+
+def check_answer(question_data):
+    """(verdict, check) for one question"""
+    if question_data.get("question_type") not in (None, "", "Multiple Choice", "Short Answer"):
+        return UNDECIDED, "not_applicable"
+    for check in CHECKS:
+        try:
+            result = check(question_data)
+        except (CheckError, ArithmeticError, ValueError, statistics.StatisticsError):
+            result = None
+        if result is not None and result[0] != UNDECIDED:
+            return result
+    return UNDECIDED, "no_check"
+
+
+def check_batch(questions):
+    """Worker-process entry point: verdicts for a list of questions"""
+    return [check_answer(question_data) for question_data in questions]
+
+
+class AnswerChecker:
+    """
+    Checks answer keys in batches. Large batches are split into chunks that run
+    in a process pool; small ones are checked in the calling process. Counts
+    verdicts per check for the run summary.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.counts = {VERIFIED: 0, WRONG: 0, UNDECIDED: 0}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _record(self, verdicts):
+        with self._lock:
+            for verdict, check in verdicts:
+                self.counts[verdict] += 1
+                ANSWER_CHECKS.inc(verdict=verdict, check=check)
+        return verdicts
+
+    def check(self, questions):
+        """[(verdict, check), ...] for `questions`, in order"""
+        questions = list(questions)
+        if len(questions) < MIN_POOL_BATCH:
+            return self._record(check_batch(questions))
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        chunks = [questions[start:start + POOL_CHUNK_SIZE] for start in range(0, len(questions), POOL_CHUNK_SIZE)]
+        return self._record([verdict for chunk in self._pool.map(check_batch, chunks) for verdict in chunk])
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Helpers for the OpenAI Batch API.
+A batch run has three phases: write the work plan as a JSONL request file,
+submit it and poll until it finishes, then stream the results back.
+
+The OpenAI client honours OPENAI_BASE_URL, so every phase can be pointed at a
+local stand-in server that implements /files and /batches.
+"""
+
+import os
+import json
+import time
+
+import openai
+
+CHAT_COMPLETIONS_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+DEFAULT_POLL_INTERVAL = 60  # seconds
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def batch_request(custom_id, model, messages, **params):
+    """One line of a batch request file"""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": CHAT_COMPLETIONS_ENDPOINT,
+        "body": dict(params, model=model, messages=messages),
+    }
+
+
+def write_batch_file(path, requests):
+    """
+    Write batch requests as JSONL and return how many were written.
+    A batch submitted for the file's previous contents is forgotten, so a
+    later collect cannot pick up results that belong to an older plan.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    clear_state(path)
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for request in requests:
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def state_path(batch_file):
+    """Sidecar file recording the submitted batch id for a request file"""
+    return batch_file + ".state.json"
+
+
+def clear_state(batch_file):
+    """Forget the batch submitted for a request file"""
+    try:
+        os.remove(state_path(batch_file))
+    except FileNotFoundError:
+        pass
+
+
+def submit_batch(batch_file, metadata=None):
+    """Upload a request file and create a batch for it. Returns the batch id."""
+    with open(batch_file, "rb") as f:
+        uploaded = openai.files.create(file=f, purpose="batch")
+    batch = openai.batches.create(
+        input_file_id=uploaded.id,
+        endpoint=CHAT_COMPLETIONS_ENDPOINT,
+        completion_window=COMPLETION_WINDOW,
+        metadata=metadata,
+    )
+    with open(state_path(batch_file), "w", encoding="utf-8") as f:
+        json.dump({"batch_id": batch.id, "input_file_id": uploaded.id}, f)
+    return batch.id
+
+
+def load_batch_id(batch_file):
+    """Batch id recorded by `submit_batch`, or None if the file was never submitted"""
+    try:
+        with open(state_path(batch_file), encoding="utf-8") as f:
+            return json.load(f)["batch_id"]
+    except FileNotFoundError:
+        return None
+
+
+def wait_for_batch(batch_id, poll_interval=DEFAULT_POLL_INTERVAL):
+    """Poll a batch until it reaches a terminal status and return it"""
+    while True:
+        batch = openai.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        if counts is not None:
+            print(f"Batch {batch_id}: {batch.status} "
+                  f"({counts.completed} completed, {counts.failed} failed of {counts.total})")
+        else:
+            print(f"Batch {batch_id}: {batch.status}")
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        time.sleep(poll_interval)
+
+
+def iter_batch_results(batch):
+    """
+    Stream the results of a finished batch line by line.
+    Yields (custom_id, content, usage, error) where content is None on error.
+    """
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in openai.files.content(file_id).iter_lines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            body = response.get("body") or {}
+            error = record.get("error") or (body.get("error") if response.get("status_code", 200) >= 300 else None)
+            if error:
+                yield record["custom_id"], None, {}, error
+                continue
+            yield record["custom_id"], body["choices"][0]["message"]["content"], body.get("usage", {}), None
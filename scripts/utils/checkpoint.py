@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Durable checkpoint journal for long-running generation jobs.
+Records which work slots have completed so an interrupted run can resume.
+"""
+
+import os
+import json
+import threading
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CHECKPOINT_DIR = os.path.join(REPO_ROOT, "checkpoints")
+
+
+def default_journal_path(name):
+    """Journal file for a named job, e.g. checkpoints/edutest.jsonl"""
+    return os.path.join(CHECKPOINT_DIR, f"{name}.jsonl")
+
+
+class CheckpointJournal:
+    """
+    Append-only journal of completed slot keys (tuples such as
+    (test_type, section, sub_skill, difficulty, ordinal)).
+
+    Each completion is one JSON line, flushed and fsynced before `mark_done`
+    returns, so a completed slot survives a crash. A line torn by a crash
+    mid-write is ignored on load. The journal is thread-safe.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.completed = set()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        torn = False
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    torn = not line.endswith("\n")
+                    try:
+                        self.completed.add(tuple(json.loads(line)))
+                    except (json.JSONDecodeError, TypeError):
+                        continue
+        self._file = open(path, "a", encoding="utf-8")
+        if torn:
+            # Terminate a partial last line so the next record starts cleanly
+            self._file.write("\n")
+
+    def __contains__(self, key):
+        return tuple(key) in self.completed
+
+    def __len__(self):
+        return len(self.completed)
+
+    def mark_done(self, keys):
+        """Durably record that every key in `keys` has completed"""
+        lines = "".join(json.dumps(list(key)) + "\n" for key in keys)
+        if not lines:
+            return
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.completed.update(tuple(key) for key in keys)
+
+    def reset(self):
+        """Forget all completed slots and start a new journal"""
+        with self._lock:
+            self._file.close()
+            self._file = open(self.path, "w", encoding="utf-8")
+            self.completed.clear()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate detection for generated question text.
+Questions are reduced to MinHash signatures over character shingles and indexed with
+locality-sensitive hashing (banded signatures), one index per key such as
+(test_type, sub_skill). Lookups and inserts cost O(signature size), independent
+of how many questions are already indexed.
+"""
+
+import re
+import random
+import hashlib
+import threading
+
+from utils.supabase_helpers import SUPABASE_TABLE, iter_rows
+
+NUM_PERMUTATIONS = 64
+NUM_BANDS = 16  # 4 rows per band: pairs above ~0.5 similarity usually share a bucket
+SHINGLE_SIZE = 5  # characters per shingle of the normalised text
+DEFAULT_THRESHOLD = 0.7  # estimated Jaccard similarity at which questions count as duplicates
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """
+    Set of hashed character n-grams of normalised text. Case, punctuation and
+    spacing are ignored, so "3 pm," and "3pm" produce the same shingles.
+    """
+    normalised = "".join(_WORD.findall(str(text).lower()))
+    if len(normalised) < size:
+        grams = [normalised] if normalised else []
+    else:
+        grams = [normalised[i:i + size] for i in range(len(normalised) - size + 1)]
+    return {int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=4).digest(), "big")
+            for gram in grams}
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index of question texts, partitioned by key.
+
+    `check_and_add` is atomic, so concurrent workers cannot both insert the same
+    near-duplicate. `reserve` does the same for texts that are still being uploaded:
+    they block near-duplicates at once, but stay in the index only once `confirm`ed,
+    and are dropped again by `release`. The index is thread-safe.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, num_permutations=NUM_PERMUTATIONS,
+                 num_bands=NUM_BANDS, seed=1):
+        if num_permutations % num_bands:
+            raise ValueError("num_permutations must be a multiple of num_bands")
+        self.threshold = threshold
+        self.num_bands = num_bands
+        self.rows_per_band = num_permutations // num_bands
+        rng = random.Random(seed)
+        self._permutations = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+                              for _ in range(num_permutations)]
+        self._buckets = {}  # key -> [ {band value: [entry, ...]} per band ]
+        self._signatures = []
+        self._refs = []
+        self._pending = {}  # ref -> (key, entry) of reserved texts
+        self._size = 0
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def __len__(self):
+        return self._size
+
+    def signature(self, text):
+        """MinHash signature of a text, or None if it has no words"""
+        hashed = shingles(text)
+        if not hashed:
+            return None
+        prime = _MERSENNE_PRIME
+        return tuple(min([(a * h + b) % prime for h in hashed]) for a, b in self._permutations)
+
+    def _bands(self, signature):
+        rows = self.rows_per_band
+        return [signature[i * rows:(i + 1) * rows] for i in range(self.num_bands)]
+
+    def _best_match(self, key, signature):
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            return None
+        candidates = set()
+        for band, value in zip(buckets, self._bands(signature)):
+            candidates.update(band.get(value, ()))
+
+        best = None
+        for entry in candidates:
+            other = self._signatures[entry]
+            similarity = sum(x == y for x, y in zip(signature, other)) / len(signature)
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (self._refs[entry], similarity)
+        return best
+
+    def _add(self, key, signature, ref):
+        entry = len(self._signatures)
+        self._signatures.append(signature)
+        self._refs.append(ref)
+        buckets = self._buckets.setdefault(key, [{} for _ in range(self.num_bands)])
+        for band, value in zip(buckets, self._bands(signature)):
+            band.setdefault(value, []).append(entry)
+        return entry
+
+    def _remove(self, key, entry):
+        for band, value in zip(self._buckets[key], self._bands(self._signatures[entry])):
+            band[value].remove(entry)
+            if not band[value]:
+                del band[value]
+        self._signatures[entry] = None
+        self._refs[entry] = None
+
+    def add(self, key, text, ref=None):
+        """Index a text under `key` without checking it"""
+        signature = self.signature(text)
+        if signature is None:
+            return
+        with self._lock:
+            self._add(key, signature, ref)
+            self._size += 1
+
+    def find(self, key, text):
+        """Return (ref, similarity) of the closest indexed near-duplicate, or None"""
+        signature = self.signature(text)
+        if signature is None:
+            return None
+        with self._lock:
+            return self._best_match(key, signature)
+
+    def check_and_add(self, key, text, ref=None):
+        """
+        Return (ref, similarity) if `text` is a near-duplicate of an indexed text;
+        otherwise index it and return None.
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return None
+        with self._lock:
+            match = self._best_match(key, signature)
+            if match is None:
+                self._add(key, signature, ref)
+                self._size += 1
+            else:
+                self.duplicates += 1
+            return match
+
+    def reserve(self, key, text, ref):
+        """
+        Like check_and_add, but the text is held only until `ref` is confirmed or
+        released. Use it for texts whose upload has not succeeded yet; `ref` must be unique.
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return None
+        with self._lock:
+            match = self._best_match(key, signature)
+            if match is None:
+                self._pending[ref] = (key, self._add(key, signature, ref))
+            else:
+                self.duplicates += 1
+            return match
+
+    def confirm(self, refs):
+        """Keep the reserved texts of `refs`, e.g. once they are stored"""
+        with self._lock:
+            for ref in refs:
+                if self._pending.pop(ref, None) is not None:
+                    self._size += 1
+
+    def release(self, refs):
+        """Drop the reserved texts of `refs`, e.g. after their upload failed"""
+        with self._lock:
+            for ref in refs:
+                reserved = self._pending.pop(ref, None)
+                if reserved is not None:
+                    self._remove(*reserved)
+
+
+def load_index(filters=None, key_columns=("test_type", "sub_skill"), threshold=DEFAULT_THRESHOLD,
+               table=SUPABASE_TABLE):
+    """
+    Build an index from the questions already stored in Supabase.
+    Rows are streamed page by page and keyed by `key_columns`; each entry's ref is the row id.
+    """
+    index = NearDuplicateIndex(threshold)
+    select = ",".join(["question", *key_columns])
+    for row in iter_rows(table, select=select, filters=filters):
+        if row.get("question"):
+            index.add(tuple(row.get(column) for column in key_columns), row["question"], row["id"])
+    return index
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Rendering of question diagram_spec fields into image assets.
+
+A diagram spec is a small JSON scene: {"width", "height", "shapes": [...]}
+with rect, circle, ellipse, line, polyline, polygon and text shapes. Specs
+are rendered to SVG (and PNG when cairosvg is installed) in a process pool.
+Each asset is stored under the SHA-256 of its canonical spec, so identical
+diagrams are rendered once and later requests are served from the asset
+directory. The asset directory stands in for object storage; by default it
+is public/diagrams, which the frontend serves at /diagrams.
+"""
+
+import os
+import json
+import time
+import hashlib
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape, quoteattr
+
+from utils.metrics import REGISTRY
+
+try:
+    import cairosvg
+except ImportError:
+    cairosvg = None
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_ASSET_DIR = os.path.join(REPO_ROOT, "public", "diagrams")
+DEFAULT_BASE_URL = "/diagrams"
+DEFAULT_SIZE = 300  # pixels, used when a spec gives no width/height
+MAX_SIZE = 2000
+MAX_SHAPES = 500
+
+# Attributes accepted per shape type; everything else in a shape is ignored
+SHAPE_ATTRIBUTES = {
+    "rect": ("x", "y", "width", "height", "rx"),
+    "circle": ("cx", "cy", "r"),
+    "ellipse": ("cx", "cy", "rx", "ry"),
+    "line": ("x1", "y1", "x2", "y2"),
+    "polyline": (),
+    "polygon": (),
+    "text": ("x", "y", "font_size"),
+}
+STYLE_ATTRIBUTES = ("fill", "stroke", "stroke_width", "opacity", "transform")
+
+DIAGRAMS = REGISTRY.counter("educoach_diagrams_total", "Diagram specs by outcome (rendered, cached or failed)")
+RENDER_SECONDS = REGISTRY.histogram("educoach_diagram_render_seconds",
+                                    "Time to render one diagram in the worker pool",
+                                    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+
+
+class DiagramSpecError(ValueError):
+    """The spec cannot be turned into a diagram"""
+
+
+def parse_spec(spec):
+    """Return the spec as a dict; JSON strings are decoded. Raises DiagramSpecError."""
+    if isinstance(spec, str):
+        try:
+            spec = json.loads(spec)
+        except json.JSONDecodeError:
+            raise DiagramSpecError("diagram_spec is free text, not a JSON scene")
+    if not isinstance(spec, dict) or not isinstance(spec.get("shapes"), list) or not spec["shapes"]:
+        raise DiagramSpecError("diagram_spec has no shapes")
+    if len(spec["shapes"]) > MAX_SHAPES:
+        raise DiagramSpecError(f"diagram_spec has more than {MAX_SHAPES} shapes")
+    return spec
+
+
+def spec_digest(spec):
+    """Content address of a spec: SHA-256 of its canonical JSON"""
+    canonical = json.dumps(parse_spec(spec), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _number(value, name):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise DiagramSpecError(f"{name} is not a number: {value!r}")
+    return f"{value:g}"
+
+
+def _points(points):
+    if not isinstance(points, list) or len(points) < 2:
+        raise DiagramSpecError("points must be a list of at least two [x, y] pairs")
+    pairs = []
+    for point in points:
+        if not isinstance(point, (list, tuple)) or len(point) != 2:
+            raise DiagramSpecError(f"bad point {point!r}")
+        pairs.append(f"{_number(point[0], 'x')},{_number(point[1], 'y')}")
+    return " ".join(pairs)
+
+
+def _shape_svg(shape):
+    kind = shape.get("type") if isinstance(shape, dict) else None
+    if kind not in SHAPE_ATTRIBUTES:
+        raise DiagramSpecError(f"unknown shape type {kind!r}")
+
+    attributes = []
+    for name in SHAPE_ATTRIBUTES[kind]:
+        if name in shape:
+            attributes.append(f'{name.replace("_", "-")}="{_number(shape[name], name)}"')
+    if kind in ("polyline", "polygon"):
+        attributes.append(f'points="{_points(shape.get("points"))}"')
+    for name in STYLE_ATTRIBUTES:
+        if name in shape:
+            attributes.append(f"{name.replace('_', '-')}={quoteattr(str(shape[name]))}")
+    if kind in ("line", "polyline") and "stroke" not in shape:
+        attributes.append('stroke="black"')
+    if kind == "polyline" and "fill" not in shape:
+        attributes.append('fill="none"')
+
+    if kind == "text":
+        return f"<text {' '.join(attributes)}>{escape(str(shape.get('text', '')))}</text>"
+    return f"<{kind} {' '.join(attributes)}/>"
+
+
+def render_svg(spec):
+    """Render a diagram spec as an SVG document. Raises DiagramSpecError for invalid specs."""
+    spec = parse_spec(spec)
+    width = min(MAX_SIZE, float(_number(spec.get("width", DEFAULT_SIZE), "width")))
+    height = min(MAX_SIZE, float(_number(spec.get("height", DEFAULT_SIZE), "height")))
+    body = "\n".join(f"  {_shape_svg(shape)}" for shape in spec["shapes"])
+    background = quoteattr(str(spec.get("background", "white")))
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:g}" height="{height:g}" '
+            f'viewBox="0 0 {width:g} {height:g}">\n'
+            f'  <rect width="100%" height="100%" fill={background}/>\n'
+            f"{body}\n</svg>\n")
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def render_to_files(spec, base_path, formats=("svg",)):
+    """
+    Worker-process entry point: render `spec` to `base_path`.<format> for each
+    format and return the seconds spent. Files are written atomically.
+    """
+    start = time.perf_counter()
+    svg = render_svg(spec)
+    for fmt in formats:
+        if fmt == "svg":
+            _write_atomic(f"{base_path}.svg", svg.encode("utf-8"))
+        elif fmt == "png":
+            _write_atomic(f"{base_path}.png", cairosvg.svg2png(bytestring=svg.encode("utf-8")))
+    return time.perf_counter() - start
+
+
+class DiagramRenderer:
+    """
+    Renders diagram specs in a process pool into a content-addressed asset directory.
+
+    render() (blocking) and render_async() return the asset URL of a spec, or
+    None if the spec cannot be rendered. A spec whose asset already exists is
+    not rendered again, and concurrent requests for the same spec share one
+    render. `format` is "svg" or "png"; PNG needs cairosvg and the SVG is kept too.
+    """
+
+    def __init__(self, asset_dir=DEFAULT_ASSET_DIR, base_url=DEFAULT_BASE_URL, workers=None, format="svg"):
+        if format == "png" and cairosvg is None:
+            raise RuntimeError("PNG diagrams need cairosvg: pip install cairosvg")
+        self.asset_dir = asset_dir
+        self.base_url = base_url.rstrip("/")
+        self.format = format
+        self.workers = workers or os.cpu_count() or 1
+        self.formats = ("svg", "png") if format == "png" else ("svg",)
+        self.rendered = 0
+        self.cached = 0
+        self.failed = 0
+
+        os.makedirs(asset_dir, exist_ok=True)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._pending = {}  # digest -> Future of a render in progress
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def url(self, digest):
+        return f"{self.base_url}/{digest}.{self.format}"
+
+    def submit(self, spec):
+        """
+        Start rendering a spec without waiting. Returns (url, future); future is
+        None when the asset already exists. Raises DiagramSpecError for invalid specs.
+        """
+        digest = spec_digest(spec)
+        base_path = os.path.join(self.asset_dir, digest)
+        with self._lock:
+            future = self._pending.get(digest)
+            if future is not None or os.path.exists(f"{base_path}.{self.format}"):
+                self.cached += 1
+                DIAGRAMS.inc(outcome="cached")
+                return self.url(digest), future
+            future = self._pool.submit(render_to_files, parse_spec(spec), base_path, self.formats)
+            self._pending[digest] = future
+        # Outside the lock: a render that is already done runs the callback right here
+        future.add_done_callback(lambda done: self._finished(digest, done))
+        return self.url(digest), future
+
+    def _finished(self, digest, future):
+        with self._lock:
+            self._pending.pop(digest, None)
+            if future.exception() is None:
+                self.rendered += 1
+                DIAGRAMS.inc(outcome="rendered")
+                RENDER_SECONDS.observe(future.result())
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failed += 1
+        DIAGRAMS.inc(outcome="failed")
+        print(f"  Diagram not rendered: {error}")
+        return None
+
+    def render(self, spec):
+        """Render a spec (or reuse its asset) and return its URL, or None"""
+        try:
+            url, future = self.submit(spec)
+            if future is not None:
+                future.result()
+            return url
+        except Exception as e:  # a diagram that cannot be rendered never blocks the question
+            return self.record_failure(e)
+
+    def render_all(self, specs):
+        """render() for many specs at once: all are submitted to the pool before any is awaited"""
+        submitted = []
+        for spec in specs:
+            try:
+                submitted.append(self.submit(spec))
+            except Exception as e:
+                submitted.append(e)
+        urls = []
+        for item in submitted:
+            try:
+                if isinstance(item, Exception):
+                    raise item
+                url, future = item
+                if future is not None:
+                    future.result()
+                urls.append(url)
+            except Exception as e:  # a diagram that cannot be rendered never blocks the question
+                urls.append(self.record_failure(e))
+        return urls
+
+    async def render_async(self, spec):
+        """render() for asyncio code; the event loop is not blocked while the pool works"""
+        try:
+            url, future = self.submit(spec)
+            if future is not None:
+                await asyncio.wrap_future(future)
+            return url
+        except Exception as e:  # a diagram that cannot be rendered never blocks the question
+            return self.record_failure(e)
+
+    def stats(self):
+        return {"rendered": self.rendered, "cached": self.cached, "failed": self.failed}
+
+    def close(self):
+        self._pool.shutdown(wait=True)
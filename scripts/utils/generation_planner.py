@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Inventory-driven planning of generation work.
+
+The current question counts per (test_type, test_section, sub_skill,
+difficulty) cell are compared with the quotas in an exam config, and only the
+shortfall is planned. A cell's stock is split into free questions (set_id
+"raw" or empty, available to set assembly), questions placed in sets, and
+unusable ones (e.g. flagged near-duplicates), which never count towards a quota.
+
+Quotas per cell come from the exam config:
+  questions_per_difficulty  questions the cell should hold, free or placed
+  free_per_difficulty       free questions to keep in stock (optional, default 0),
+                            so placing questions in sets makes room for new ones
+"""
+
+from collections import namedtuple
+
+FREE_SET_IDS = (None, "", "raw")
+
+CellStock = namedtuple("CellStock", ["total", "free", "placed", "unusable"])
+EMPTY_STOCK = CellStock(0, 0, 0, 0)
+
+CellDeficit = namedtuple("CellDeficit", ["cell", "stock", "target", "free_target", "missing"])
+
+
+def _difficulty(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def stock_by_cell(inventory, unusable_set_ids=()):
+    """
+    Fold inventory rows (as returned by fetch_inventory) into a CellStock per
+    (test_type, test_section, sub_skill, difficulty) cell.
+    """
+    counts = {}
+    for row in inventory:
+        cell = (row["test_type"], row["test_section"], row["sub_skill"], _difficulty(row["difficulty"]))
+        total, free, placed, unusable = counts.get(cell, EMPTY_STOCK)
+        count = row["question_count"]
+        if row.get("set_id") in unusable_set_ids:
+            unusable += count
+        elif row.get("set_id") in FREE_SET_IDS:
+            free += count
+        else:
+            placed += count
+        counts[cell] = CellStock(total + count, free, placed, unusable)
+    return counts
+
+
+def cell_quotas(exam):
+    """{cell: (target, free_target)} for every cell in an exam's structure"""
+    target = exam["questions_per_difficulty"]
+    free_target = exam.get("free_per_difficulty", 0)
+    return {
+        (exam["test_type"], section, sub_skill, difficulty): (target, free_target)
+        for section, sub_skills in exam["structure"].items()
+        for sub_skill in sub_skills
+        for difficulty in exam["difficulties"]
+    }
+
+
+def plan_deficits(exam, stock):
+    """
+    One CellDeficit per cell of the exam, in structure order. `missing` is the
+    larger of the shortfall against the cell target and against the free stock target.
+    """
+    deficits = []
+    for cell, (target, free_target) in cell_quotas(exam).items():
+        cell_stock = stock.get(cell, EMPTY_STOCK)
+        usable = cell_stock.free + cell_stock.placed
+        missing = max(target - usable, free_target - cell_stock.free, 0)
+        deficits.append(CellDeficit(cell, cell_stock, target, free_target, missing))
+    return deficits
+
+
+def highest_ordinals(slots):
+    """{cell: highest ordinal} of (test_type, test_section, sub_skill, difficulty, ordinal) slots"""
+    highest = {}
+    for slot in slots:
+        cell, ordinal = tuple(slot[:4]), slot[4]
+        if isinstance(ordinal, int) and ordinal > highest.get(cell, 0):
+            highest[cell] = ordinal
+    return highest
+
+
+def deficit_work_items(deficits, used_ordinals=None):
+    """
+    Slots for the missing questions. Ordinals continue after every row already
+    in the cell and after the highest ordinal in `used_ordinals` ({cell: ordinal},
+    e.g. from a checkpoint journal), so they never repeat the slot (or cached
+    response) of a stored, rejected or deleted question.
+    """
+    used_ordinals = used_ordinals or {}
+    work_items = []
+    for deficit in deficits:
+        start = max(deficit.stock.total, used_ordinals.get(deficit.cell, 0))
+        work_items.extend(deficit.cell + (ordinal,) for ordinal in range(start + 1, start + deficit.missing + 1))
+    return work_items
+
+
+def summarise(deficits):
+    """Totals for a plan: cells, short cells, questions in stock and questions missing"""
+    return {
+        "cells": len(deficits),
+        "short_cells": sum(1 for deficit in deficits if deficit.missing),
+        "free": sum(deficit.stock.free for deficit in deficits),
+        "placed": sum(deficit.stock.placed for deficit in deficits),
+        "missing": sum(deficit.missing for deficit in deficits),
+    }
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Lightweight run metrics: labelled counters and latency histograms.
+A registry can be written as a Prometheus textfile (for node_exporter's
+textfile collector) and as a JSON run summary, e.g. when the script exits.
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+import contextlib
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+METRICS_DIR = os.path.join(REPO_ROOT, "metrics")
+
+# Upper bounds in seconds, sized for API calls that take from tens of ms to minutes
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """A monotonically increasing value per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def total(self):
+        with self._lock:
+            return sum(self.values.values())
+
+    def prometheus_lines(self):
+        with self._lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in items]
+
+    def summary(self):
+        with self._lock:
+            return [dict(key, value=value) for key, value in sorted(self.values.items())]
+
+
+class Histogram:
+    """Bucketed distribution of observations per label set"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # label key -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of a block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _quantile(self, state, fraction):
+        """Upper bound of the bucket holding the given quantile (None if above the last bucket)"""
+        rank = fraction * sum(state[:-1])
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, state):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return None
+
+    def prometheus_lines(self):
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self.values.items())
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {state[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+    def summary(self):
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self.values.items())
+        summaries = []
+        for key, state in items:
+            count = sum(state[:-1])
+            summaries.append(dict(
+                key,
+                count=count,
+                sum=state[-1],
+                mean=state[-1] / count if count else 0.0,
+                p50_le=self._quantile(state, 0.5),
+                p99_le=self._quantile(state, 0.99),
+            ))
+        return summaries
+
+
+class MetricsRegistry:
+    """A named collection of metrics for one run (thread-safe)"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, *args):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, *args)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help_text):
+        return self._get(Counter, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets)
+
+    def to_prometheus(self):
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.prometheus_lines())
+        return "\n".join(lines) + "\n"
+
+    def summary(self, extra=None):
+        """JSON-serialisable run summary. `extra` is a dict, or a callable returning one."""
+        if callable(extra):
+            extra = extra()
+        finished = time.time()
+        return dict(extra or {},
+                    started_at=self.started,
+                    finished_at=finished,
+                    duration_seconds=finished - self.started,
+                    metrics={name: {"type": metric.kind, "help": metric.help, "values": metric.summary()}
+                             for name, metric in sorted(self.metrics.items())})
+
+    def write(self, prometheus_path=None, json_path=None, extra=None):
+        """Write the textfile and/or summary; each file is replaced atomically"""
+        outputs = [
+            (prometheus_path, self.to_prometheus),
+            (json_path, lambda: json.dumps(self.summary(extra), indent=2, default=str) + "\n"),
+        ]
+        for path, render in outputs:
+            if not path:
+                continue
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(render())
+            os.replace(temp_path, path)
+
+    def write_at_exit(self, prometheus_path=None, json_path=None, extra=None):
+        """Write the metrics when the interpreter exits, including after Ctrl-C or sys.exit"""
+        def write():
+            try:
+                self.write(prometheus_path, json_path, extra)
+                print(f"Metrics written to {prometheus_path or json_path}")
+            except OSError as e:
+                print(f"Warning: could not write metrics: {e}")
+        atexit.register(write)
+
+
+# Shared registry for the current process
+REGISTRY = MetricsRegistry()
@@ -4,4 +4,115 @@ Helper functions for interacting with the OpenAI API.
 Includes utilities for prompt formatting and API calls.
 """
 
-# This file will be implemented in a future task 
\ No newline at end of file
+import openai
+
+from utils.llm_cache import cache_key
+from utils.rate_limiter import estimate_tokens
+from utils.question_schema import StreamAborted
+
+DEFAULT_MODEL = "gpt-4o"
+
+
+def usage_to_dict(usage):
+    """Token usage from an OpenAI response as a plain dict"""
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens,
+        # Prompt tokens served from the provider's prefix cache
+        "cached_tokens": getattr(details, "cached_tokens", None) or 0,
+    }
+
+
+def chat_completion(messages, model=DEFAULT_MODEL, cache=None, sample_index=0, **params):
+    """
+    Run a chat completion and return {"content", "usage", "cached", "retries"}.
+    `retries` is the number of retries the OpenAI client made before succeeding.
+
+    When a ResponseCache is given, an identical request (same model, messages,
+    parameters and sample index) is answered from the cache without an API call.
+    """
+    key = None
+    if cache is not None:
+        key = cache_key(model, messages, params, sample_index)
+        cached = cache.get(key)
+        if cached is not None:
+            return dict(cached, cached=True, retries=0)
+
+    raw = openai.chat.completions.with_raw_response.create(model=model, messages=messages, **params)
+    response = raw.parse()
+    result = {
+        "content": response.choices[0].message.content,
+        "usage": usage_to_dict(response.usage),
+    }
+
+    if cache is not None:
+        cache.put(key, result)
+    return dict(result, cached=False, retries=raw.retries_taken)
+
+
+def estimate_usage(messages, content):
+    """Approximate token usage for a request whose usage was not reported"""
+    prompt_tokens = sum(estimate_tokens(str(message.get("content", ""))) for message in messages)
+    completion_tokens = estimate_tokens(content)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def stream_chat_completion(messages, model=DEFAULT_MODEL, cache=None, sample_index=0, guard=None, **params):
+    """
+    Run a chat completion as a stream and return the same dict as chat_completion.
+
+    Each delta is passed to `guard` (a StreamGuard) as it arrives. If the guard
+    raises StreamAborted, the HTTP stream is closed at once, which cancels the
+    generation, and the exception is re-raised with an estimated `usage`.
+    Reading also stops once the guard has seen the complete JSON value.
+
+    Responses share cache keys with chat_completion, so streamed and
+    non-streamed runs replay each other's cached completions.
+    """
+    key = None
+    if cache is not None:
+        key = cache_key(model, messages, params, sample_index)
+        cached = cache.get(key)
+        if cached is not None:
+            return dict(cached, cached=True, retries=0)
+
+    stream = openai.chat.completions.create(model=model, messages=messages, stream=True,
+                                            stream_options={"include_usage": True}, **params)
+    parts = []
+    usage = None
+    try:
+        for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            parts.append(delta)
+            if guard is not None:
+                guard.feed(delta)
+                if guard.finished:
+                    break
+    except StreamAborted as e:
+        e.usage = estimate_usage(messages, e.content)
+        raise
+    finally:
+        stream.close()
+
+    content = "".join(parts)
+    result = {
+        "content": content,
+        # Usage arrives in the last chunk, which is skipped when reading stops early
+        "usage": usage_to_dict(usage) if usage is not None else estimate_usage(messages, content),
+    }
+
+    if cache is not None:
+        cache.put(key, result)
+    return dict(result, cached=False, retries=0)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Shared reading passages for passage-based sections (e.g. Reading Comprehension).
+
+A passage is generated once and several questions, across the section's
+sub-skills, are then generated against it in one call. Passages are stored in
+the educoach_passages table under a content-addressed id ("psg_" + SHA-256 of
+the normalised text), so a passage generated twice is stored once and
+questions reference it through linked_passage_id.
+"""
+
+import re
+import hashlib
+import threading
+from collections import defaultdict
+
+from utils.supabase_helpers import upsert_rows, PASSAGES_TABLE
+from utils.question_schema import extract_json
+
+MIN_PASSAGE_WORDS = 120
+MAX_PASSAGE_WORDS = 1200
+
+
+def passage_id(text):
+    """Content address of a passage: whitespace and case do not change it"""
+    normalised = " ".join(str(text).split()).casefold()
+    return "psg_" + hashlib.sha256(normalised.encode("utf-8")).hexdigest()[:16]
+
+
+def word_count(text):
+    return len(re.findall(r"\b[\w'’-]+\b", str(text)))
+
+
+def parse_passage(content):
+    """
+    Parse a passage response ({"title", "text_type", "passage"}) into a dict.
+    Returns (passage, None) or (None, rejection reason).
+    """
+    try:
+        data = extract_json(content)
+    except ValueError:
+        return None, "unparseable_json"
+    if isinstance(data, list) and len(data) == 1:
+        data = data[0]
+    if not isinstance(data, dict):
+        return None, "not_an_object"
+    text = data.get("passage")
+    if not isinstance(text, str) or not text.strip():
+        return None, "missing_passage"
+    words = word_count(text)
+    if not MIN_PASSAGE_WORDS <= words <= MAX_PASSAGE_WORDS:
+        return None, "passage_length"
+    return {
+        "title": str(data.get("title") or "").strip(),
+        "text_type": str(data.get("text_type") or "").strip(),
+        "passage": text.strip(),
+        "word_count": words,
+    }, None
+
+
+def group_passage_slots(work_items, questions_per_passage):
+    """
+    Group the slots of passage sections into one group per passage. A group
+    shares test type, section and difficulty, and takes slots round-robin
+    across sub-skills, so each passage is asked about as many sub-skills as possible.
+    """
+    by_cell = defaultdict(lambda: defaultdict(list))
+    for slot in work_items:
+        test_type, section, sub_skill, difficulty, _ = slot
+        by_cell[(test_type, section, difficulty)][sub_skill].append(slot)
+
+    groups = []
+    for by_sub_skill in by_cell.values():
+        queues = [list(slots) for slots in by_sub_skill.values()]
+        ordered = []
+        while any(queues):
+            for queue in queues:
+                if queue:
+                    ordered.append(queue.pop(0))
+        groups.extend(ordered[start:start + questions_per_passage]
+                      for start in range(0, len(ordered), questions_per_passage))
+    return groups
+
+
+def match_slots(slots, questions):
+    """
+    Pair questions with the slots they fill. A question fills the first open
+    slot of its sub-skill; questions for sub-skills with no open slot are
+    returned separately. Returns (pairs, unmatched).
+    """
+    open_slots = defaultdict(list)
+    for slot in slots:
+        open_slots[slot[2]].append(slot)
+    pairs, unmatched = [], []
+    for question_data in questions:
+        queue = open_slots.get(question_data.get("sub_skill"))
+        if queue:
+            pairs.append((queue.pop(0), question_data))
+        else:
+            unmatched.append(question_data)
+    return pairs, unmatched
+
+
+class PassageStore:
+    """
+    Writes passages to the passages table once per content id. Safe to share
+    between threads; a passage is uploaded before any question that links to it.
+    """
+
+    def __init__(self, table=PASSAGES_TABLE):
+        self.table = table
+        self.stored = set()
+        self.created = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+
+    def add(self, passage, **metadata):
+        """Store a parsed passage with its metadata (test_type, test_section, ...) and return its id"""
+        row = dict(metadata, **passage)
+        row["id"] = passage_id(passage["passage"])
+        with self._lock:
+            if row["id"] in self.stored:
+                self.reused += 1
+                return row["id"]
+        # ignore-duplicates: a passage stored by an earlier run keeps its row
+        upsert_rows([row], self.table)
+        with self._lock:
+            self.stored.add(row["id"])
+            self.created += 1
+        return row["id"]
+
+    def stats(self):
+        with self._lock:
+            return {"created": self.created, "reused": self.reused}
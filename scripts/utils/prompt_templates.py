@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Prompt templates split into a static prefix and a small variable suffix.
+
+Provider-side prompt caching only reuses an identical prefix, so everything
+that does not change between calls (instructions, output format, calibration)
+is rendered once into the system message, and the per-call values go into a
+short user message at the end. Token counts are kept per template so the
+input-token cost of each part can be tracked.
+"""
+
+import threading
+
+from utils.rate_limiter import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encodings = {}
+
+
+def count_tokens(text, model="gpt-4o"):
+    """Token count for `text` with the model's tokenizer, or an estimate if tiktoken is not installed"""
+    if tiktoken is None:
+        return estimate_tokens(text)
+    encoding = _encodings.get(model)
+    if encoding is None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        _encodings[model] = encoding
+    return len(encoding.encode(text))
+
+
+class PromptTemplate:
+    """
+    A compiled prompt: a fixed system `prefix` and a `suffix` format string
+    filled in per call with str.format. The prefix and its token count are
+    computed once, when the template is built.
+    """
+
+    def __init__(self, name, prefix, suffix, model="gpt-4o"):
+        self.name = name
+        self.prefix = prefix
+        self.suffix = suffix
+        self.model = model
+        self.prefix_tokens = count_tokens(prefix, model)
+
+        self.calls = 0
+        self.suffix_tokens_total = 0
+        self._lock = threading.Lock()
+
+    def render_suffix(self, **values):
+        return self.suffix.format(**values)
+
+    def messages(self, **values):
+        """Chat messages for one call: the shared system prefix, then the per-call request"""
+        return [
+            {"role": "system", "content": self.prefix},
+            {"role": "user", "content": self.render_suffix(**values)},
+        ]
+
+    def prompt_tokens(self, **values):
+        """Input tokens for one call (prefix plus rendered suffix)"""
+        return self.prefix_tokens + count_tokens(self.render_suffix(**values), self.model)
+
+    def record_call(self, **values):
+        """Count one call against this template; returns the suffix token count"""
+        suffix_tokens = count_tokens(self.render_suffix(**values), self.model)
+        with self._lock:
+            self.calls += 1
+            self.suffix_tokens_total += suffix_tokens
+        return suffix_tokens
+
+    def stats(self):
+        with self._lock:
+            calls, suffix_tokens = self.calls, self.suffix_tokens_total
+        return {
+            "calls": calls,
+            "prefix_tokens": self.prefix_tokens,
+            "mean_suffix_tokens": suffix_tokens / calls if calls else 0.0,
+            "input_tokens": self.prefix_tokens * calls + suffix_tokens,
+        }
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Parsing and validation of generated questions.
+Provides a single-pass JSON extractor for model output, a declarative question
+schema compiled into a list of checks, counters for rejection reasons, and an
+incremental guard that checks a streamed response while it is still arriving.
+"""
+
+import re
+import json
+import threading
+from collections import Counter
+
+QUESTION_TYPES = ("Multiple Choice", "Short Answer", "Written Prompt")
+INPUT_TYPES = ("Text", "Image + Text", "Diagram", "Numeric Entry")
+OPTION_LETTERS = "ABCD"
+
+_decoder = json.JSONDecoder()
+
+
+def extract_json(content):
+    """
+    Return the first JSON object or array in `content`.
+
+    Works in one pass over the text: each '{' or '[' is tried in turn with
+    raw_decode, so Markdown fences and surrounding prose are skipped without
+    splitting or re-parsing the string.
+    """
+    index = 0
+    while True:
+        starts = [i for i in (content.find("{", index), content.find("[", index)) if i >= 0]
+        if not starts:
+            raise ValueError("No JSON object or array found in response")
+        start = min(starts)
+        try:
+            value, _ = _decoder.raw_decode(content, start)
+            return value
+        except json.JSONDecodeError:
+            index = start + 1
+
+
+class Field:
+    """
+    Declarative description of one question field.
+
+    `types` is a type or tuple of types; `choices` restricts the value to a set;
+    `length` fixes the length of a list; `item_type` checks list elements;
+    `required_when` is a predicate on the whole record that makes the field required.
+    """
+
+    def __init__(self, name, types, required=False, non_empty=False, choices=None,
+                 length=None, item_type=None, value_range=None, required_when=None):
+        self.name = name
+        self.types = types
+        self.required = required
+        self.non_empty = non_empty
+        self.choices = choices
+        self.length = length
+        self.item_type = item_type
+        self.value_range = value_range
+        self.required_when = required_when
+
+    def compile(self):
+        """Build a check(record, context) -> reason or None for this field"""
+        name, types = self.name, self.types
+        required, required_when = self.required, self.required_when
+        non_empty, choices, length = self.non_empty, self.choices, self.length
+        item_type, value_range = self.item_type, self.value_range
+
+        def check(record, context):
+            value = record.get(name)
+            is_required = required or (required_when is not None and required_when(record, context))
+            if value is None or value == "" or value == []:
+                return f"missing_{name}" if is_required else None
+            if not isinstance(value, types) or isinstance(value, bool):
+                return f"bad_type_{name}"
+            if non_empty and isinstance(value, str) and not value.strip():
+                return f"missing_{name}"
+            if choices is not None and value not in choices:
+                return f"bad_value_{name}"
+            if length is not None and len(value) != length:
+                return f"bad_length_{name}"
+            if item_type is not None and not all(isinstance(item, item_type) and str(item).strip() for item in value):
+                return f"bad_items_{name}"
+            if value_range is not None and not value_range[0] <= value <= value_range[1]:
+                return f"out_of_range_{name}"
+            return None
+
+        return check
+
+
+class Schema:
+    """
+    A set of fields and cross-field rules compiled once into a flat list of checks.
+    Rules are callables taking (record, context) and returning a reason or None.
+    """
+
+    def __init__(self, fields, rules=()):
+        self.fields = list(fields)
+        self.rules = list(rules)
+        self._checks = [field.compile() for field in self.fields] + self.rules
+
+    def validate(self, record, context=None):
+        """Return the first rejection reason for `record`, or None if it is valid"""
+        if not isinstance(record, dict):
+            return "not_an_object"
+        context = context or {}
+        for check in self._checks:
+            reason = check(record, context)
+            if reason:
+                return reason
+        return None
+
+
+def _is_multiple_choice(record, context):
+    return record.get("question_type", "Multiple Choice") == "Multiple Choice"
+
+
+def _needs_answer(record, context):
+    return record.get("question_type") != "Written Prompt"
+
+
+def _requires_passage(record, context):
+    """Passage-based sections are flagged by the caller; Reading Comprehension is the default"""
+    return context.get("requires_passage", context.get("test_section") == "Reading Comprehension")
+
+
+def answer_in_options(record, context):
+    """The key must be one of the options (by text or by letter A-D)"""
+    options = record.get("options")
+    if not _is_multiple_choice(record, context) or not options:
+        return None
+    answer = str(record.get("correct_answer", "")).strip()
+    if answer.upper() in OPTION_LETTERS[:len(options)] and len(answer) == 1:
+        return None
+    if answer.casefold() in {str(option).strip().casefold() for option in options}:
+        return None
+    return "answer_not_in_options"
+
+
+def distinct_options(record, context):
+    options = record.get("options")
+    if options and len({str(option).strip().casefold() for option in options}) != len(options):
+        return "duplicate_options"
+    return None
+
+
+def matches_request(record, context):
+    """If the model echoes the section or sub-skill, it must be the one requested"""
+    for key in ("test_section", "sub_skill"):
+        expected = context.get(key)
+        if expected and record.get(key) not in (None, "", expected):
+            return f"wrong_{key}"
+    return None
+
+
+def in_requested_sub_skills(record, context):
+    """When a call asks for several sub-skills (passage questions), each question must name one of them"""
+    sub_skills = context.get("sub_skills")
+    if sub_skills and record.get("sub_skill") not in sub_skills:
+        return "wrong_sub_skill"
+    return None
+
+
+QUESTION_SCHEMA = Schema(
+    fields=[
+        Field("question", str, required=True, non_empty=True),
+        Field("question_type", str, choices=QUESTION_TYPES),
+        Field("input_type", str, choices=INPUT_TYPES),
+        Field("options", list, length=4, item_type=(str, int, float), required_when=_is_multiple_choice),
+        Field("correct_answer", (str, int, float), required_when=_needs_answer),
+        Field("explanation", str, required=True, non_empty=True),
+        Field("linked_passage_id", (str, int), required_when=_requires_passage),
+        Field("diagram_spec", (str, dict)),
+    ],
+    rules=[matches_request, in_requested_sub_skills, distinct_options, answer_in_options],
+)
+
+
+class RejectionStats:
+    """Thread-safe counters of rejection reasons, overall and per sub-skill"""
+
+    def __init__(self):
+        self.reasons = Counter()
+        self.by_sub_skill = Counter()
+        self.accepted = 0
+        self._lock = threading.Lock()
+
+    def accept(self, count=1):
+        with self._lock:
+            self.accepted += count
+
+    def reject(self, reason, sub_skill=None, count=1):
+        with self._lock:
+            self.reasons[reason] += count
+            self.by_sub_skill[(sub_skill, reason)] += count
+
+    def total_rejected(self):
+        return sum(self.reasons.values())
+
+    def report(self, top=10):
+        """Print the most common rejection reasons"""
+        rejected = self.total_rejected()
+        print(f"Validation: {self.accepted} accepted, {rejected} rejected")
+        for reason, count in self.reasons.most_common(top):
+            print(f"  - {reason}: {count}")
+        if self.by_sub_skill:
+            print("Most rejected sub-skills:")
+            for (sub_skill, reason), count in self.by_sub_skill.most_common(top):
+                print(f"  - {sub_skill}: {reason} x{count}")
+
+    def as_dict(self):
+        return {
+            "accepted": self.accepted,
+            "rejected": dict(self.reasons),
+            "by_sub_skill": {f"{sub_skill}|{reason}": count
+                             for (sub_skill, reason), count in self.by_sub_skill.items()},
+        }
+
+
+def validate_questions(content, context, count=1, stats=None):
+    """
+    Extract and validate up to `count` questions from a model response.
+    Returns the valid question dicts; every rejection is recorded in `stats`.
+    """
+    sub_skill = context.get("sub_skill")
+    try:
+        parsed = extract_json(content)
+    except ValueError:
+        if stats is not None:
+            stats.reject("unparseable_json", sub_skill, count)
+        return []
+
+    if isinstance(parsed, dict):
+        parsed = parsed.get("questions", [parsed])
+    if not isinstance(parsed, list):
+        if stats is not None:
+            stats.reject("not_an_object", sub_skill, count)
+        return []
+
+    if stats is not None and len(parsed) < count:
+        stats.reject("missing_items", sub_skill, count - len(parsed))
+
+    questions = []
+    for record in parsed[:count]:
+        reason = QUESTION_SCHEMA.validate(record, context)
+        if reason:
+            if stats is not None:
+                stats.reject(reason, sub_skill or (record.get("sub_skill") if isinstance(record, dict) else None))
+            continue
+        questions.append(record)
+
+    if stats is not None:
+        stats.accept(len(questions))
+    return questions
+
+
+# Streaming limits: characters of prose allowed before the JSON starts, and output budget per question
+MAX_PREFIX_CHARS = 200
+MAX_CHARS_PER_QUESTION = 6000
+
+_ECHOED_FIELD = re.compile(r'"(test_section|sub_skill)"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+class StreamAborted(Exception):
+    """Raised by StreamGuard when a partial response already violates the schema"""
+
+    def __init__(self, reason, content=""):
+        super().__init__(f"Streamed response aborted after {len(content)} characters: {reason}")
+        self.reason = reason
+        self.content = content
+        # Estimated token usage of the cancelled request, filled in by the caller
+        self.usage = {}
+
+
+class StreamGuard:
+    """
+    Incremental checker for a streamed model response.
+
+    Chunks are passed to feed() as they arrive. The guard tracks JSON nesting
+    (outside strings) to find each question object as soon as it closes and
+    validates it against QUESTION_SCHEMA. It raises StreamAborted when:
+    - no JSON starts within MAX_PREFIX_CHARS characters (prose instead of JSON)
+    - more than count // 2 of the questions are invalid. A question whose
+      echoed test_section or sub_skill differs from the request counts as
+      invalid as soon as that value is complete, before the rest of it arrives
+    - the response grows past `max_chars` (MAX_CHARS_PER_QUESTION per question)
+
+    `finished` becomes True once the top-level JSON value is closed, so the
+    caller can stop reading trailing prose.
+    """
+
+    def __init__(self, context, count=1, max_chars=None, max_prefix_chars=MAX_PREFIX_CHARS):
+        self.context = context
+        self.count = count
+        self.max_chars = max_chars or MAX_CHARS_PER_QUESTION * count
+        self.max_prefix_chars = max_prefix_chars
+        self.max_rejected = count // 2
+        self.valid = 0
+        self.rejected = 0
+        self.finished = False
+
+        self._parts = []
+        self._length = 0
+        self._depth = 0
+        self._started = False
+        self._item_depth = None
+        self._item = None
+        self._item_checked = set()
+        self._item_rejected = False
+        self._in_string = False
+        self._escape = False
+
+    def text(self):
+        return "".join(self._parts)
+
+    def abort(self, reason):
+        raise StreamAborted(reason, self.text())
+
+    def feed(self, chunk):
+        """Consume the next piece of the response; raises StreamAborted on a violation"""
+        if self.finished:
+            return
+        self._parts.append(chunk)
+        self._length += len(chunk)
+        if self._length > self.max_chars:
+            self.abort("runaway_length")
+
+        for char in chunk:
+            if not self._started:
+                if char in "{[":
+                    self._started = True
+                    # Questions are the elements of a top-level array, or the top-level object itself
+                    self._item_depth = 1 if char == "[" else 0
+                elif self._length > self.max_prefix_chars:
+                    self.abort("no_json")
+                else:
+                    continue
+
+            if self._item is not None:
+                self._item.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._item is not None and not self._item_rejected:
+                        self._check_echoed_fields()
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if char == "{" and self._depth == self._item_depth:
+                    self._item = [char]
+                    self._item_checked = set()
+                    self._item_rejected = False
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if char == "}" and self._item is not None and self._depth == self._item_depth:
+                    if not self._item_rejected:
+                        self._check_item("".join(self._item))
+                    self._item = None
+                if self._depth == 0:
+                    self.finished = True
+                    return
+
+    def _check_echoed_fields(self):
+        """Compare test_section / sub_skill with the request as soon as their values close"""
+        if len(self._item_checked) == 2:
+            return
+        for match in _ECHOED_FIELD.finditer("".join(self._item)):
+            key = match.group(1)
+            if key in self._item_checked:
+                continue
+            self._item_checked.add(key)
+            expected = self.context.get(key)
+            try:
+                value = json.loads(f'"{match.group(2)}"')
+            except json.JSONDecodeError:
+                continue
+            if expected and value not in ("", expected):
+                self._item_rejected = True
+                self._reject(f"wrong_{key}")
+                return
+
+    def _check_item(self, text):
+        try:
+            record = json.loads(text)
+        except json.JSONDecodeError:
+            reason = "unparseable_json"
+        else:
+            # A {"questions": [...]} wrapper is validated after the stream completes
+            if self._item_depth == 0 and isinstance(record.get("questions"), list):
+                return
+            reason = QUESTION_SCHEMA.validate(record, self.context)
+        if reason is None:
+            self.valid += 1
+        else:
+            self._reject(reason)
+
+    def _reject(self, reason):
+        self.rejected += 1
+        if self.rejected > self.max_rejected:
+            self.abort(reason)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Rate limiting utilities for API calls.
+Provides a token bucket limiter that budgets both requests and tokens per minute.
+"""
+
+import asyncio
+import time
+
+
+def estimate_tokens(text):
+    """Rough token estimate for a prompt (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """
+    A token bucket that refills continuously at `rate_per_minute`.
+    The bucket starts full so a run can begin with a burst up to `capacity`.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount):
+        """Seconds until `amount` tokens are available (0 if available now)"""
+        self._refill()
+        # Never ask for more than the bucket can hold or we would wait forever
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Async limiter enforcing a requests-per-minute and (optionally) a
+    tokens-per-minute budget. Waiters are served in FIFO order.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute=None):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens=0):
+        """Wait until one request and `tokens` tokens fit in the budget"""
+        async with self._lock:
+            while True:
+                wait = self.request_bucket.time_until(1)
+                if self.token_bucket is not None:
+                    wait = max(wait, self.token_bucket.time_until(tokens))
+
+                if wait <= 0:
+                    self.request_bucket.consume(1)
+                    if self.token_bucket is not None:
+                        self.token_bucket.consume(tokens)
+                    return
+
+                await asyncio.sleep(wait)
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Retry and overload handling shared by the OpenAI and Supabase calls.
+
+- classify_error / classify_status sort failures into throttled, quota,
+  transient and fatal.
+- RetryPolicy computes jittered exponential backoff that honours Retry-After
+  and runs blocking calls with retries.
+- CircuitBreaker pauses all callers after repeated failures.
+- AdaptiveConcurrency is an AIMD concurrency limit for asyncio code: it halves
+  on throttling and creeps back up on success.
+- RetryController combines the three for asyncio pipelines, and stops
+  starting calls once a stop event is set.
+"""
+
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+try:
+    import openai
+except ImportError:
+    openai = None
+
+# Error classes
+THROTTLED = "throttled"  # 429: slow down and retry
+QUOTA = "quota"  # billing quota exhausted: retrying will not help
+TRANSIENT = "transient"  # 5xx, timeouts, dropped connections: retry
+FATAL = "fatal"  # other 4xx and programming errors: do not retry
+
+TRANSIENT_STATUSES = {408, 425, 500, 502, 503, 504}
+# Statuses after which even a non-idempotent request (an insert) is known not to have been applied
+SAFE_RETRY_STATUSES = {429, 503}
+
+_CONNECTION_ERRORS = (ConnectionError, TimeoutError)
+if requests is not None:
+    _CONNECTION_ERRORS += (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+if openai is not None:
+    _CONNECTION_ERRORS += (openai.APIConnectionError,)
+
+
+class CallsStopped(Exception):
+    """Raised by RetryController.run instead of starting a call after its stop event was set"""
+
+
+def classify_status(status, body=""):
+    """Error class for an HTTP status code, or None for success"""
+    if status is None or status < 400:
+        return None
+    if status == 429:
+        return QUOTA if "insufficient_quota" in str(body) else THROTTLED
+    if status in TRANSIENT_STATUSES or status >= 500:
+        return TRANSIENT
+    return FATAL
+
+
+def error_status(error):
+    """HTTP status carried by an exception (OpenAI or requests), if any"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def classify_error(error):
+    """Error class for an exception raised by an API call"""
+    status = error_status(error)
+    if status is not None:
+        body = getattr(error, "body", None) or getattr(error, "code", None) or str(error)
+        return classify_status(status, body) or FATAL
+    if isinstance(error, _CONNECTION_ERRORS):
+        return TRANSIENT
+    return FATAL
+
+
+def retry_after_seconds(source):
+    """
+    Seconds requested by a Retry-After (or retry-after-ms) header.
+    `source` is a header mapping, a response or an exception carrying a response.
+    """
+    headers = source
+    if hasattr(source, "response"):
+        headers = getattr(source.response, "headers", None)
+    elif hasattr(source, "headers"):
+        headers = source.headers
+    if not headers:
+        return None
+
+    try:
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            return max(0.0, float(value) / 1000)
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and stays open for
+    `reset_timeout` seconds; callers wait for it instead of adding load. After
+    the timeout requests flow again, and the next failure reopens it at once.
+    Thread-safe.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, name="api"):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def wait_time(self):
+        """Seconds until requests may be sent again (0 when closed)"""
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures < self.failure_threshold:
+                return
+            now = time.monotonic()
+            if self.opened_at is None or now >= self.opened_at + self.reset_timeout:
+                self.trips += 1
+                print(f"Circuit '{self.name}' open after {self.failures} consecutive failures; "
+                      f"pausing for {self.reset_timeout:.0f}s")
+            # The failure count is only reset by a success, so after the pause one more failure reopens it
+            self.opened_at = now
+
+
+class RetryPolicy:
+    """
+    Jittered exponential backoff ("full jitter"): attempt n waits a random time
+    up to min(max_delay, base_delay * 2**n), and never less than the server's Retry-After.
+    """
+
+    def __init__(self, max_attempts=6, base_delay=1.0, max_delay=60.0, breaker=None, on_retry=None, seed=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+        self.on_retry = on_retry
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self, attempt, retry_after=None):
+        with self._lock:
+            delay = self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    def should_retry(self, kind, attempt, status=None, idempotent=True):
+        if attempt + 1 >= self.max_attempts or kind not in (THROTTLED, TRANSIENT):
+            return False
+        # A non-idempotent request may have been applied unless the server said otherwise
+        return idempotent or status in SAFE_RETRY_STATUSES
+
+    def call(self, func, idempotent=True):
+        """
+        Run a blocking call with retries and return its result.
+
+        `func` takes no arguments. If it returns an HTTP response, retryable
+        statuses are retried and the last response is returned; exceptions are
+        retried if transient and re-raised once attempts run out.
+        """
+        for attempt in range(self.max_attempts):
+            if self.breaker is not None:
+                time.sleep(self.breaker.wait_time())
+            error = None
+            try:
+                result = func()
+            except Exception as e:
+                error = e
+                kind, status, retry_after = classify_error(e), error_status(e), retry_after_seconds(e)
+            else:
+                status = getattr(result, "status_code", None)
+                kind = classify_status(status, getattr(result, "text", ""))
+                retry_after = retry_after_seconds(result) if kind else None
+
+            if self.breaker is not None:
+                if kind is None:
+                    self.breaker.record_success()
+                elif kind in (THROTTLED, TRANSIENT):
+                    self.breaker.record_failure()
+
+            if kind is None or not self.should_retry(kind, attempt, status, idempotent):
+                if error is not None:
+                    raise error
+                return result
+
+            delay = self.delay(attempt, retry_after)
+            if self.on_retry is not None:
+                self.on_retry(kind, attempt + 1, delay, error or f"HTTP {status}")
+            time.sleep(delay)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency limit for asyncio tasks, used as `async with limit:`.
+
+    Starts at `max_limit`. Each throttling signal halves the limit (at most once
+    per `cooldown` seconds, so one burst of 429s counts once) down to `min_limit`;
+    each success adds 1/limit, so the limit grows back by about one per window of
+    successful calls.
+    """
+
+    def __init__(self, max_limit, min_limit=1, decrease_factor=0.5, cooldown=5.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.decreases = 0
+        self._last_decrease = float("-inf")
+        self._condition = None
+
+    def _get_condition(self):
+        # Created lazily so it binds to the running event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def __aenter__(self):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def on_success(self):
+        self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        previous = int(self.limit)
+        self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+        self.decreases += 1
+        if int(self.limit) != previous:
+            print(f"Throttled: reducing concurrency from {previous} to {int(self.limit)}")
+
+
+class RetryController:
+    """
+    Runs blocking calls from asyncio code with retries, an adaptive concurrency
+    limit and a circuit breaker. Backoff sleeps happen outside the concurrency
+    slot, so waiting tasks do not hold capacity.
+
+    Once `stop` (an asyncio.Event) is set, no further attempt is started, including
+    by calls that are already queued, waiting for the rate limit or backing off.
+    """
+
+    def __init__(self, policy, concurrency, breaker=None, stop=None):
+        self.policy = policy
+        self.concurrency = concurrency
+        self.breaker = breaker
+        self.stop = stop
+
+    def _check_stop(self):
+        if self.stop is not None and self.stop.is_set():
+            raise CallsStopped("calls stopped")
+
+    async def run(self, func, *args, before_attempt=None):
+        """
+        Call func(*args) in a worker thread until it succeeds or fails permanently.
+        `before_attempt` is an optional coroutine function awaited inside the
+        concurrency slot before each attempt (e.g. a rate limiter).
+        Raises CallsStopped if the stop event is set before an attempt starts.
+        """
+        for attempt in range(self.policy.max_attempts):
+            self._check_stop()
+            if self.breaker is not None:
+                while self.breaker.wait_time() > 0:
+                    await asyncio.sleep(self.breaker.wait_time())
+                    self._check_stop()
+
+            async with self.concurrency:
+                self._check_stop()
+                if before_attempt is not None:
+                    await before_attempt()
+                    self._check_stop()
+                try:
+                    result = await asyncio.to_thread(func, *args)
+                except Exception as e:
+                    error = e
+                else:
+                    self.concurrency.on_success()
+                    if self.breaker is not None:
+                        self.breaker.record_success()
+                    return result
+
+            kind = classify_error(error)
+            if kind == THROTTLED:
+                self.concurrency.on_throttle()
+            if kind in (THROTTLED, TRANSIENT) and self.breaker is not None:
+                self.breaker.record_failure()
+            if not self.policy.should_retry(kind, attempt):
+                raise error
+
+            delay = self.policy.delay(attempt, retry_after_seconds(error))
+            if self.policy.on_retry is not None:
+                self.policy.on_retry(kind, attempt + 1, delay, error)
+            await asyncio.sleep(delay)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Pool-based assembly of question sets.
+Questions are bucketed into pools keyed by (test_section, sub_skill, difficulty)
+with O(1) random draw-and-remove. Diagnostic, practice and drill sets are then
+filled from the pools in one linear pass, driven by a constraint spec for
+section counts, difficulty mix and sub-skill coverage. With a fixed seed (and
+the same input order) the output is reproducible.
+
+For incremental runs, SetMembership holds the current contents of existing
+sets and the top_up_* functions draw only what each set is missing.
+"""
+
+import random
+from collections import Counter, defaultdict
+
+DIFFICULTIES = (1, 2, 3, 4, 5)
+
+
+def apportion(total, weights):
+    """
+    Split `total` into integer parts proportional to `weights` (largest remainder method).
+    Returns {key: count} with the counts summing to `total`.
+    """
+    weight_sum = sum(weights.values())
+    if total <= 0 or weight_sum <= 0:
+        return {key: 0 for key in weights}
+    exact = {key: total * weight / weight_sum for key, weight in weights.items()}
+    counts = {key: int(value) for key, value in exact.items()}
+    leftover = total - sum(counts.values())
+    for key in sorted(exact, key=lambda k: counts[k] - exact[k])[:leftover]:
+        counts[key] += 1
+    return counts
+
+
+class SetSpec:
+    """
+    Constraints for one kind of test set.
+
+    `section_counts` maps test_section to the number of questions; `difficulty_mix`
+    maps difficulty to a relative weight. Within a section, questions are spread
+    round-robin over its sub-skills, so every sub-skill appears once the section
+    count reaches the number of sub-skills.
+    """
+
+    def __init__(self, section_counts, difficulty_mix=None):
+        self.section_counts = dict(section_counts)
+        self.difficulty_mix = dict(difficulty_mix or {difficulty: 1 for difficulty in DIFFICULTIES})
+
+
+class QuestionPools:
+    """Questions bucketed by (test_section, sub_skill, difficulty), drawn at random without replacement"""
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self._pools = defaultdict(list)
+        self._sub_skills = defaultdict(list)  # section -> sub-skills in first-seen order
+        self._difficulties = defaultdict(set)  # (section, sub_skill) -> difficulties seen
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, question):
+        section, sub_skill = question["test_section"], question["sub_skill"]
+        if sub_skill not in self._sub_skills[section]:
+            self._sub_skills[section].append(sub_skill)
+        self._difficulties[(section, sub_skill)].add(question["difficulty"])
+        self._pools[(section, sub_skill, question["difficulty"])].append(question)
+        self._size += 1
+
+    def sections(self):
+        return sorted(self._sub_skills)
+
+    def sub_skills(self, section):
+        return sorted(self._sub_skills.get(section, ()))
+
+    def remaining(self, section, sub_skill, difficulty):
+        return len(self._pools.get((section, sub_skill, difficulty), ()))
+
+    def draw(self, section, sub_skill, difficulty):
+        """Remove and return a random question from one pool, or None if it is empty"""
+        pool = self._pools.get((section, sub_skill, difficulty))
+        if not pool:
+            return None
+        # Swap a random element to the end and pop it: O(1) without shifting the list
+        index = self.rng.randrange(len(pool))
+        pool[index], pool[-1] = pool[-1], pool[index]
+        self._size -= 1
+        return pool.pop()
+
+    def draw_nearest(self, section, sub_skill, difficulty):
+        """Draw at `difficulty`, falling back to the closest difficulty with questions left"""
+        for delta in range(len(DIFFICULTIES)):
+            for candidate in ((difficulty,) if delta == 0 else (difficulty - delta, difficulty + delta)):
+                question = self.draw(section, sub_skill, candidate)
+                if question is not None:
+                    return question
+        return None
+
+    def drain(self, section, sub_skill):
+        """Remove and return every remaining question of a sub-skill, in random order"""
+        questions = []
+        for difficulty in sorted(self._difficulties.get((section, sub_skill), ())):
+            pool = self._pools.pop((section, sub_skill, difficulty), [])
+            self.rng.shuffle(pool)
+            questions.extend(pool)
+        self._size -= len(questions)
+        return questions
+
+
+def build_diagnostic(pools):
+    """One question per sub-skill per difficulty level"""
+    return [question
+            for section in pools.sections()
+            for sub_skill in pools.sub_skills(section)
+            for difficulty in DIFFICULTIES
+            for question in [pools.draw(section, sub_skill, difficulty)]
+            if question is not None]
+
+
+def build_set(pools, spec, offset=0):
+    """
+    Fill one set according to `spec`. `offset` rotates the sub-skill order so
+    consecutive sets start their round-robin on different sub-skills.
+    Returns (questions, shortfalls) where shortfalls maps section to missing count.
+    """
+    questions = []
+    shortfalls = {}
+    for section, count in spec.section_counts.items():
+        sub_skills = pools.sub_skills(section)
+        if not sub_skills:
+            shortfalls[section] = count
+            continue
+        cursor = offset % len(sub_skills)
+        missing = 0
+        for difficulty, target in apportion(count, spec.difficulty_mix).items():
+            for _ in range(target):
+                question = None
+                # Try each sub-skill at most once, starting from the round-robin cursor
+                for _ in range(len(sub_skills)):
+                    question = pools.draw_nearest(section, sub_skills[cursor], difficulty)
+                    cursor = (cursor + 1) % len(sub_skills)
+                    if question is not None:
+                        break
+                if question is None:
+                    missing += 1
+                else:
+                    questions.append(question)
+        if missing:
+            shortfalls[section] = missing
+    return questions, shortfalls
+
+
+class SetMembership:
+    """Current number of questions per set, counted by (test_section, sub_skill, difficulty)"""
+
+    def __init__(self):
+        self._counts = defaultdict(Counter)  # set_id -> Counter of cells
+        self._cells = set()  # every (section, sub_skill) seen in any set
+
+    def add(self, set_id, section, sub_skill, difficulty, count=1):
+        self._counts[set_id][(section, sub_skill, difficulty)] += count
+        self._cells.add((section, sub_skill))
+
+    def add_questions(self, set_id, questions):
+        for question in questions:
+            self.add(set_id, question["test_section"], question["sub_skill"], question["difficulty"])
+
+    def size(self, set_id):
+        return sum(self._counts[set_id].values())
+
+    def count(self, set_id, section, sub_skill=None, difficulty=None):
+        return sum(count for (cell_section, cell_sub_skill, cell_difficulty), count in self._counts[set_id].items()
+                   if cell_section == section
+                   and (sub_skill is None or cell_sub_skill == sub_skill)
+                   and (difficulty is None or cell_difficulty == difficulty))
+
+    def sub_skills(self):
+        return sorted(self._cells)
+
+
+def top_up_diagnostic(pools, membership, set_id="diagnostic"):
+    """
+    Fill the diagnostic cells (one question per sub-skill per difficulty) that
+    are still empty. Sub-skills already in the set or with raw questions are covered.
+    """
+    cells = set(membership.sub_skills()) | {(section, sub_skill)
+                                            for section in pools.sections()
+                                            for sub_skill in pools.sub_skills(section)}
+    questions = []
+    for section, sub_skill in sorted(cells):
+        for difficulty in DIFFICULTIES:
+            if membership.count(set_id, section, sub_skill, difficulty):
+                continue
+            question = pools.draw(section, sub_skill, difficulty)
+            if question is not None:
+                questions.append(question)
+    membership.add_questions(set_id, questions)
+    return questions
+
+
+def top_up_set(pools, spec, membership, set_id):
+    """
+    Add only what an existing set is missing under `spec`.
+
+    The deficit is computed per section and difficulty (target minus current
+    count), capped so a section never grows past its total. Each missing
+    question comes from the sub-skill the set holds the fewest of in that
+    section, falling back to the nearest difficulty like build_set.
+    Returns (questions, shortfalls) as build_set does.
+    """
+    questions = []
+    shortfalls = {}
+    for section, count in spec.section_counts.items():
+        sub_skills = pools.sub_skills(section)
+        room = count - membership.count(set_id, section)
+        missing = 0
+        for difficulty, target in apportion(count, spec.difficulty_mix).items():
+            deficit = min(room, target - membership.count(set_id, section, difficulty=difficulty))
+            for _ in range(max(0, deficit)):
+                question = None
+                for sub_skill in sorted(sub_skills, key=lambda name: membership.count(set_id, section, name)):
+                    question = pools.draw_nearest(section, sub_skill, difficulty)
+                    if question is not None:
+                        break
+                if question is None:
+                    missing += 1
+                    continue
+                membership.add_questions(set_id, [question])
+                questions.append(question)
+                room -= 1
+        if missing:
+            shortfalls[section] = missing
+    return questions, shortfalls
+
+
+def drill_set_id(sub_skill):
+    return f"drill-{sub_skill.replace(' ', '-').lower()}"
+
+
+def build_drills(pools):
+    """Every remaining question, grouped into one drill set per sub-skill"""
+    drills = defaultdict(list)
+    for section in pools.sections():
+        for sub_skill in pools.sub_skills(section):
+            questions = pools.drain(section, sub_skill)
+            if questions:
+                drills[drill_set_id(sub_skill)].extend(questions)
+    return dict(drills)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Local SQLite mirror of the educoach_questions table.
+Metadata columns are stored as indexed SQL columns and the full row as JSON,
+so audits, set planning dry runs and benchmarks can read the table offline.
+Syncs are incremental: new rows are fetched by id and changed rows by updated_at.
+
+A snapshot offers the same read functions as utils.supabase_helpers
+(iter_rows, count_rows, fetch_inventory), so scripts can read from either one.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from utils import supabase_helpers
+from utils.supabase_helpers import SUPABASE_TABLE, INVENTORY_COLUMNS
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_SNAPSHOT_PATH = os.path.join(REPO_ROOT, "snapshots", f"{SUPABASE_TABLE}.sqlite3")
+
+# Columns stored (and indexed) outside the JSON row, so filters and counts never parse JSON
+METADATA_COLUMNS = ("id", "test_type", "test_section", "sub_skill", "difficulty", "set_id",
+                    "question_type", "input_type", "created_at", "updated_at")
+COLUMN_TYPES = {"id": "INTEGER PRIMARY KEY", "difficulty": "INTEGER"}
+
+_OPERATORS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+def filter_sql(column, expression):
+    """
+    Translate one PostgREST filter (e.g. "eq.EduTest", "in.(raw,diagnostic)",
+    "not.is.null") on a metadata column into a SQL condition and its parameters.
+    """
+    if column not in METADATA_COLUMNS:
+        raise ValueError(f"Snapshot can only filter on {', '.join(METADATA_COLUMNS)}, not {column}")
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[len("not."):]
+    operator, _, value = expression.partition(".")
+
+    if operator == "is":
+        if value != "null":
+            raise ValueError(f"Unsupported filter {column}=is.{value}")
+        sql, params = f"{column} IS NULL", []
+    elif operator == "in":
+        values = [item.strip().strip('"') for item in value.strip("()").split(",") if item.strip()]
+        sql, params = f"{column} IN ({','.join('?' * len(values))})", values
+    elif operator in _OPERATORS:
+        sql, params = f"{column} {_OPERATORS[operator]} ?", [value]
+    else:
+        raise ValueError(f"Unsupported filter {column}={expression}")
+    return (f"NOT ({sql})" if negate else sql), params
+
+
+def where_clause(filters):
+    conditions, params = [], []
+    for column, expression in (filters or {}).items():
+        sql, values = filter_sql(column, expression)
+        conditions.append(sql)
+        params.extend(values)
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+
+class QuestionSnapshot:
+    """
+    SQLite snapshot of educoach_questions with incremental sync.
+
+    Read methods accept the same `select` projections and PostgREST-style
+    `filters` as the Supabase helpers (filters must be on METADATA_COLUMNS).
+    Safe to share between threads.
+    """
+
+    def __init__(self, path=DEFAULT_SNAPSHOT_PATH, table=SUPABASE_TABLE):
+        self.path = path
+        self.table = table
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        columns = ", ".join(f"{column} {COLUMN_TYPES.get(column, 'TEXT')}" for column in METADATA_COLUMNS)
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS questions ({columns}, data TEXT NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS questions_cell ON questions "
+                         "(test_type, test_section, sub_skill, difficulty, set_id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS questions_set ON questions (test_type, set_id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS questions_updated ON questions (updated_at)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def meta(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def upsert(self, rows):
+        """Insert or replace full rows; returns the number written"""
+        records = [tuple(row.get(column) for column in METADATA_COLUMNS) + (json.dumps(row, ensure_ascii=False),)
+                   for row in rows]
+        with self._lock:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO questions ({', '.join(METADATA_COLUMNS)}, data) "
+                f"VALUES ({', '.join('?' * (len(METADATA_COLUMNS) + 1))})", records)
+            self._db.commit()
+        return len(records)
+
+    def _upsert_stream(self, rows, chunk_size=supabase_helpers.DEFAULT_PAGE_SIZE):
+        written, chunk = 0, []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                written += self.upsert(chunk)
+                chunk = []
+        return written + self.upsert(chunk)
+
+    def sync(self, full=False):
+        """
+        Bring the snapshot up to date with Supabase.
+
+        Rows with an id above the highest local id are fetched as new; older rows
+        whose updated_at is at or after the newest local updated_at are fetched
+        again, which picks up set_id changes. If no local row has an updated_at,
+        changed rows cannot be found, so the snapshot is rebuilt as in a full sync.
+        Deleted rows are only removed by a full sync. Returns a summary dict.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            last_id, last_updated = self._db.execute(
+                "SELECT MAX(id), MAX(updated_at) FROM questions").fetchone()
+        if last_id is not None and last_updated is None:
+            full = True
+
+        if full:
+            with self._lock:
+                self._db.execute("DELETE FROM questions")
+                self._db.execute("DELETE FROM meta")
+                self._db.commit()
+            last_id = last_updated = None
+
+        updated = 0
+        if last_updated is not None:
+            updated = self._upsert_stream(supabase_helpers.iter_rows(
+                self.table, filters={"updated_at": f"gte.{last_updated}"}, up_to_id=last_id))
+        new = self._upsert_stream(supabase_helpers.iter_rows(self.table, after_id=last_id))
+
+        remote = supabase_helpers.count_rows(self.table)
+        local = len(self)
+        with self._lock:
+            self._set_meta("synced_at", datetime.now(timezone.utc).isoformat())
+            self._db.commit()
+        return {"new": new, "updated": updated, "rows": local, "remote_rows": remote, "full": full,
+                "seconds": time.perf_counter() - start}
+
+    def iter_rows(self, table=SUPABASE_TABLE, select="*", filters=None, page_size=None):
+        """Yield rows in id order, like supabase_helpers.iter_rows"""
+        columns = [column.strip() for column in select.split(",")]
+        where, params = where_clause(filters)
+        with self._lock:
+            if "*" not in columns and all(column in METADATA_COLUMNS for column in columns):
+                cursor = self._db.execute(f"SELECT {', '.join(columns)} FROM questions{where} ORDER BY id", params)
+                rows = [dict(zip(columns, record)) for record in cursor]
+            else:
+                cursor = self._db.execute(f"SELECT data FROM questions{where} ORDER BY id", params)
+                rows = [json.loads(data) for data, in cursor]
+        if "*" in columns:
+            yield from rows
+        else:
+            for row in rows:
+                yield {column: row.get(column) for column in columns}
+
+    def count_rows(self, table=SUPABASE_TABLE, filters=None):
+        where, params = where_clause(filters)
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM questions{where}", params).fetchone()[0]
+
+    def fetch_inventory(self, filters=None, page_size=None):
+        """Question counts per inventory cell, like supabase_helpers.fetch_inventory"""
+        where, params = where_clause(filters)
+        columns = ", ".join(INVENTORY_COLUMNS)
+        with self._lock:
+            cursor = self._db.execute(
+                f"SELECT {columns}, COUNT(*) FROM questions{where} GROUP BY {columns} ORDER BY {columns}", params)
+            return [dict(zip(INVENTORY_COLUMNS, record[:-1]), question_count=record[-1]) for record in cursor]
+
+
+def open_source(snapshot_path=None):
+    """
+    Where scripts read questions from: a QuestionSnapshot at `snapshot_path`,
+    or the supabase_helpers module (live reads) when no path is given.
+    Both provide iter_rows, count_rows and fetch_inventory.
+    """
+    if snapshot_path is None:
+        return supabase_helpers
+    if not os.path.exists(snapshot_path):
+        raise FileNotFoundError(f"No snapshot at {snapshot_path}; run scripts/snapshot_questions.py first")
+    return QuestionSnapshot(snapshot_path)
@@ -2,6 +2,515 @@
 """
 Helper functions for interacting with Supabase.
 Includes utilities for uploading generated questions to the database.
+
+Every request goes through one SupabaseClient per process (get_client()): a
+pooled requests.Session that keeps connections alive between calls, asks for
+gzip-compressed responses, applies a (connect, read) timeout to every request
+and retries through the shared retry policy and circuit breaker.
 """
 
-# This file will be implemented in a future task 
\ No newline at end of file
+import os
+import sys
+import json
+import time
+import threading
+from collections import defaultdict
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.metrics import REGISTRY
+from utils.resilience import CircuitBreaker, RetryPolicy, classify_status, FATAL
+
+# Default table for generated questions
+SUPABASE_TABLE = "educoach_questions"
+# Reading passages shared by several questions (supabase/migrations)
+PASSAGES_TABLE = "educoach_passages"
+
+# Bulk insert settings
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_FLUSH_INTERVAL = 5.0  # seconds
+
+# Connection pool and timeouts shared by every Supabase request
+POOL_SIZE = 32  # connections kept alive per host; at least the number of worker threads
+CONNECT_TIMEOUT = 5.0  # seconds
+READ_TIMEOUT = 60.0  # seconds without a byte from the server
+
+# Streaming read settings
+DEFAULT_PAGE_SIZE = 1000  # matches PostgREST's default max-rows on Supabase
+
+# Inventory settings
+INVENTORY_VIEW = "educoach_question_inventory"
+INVENTORY_COLUMNS = ["test_type", "test_section", "sub_skill", "difficulty", "set_id"]
+
+# Set assignment settings
+ASSIGN_SETS_RPC = "assign_question_sets"
+IMAGE_URLS_RPC = "set_question_image_urls"
+# Questions with a renderable diagram_spec and no image_url (supabase/migrations)
+DIAGRAMS_PENDING_VIEW = "educoach_question_diagrams_pending"
+IN_FILTER_CHUNK_SIZE = 200  # ids per id=in.(...) filter, keeps URLs well under server limits
+
+# Error codes that reject every row of a table alike (missing column or table, no permission).
+# Other errors can come from a single row even when their message does not say which.
+SCHEMA_ERROR_CODES = {"PGRST204", "PGRST205", "42P01", "42703", "42501"}
+
+REQUEST_SECONDS = REGISTRY.histogram("educoach_supabase_request_seconds",
+                                     "Latency of Supabase write requests by operation")
+REQUESTS = REGISTRY.counter("educoach_supabase_requests_total",
+                            "Supabase write requests by operation and HTTP status")
+ROWS_WRITTEN = REGISTRY.counter("educoach_supabase_rows_written_total",
+                                "Rows inserted or updated by operation")
+RETRIES = REGISTRY.counter("educoach_supabase_retries_total", "Supabase requests retried, by error class")
+HTTP_SECONDS = REGISTRY.histogram("educoach_supabase_http_seconds",
+                                  "Latency of every Supabase HTTP attempt by method, path and status")
+
+
+def _report_retry(kind, attempt, delay, failure):
+    RETRIES.inc(kind=kind)
+    print(f"Supabase {kind} error ({failure}); retry {attempt} in {delay:.1f}s", file=sys.stderr)
+
+
+# Shared by every Supabase call in the process, so an outage pauses all of them
+SUPABASE_BREAKER = CircuitBreaker(failure_threshold=5, reset_timeout=15.0, name="supabase")
+SUPABASE_RETRY = RetryPolicy(max_attempts=5, base_delay=0.5, max_delay=30.0,
+                             breaker=SUPABASE_BREAKER, on_retry=_report_retry)
+
+
+def in_filter(values):
+    """PostgREST filter value for column in (values); values are quoted so commas and spaces are safe"""
+    quoted = ",".join('"{}"'.format(str(value).replace('"', '\\"')) for value in values)
+    return f"in.({quoted})"
+
+
+class SupabaseClient:
+    """
+    Pooled HTTP client for the Supabase REST API.
+
+    Requests share one requests.Session, so connections are kept alive and
+    reused, up to `pool_size` per host. Every request has a (connect, read)
+    `timeout` unless the call passes its own, and is retried by `retry`.
+    Responses are gzip-compressed by the server. Hooks added with add_hook() are
+    called after every attempt as hook(method, url, status, seconds); status is
+    None when no response arrived. The client is thread-safe.
+    """
+
+    def __init__(self, url=None, key=None, pool_size=POOL_SIZE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 retry=SUPABASE_RETRY):
+        self.url = url
+        self.key = key
+        self.timeout = timeout
+        self.retry = retry
+        self.hooks = []
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip"
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def headers(self, prefer=None):
+        """Auth headers, read from the environment unless the client was given a key"""
+        key = self.key or os.getenv("SUPABASE_KEY")
+        headers = {
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json",
+        }
+        if prefer:
+            headers["Prefer"] = prefer
+        return headers
+
+    def table_url(self, table=SUPABASE_TABLE):
+        return f"{self.url or os.getenv('SUPABASE_URL')}/rest/v1/{table}"
+
+    def rpc_url(self, function_name):
+        return f"{self.url or os.getenv('SUPABASE_URL')}/rest/v1/rpc/{function_name}"
+
+    def request(self, method, url, idempotent=True, **kwargs):
+        """
+        Send a request and return the last response. 429s, 5xx and connection
+        errors are retried with backoff; pass idempotent=False for inserts so
+        they are only retried when the server reports the request was not applied.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+
+        def attempt():
+            start = time.perf_counter()
+            status = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+                status = response.status_code
+                return response
+            finally:
+                for hook in self.hooks:
+                    hook(method, url, status, time.perf_counter() - start)
+
+        return self.retry.call(attempt, idempotent)
+
+    def select(self, table, filters=None, prefer=None, **params):
+        """GET rows from a table or view; `filters` are PostgREST filters, `params` e.g. select, order, limit"""
+        return self.request("GET", self.table_url(table), headers=self.headers(prefer),
+                            params=dict(filters or {}, **params))
+
+    def count(self, table, filters=None):
+        """HEAD request with an exact count; the total is in the Content-Range header"""
+        return self.request("HEAD", self.table_url(table), headers=self.headers("count=exact"),
+                            params=dict(filters or {}, select="id"))
+
+    def insert(self, table, rows, prefer="return=minimal", params=None, idempotent=False):
+        """POST one row or a list of rows"""
+        return self.request("POST", self.table_url(table), idempotent=idempotent,
+                            headers=self.headers(prefer), params=params, json=rows)
+
+    def update(self, table, values, filters, prefer="return=minimal"):
+        """PATCH `values` into the rows matching `filters`"""
+        return self.request("PATCH", self.table_url(table), headers=self.headers(prefer),
+                            params=filters, json=values)
+
+    def rpc(self, function_name, payload):
+        """POST to a Postgres function exposed through PostgREST"""
+        return self.request("POST", self.rpc_url(function_name), headers=self.headers(), json=payload)
+
+    def close(self):
+        self.session.close()
+
+
+def record_http_time(method, url, status, seconds):
+    """SupabaseClient hook: time every attempt, reads included, in HTTP_SECONDS"""
+    HTTP_SECONDS.observe(seconds, method=method, path=url.rsplit("/", 1)[-1], status=status or "error")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The process-wide SupabaseClient, created on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = SupabaseClient()
+            _client.add_hook(record_http_time)
+        return _client
+
+
+def iter_rows(table=SUPABASE_TABLE, select="*", filters=None, page_size=DEFAULT_PAGE_SIZE,
+              after_id=None, up_to_id=None):
+    """
+    Yield rows from a table page by page using keyset pagination on `id`.
+
+    `select` is a PostgREST column projection (e.g. "id,sub_skill,difficulty");
+    `id` is always fetched because it is the pagination cursor. `filters` is a
+    dict of PostgREST filters such as {"test_type": "eq.EduTest"}. Only one page
+    is held in memory at a time, and unlike a single `select=*` request the
+    results are not truncated at the server's row cap. `after_id` and `up_to_id`
+    bound the id range (exclusive and inclusive).
+    """
+    filters = dict(filters or {})
+    if "id" in filters:
+        raise ValueError("iter_rows paginates on id; filter on another column")
+
+    columns = [column.strip() for column in select.split(",")]
+    if "*" not in columns and "id" not in columns:
+        columns.insert(0, "id")
+
+    if up_to_id is not None:
+        filters["and"] = f"(id.lte.{up_to_id})"
+
+    last_id = after_id
+    while True:
+        params = dict(filters, select=",".join(columns), order="id.asc", limit=page_size)
+        if last_id is not None:
+            params["id"] = f"gt.{last_id}"
+
+        response = get_client().select(table, params)
+        response.raise_for_status()
+        page = response.json()
+
+        # The server may cap pages below page_size, so only an empty page marks the end
+        if not page:
+            return
+        yield from page
+        last_id = page[-1]["id"]
+
+
+def count_rows(table=SUPABASE_TABLE, filters=None):
+    """
+    Count matching rows on the server with a HEAD request and `Prefer: count=exact`.
+    No rows are transferred; the total is read from the Content-Range header.
+    """
+    response = get_client().count(table, filters)
+    response.raise_for_status()
+    # Content-Range looks like "0-24/3573" or "*/0"
+    return int(response.headers["Content-Range"].split("/")[-1])
+
+
+def fetch_inventory(filters=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Return question counts grouped by test_type, test_section, sub_skill,
+    difficulty and set_id, as a list of dicts with a `question_count` key.
+
+    Reads the `educoach_question_inventory` view (supabase/migrations). If the
+    view is not installed, falls back to tallying the metadata columns client-side.
+    """
+    cells = []
+    offset = 0
+    while True:
+        response = get_client().select(INVENTORY_VIEW, filters,
+                                       select=",".join(INVENTORY_COLUMNS + ["question_count"]),
+                                       order=",".join(INVENTORY_COLUMNS), limit=page_size, offset=offset)
+        if response.status_code == 404 and offset == 0:
+            print(f"Warning: view '{INVENTORY_VIEW}' not found, counting rows client-side", file=sys.stderr)
+            return _tally_inventory(filters, page_size)
+        response.raise_for_status()
+
+        page = response.json()
+        if not page:
+            return cells
+        cells.extend(page)
+        offset += len(page)
+
+
+def _tally_inventory(filters, page_size):
+    counts = defaultdict(int)
+    for row in iter_rows(select=",".join(INVENTORY_COLUMNS), filters=filters, page_size=page_size):
+        counts[tuple(row.get(column) for column in INVENTORY_COLUMNS)] += 1
+    return [dict(zip(INVENTORY_COLUMNS, key), question_count=count) for key, count in counts.items()]
+
+
+def rollup_inventory(cells, dimensions):
+    """Sum inventory cells over every column not listed in `dimensions`"""
+    counts = defaultdict(int)
+    for cell in cells:
+        counts[tuple(cell.get(dimension) for dimension in dimensions)] += cell["question_count"]
+    return [dict(zip(dimensions, key), question_count=count) for key, count in counts.items()]
+
+
+def assign_set_ids(assignments, table=SUPABASE_TABLE):
+    """
+    Apply a {question id: set_id} map to the questions table.
+
+    Uses the `assign_question_sets` RPC (supabase/migrations) so the whole map
+    is applied in a single transaction. If the function is not installed, falls
+    back to one PATCH per set with `id=in.(...)` chunks, which is fast but not atomic.
+    Returns the number of questions updated.
+    """
+    return _apply_column_map(assignments, "set_id", ASSIGN_SETS_RPC, "assignments", "assign_sets", table)
+
+
+def set_image_urls(urls, table=SUPABASE_TABLE):
+    """
+    Apply a {question id: image_url} map to the questions table, the same way
+    as assign_set_ids: one `set_question_image_urls` RPC call, or one PATCH per
+    distinct URL if the function is not installed. Returns the number updated.
+    """
+    return _apply_column_map(urls, "image_url", IMAGE_URLS_RPC, "urls", "image_urls", table)
+
+
+def is_schema_error(error):
+    """True if a PostgREST error body names a problem with the table itself rather than a row"""
+    try:
+        code = json.loads(error).get("code")
+    except (TypeError, ValueError, AttributeError):
+        return False
+    return code in SCHEMA_ERROR_CODES
+
+
+def _apply_column_map(values, column, function_name, argument, operation, table):
+    if not values:
+        return 0
+
+    with REQUEST_SECONDS.time(operation=f"{operation}_rpc", table=table):
+        response = get_client().rpc(
+            function_name, {argument: {str(question_id): value for question_id, value in values.items()}})
+    REQUESTS.inc(operation=f"{operation}_rpc", table=table, status=response.status_code)
+    if response.status_code < 300:
+        updated = response.json()
+        ROWS_WRITTEN.inc(updated, operation=f"{operation}_rpc", table=table)
+        return updated
+    if response.status_code != 404:
+        print(f"Error applying {column} updates: {response.status_code}")
+        print(response.text)
+        response.raise_for_status()
+
+    print(f"Warning: RPC '{function_name}' not found, falling back to per-value updates (not atomic)",
+          file=sys.stderr)
+
+    ids_by_value = defaultdict(list)
+    for question_id, value in values.items():
+        ids_by_value[value].append(question_id)
+
+    # updated_at is left to the trigger in 20250520000400_questions_updated_at.sql, which uses the server clock
+    updated = 0
+    for value, ids in ids_by_value.items():
+        for i in range(0, len(ids), IN_FILTER_CHUNK_SIZE):
+            chunk = ids[i:i + IN_FILTER_CHUNK_SIZE]
+            with REQUEST_SECONDS.time(operation=f"{operation}_patch", table=table):
+                response = get_client().update(
+                    table, {column: value},
+                    {"id": f"in.({','.join(str(question_id) for question_id in chunk)})"})
+            REQUESTS.inc(operation=f"{operation}_patch", table=table, status=response.status_code)
+            response.raise_for_status()
+            ROWS_WRITTEN.inc(len(chunk), operation=f"{operation}_patch", table=table)
+            updated += len(chunk)
+    return updated
+
+
+def upsert_rows(rows, table, on_conflict="id"):
+    """
+    Insert rows, skipping any whose `on_conflict` key already exists
+    (`Prefer: resolution=ignore-duplicates`). Safe to retry. Returns the number of rows sent.
+    """
+    if not rows:
+        return 0
+    with REQUEST_SECONDS.time(operation="upsert", table=table):
+        response = get_client().insert(table, rows, "resolution=ignore-duplicates,return=minimal",
+                                       {"on_conflict": on_conflict}, idempotent=True)
+    REQUESTS.inc(operation="upsert", table=table, status=response.status_code)
+    response.raise_for_status()
+    ROWS_WRITTEN.inc(len(rows), operation="upsert", table=table)
+    return len(rows)
+
+
+def prepare_question_row(question_data):
+    """
+    Return a copy of a generated question ready for insertion.
+    Drops fields that Supabase generates itself (id and an empty question_id).
+    """
+    row = dict(question_data)
+    row.pop("id", None)
+    if row.get("question_id") in ("", None):
+        row.pop("question_id", None)
+    return row
+
+
+class BulkInserter:
+    """
+    Buffers rows and inserts them as JSON arrays.
+
+    The buffer is flushed when it reaches `batch_size` rows, and by a background
+    timer once rows have waited `flush_interval` seconds, so a slow trickle of
+    rows is still written (and checkpointed) promptly. Call `close()` (or use
+    the inserter as a context manager) to stop the timer and send the remainder.
+
+    If PostgREST rejects a batch, the batch is split in half and retried so the
+    offending rows are isolated; each failed row is recorded in `failures` with
+    its tag, status code and error text. Errors that affect every row alike
+    (SCHEMA_ERROR_CODES, e.g. a missing column) fail the batch without
+    splitting. The inserter is thread-safe.
+    """
+
+    def __init__(self, table=SUPABASE_TABLE, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, on_success=None, on_failure=None):
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_success = on_success
+        self.on_failure = on_failure
+
+        self.inserted = 0
+        self.requests = 0
+        self.failures = []
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._closed = threading.Event()
+        self._timer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, row, tag=None):
+        """Queue a row for insertion. `tag` is passed back to the callbacks."""
+        with self._lock:
+            self._buffer.append((tag, row))
+            due = len(self._buffer) >= self.batch_size
+            if self._timer is None and self.flush_interval:
+                self._timer = threading.Thread(target=self._flush_periodically, daemon=True,
+                                               name=f"flush-{self.table}")
+                self._timer.start()
+        if due:
+            self.flush()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval / 2):
+            with self._lock:
+                due = self._buffer and time.monotonic() - self._last_flush >= self.flush_interval
+            if due:
+                self.flush()
+
+    def flush(self):
+        """Insert everything currently buffered"""
+        with self._lock:
+            pending, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+
+        for i in range(0, len(pending), self.batch_size):
+            self._insert_batch(pending[i:i + self.batch_size])
+
+    def close(self):
+        """Stop the flush timer and insert the remaining rows"""
+        self._closed.set()
+        if self._timer is not None:
+            self._timer.join()
+        self.flush()
+
+    def _insert_batch(self, batch):
+        failure = self._send(batch)
+        if failure is not None:
+            self._isolate_failures(batch, failure)
+
+    def _send(self, batch):
+        """One insert request. Returns None on success, else (status, error text)"""
+        rows = [row for _, row in batch]
+        # PostgREST requires the same keys on every object unless the column list is given
+        columns = sorted({key for row in rows for key in row})
+
+        start = time.perf_counter()
+        try:
+            response = get_client().insert(self.table, rows, "return=minimal,missing=default",
+                                           {"columns": ",".join(columns)})
+            status, error = response.status_code, response.text
+        except requests.exceptions.RequestException as e:
+            status, error = None, str(e)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, operation="insert", table=self.table)
+        REQUESTS.inc(operation="insert", table=self.table, status=status or "error")
+
+        with self._lock:
+            self.requests += 1
+
+        if status is not None and status < 300:
+            ROWS_WRITTEN.inc(len(batch), operation="insert", table=self.table)
+            with self._lock:
+                self.inserted += len(batch)
+            if self.on_success:
+                self.on_success([tag for tag, _ in batch])
+            return None
+        return status, error
+
+    def _isolate_failures(self, batch, failure):
+        status, error = failure
+        # A non-retryable 4xx means some row is invalid: bisect to find it and keep the good rows.
+        # Schema errors reject every row, so splitting them would only add requests.
+        if classify_status(status) == FATAL and len(batch) > 1 and not is_schema_error(error):
+            middle = len(batch) // 2
+            for half in (batch[:middle], batch[middle:]):
+                half_failure = self._send(half)
+                if half_failure is not None:
+                    self._isolate_failures(half, half_failure)
+            return
+        self._fail(batch, status, error)
+
+    def _fail(self, batch, status, error):
+        for tag, row in batch:
+            failure = {"tag": tag, "row": row, "status": status, "error": error}
+            with self._lock:
+                self.failures.append(failure)
+            if self.on_failure:
+                self.on_failure(failure)
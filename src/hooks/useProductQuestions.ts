@@ -15,10 +15,42 @@ type EducoachQuestion = {
   difficulty: string;
   topic: string;
   sub_skill: string;
+  linked_passage_id: string | null;
   created_at: string;
   updated_at: string | null;
+  passage?: EducoachPassage;
 };
 
+type EducoachPassage = {
+  id: string;
+  title: string | null;
+  passage: string;
+};
+
+// Questions about the same passage share one row in educoach_passages; load each passage once
+async function attachPassages(questions: EducoachQuestion[]) {
+  const passageIds = [...new Set(questions.map((q) => q.linked_passage_id).filter(Boolean))] as string[];
+  if (passageIds.length === 0) {
+    return questions;
+  }
+
+  const { data, error } = await supabase
+    .from('educoach_passages')
+    .select('id, title, passage')
+    .in('id', passageIds);
+
+  if (error) {
+    console.error('Error fetching passages:', error);
+    return questions;
+  }
+
+  const passages = new Map((data as EducoachPassage[]).map((p) => [p.id, p]));
+  return questions.map((q) => {
+    const passage = q.linked_passage_id ? passages.get(q.linked_passage_id) : undefined;
+    return passage ? { ...q, passage } : q;
+  });
+}
+
 export function useProductQuestions(setId?: string) {
   const { selectedProduct } = useProduct();
   
@@ -60,7 +92,7 @@ export function useProductQuestions(setId?: string) {
         console.log('Fetched questions count:', data?.length || 0);
         console.log('First question sample:', data?.[0] || 'No questions found');
         
-        return data as EducoachQuestion[];
+        return attachPassages(data as EducoachQuestion[]);
       } catch (error) {
         console.error('Error in useProductQuestions:', error);
         return [];
@@ -50,6 +50,7 @@ export type Database = {
           difficulty: string
           topic: string
           sub_skill: string
+          linked_passage_id: string | null
           created_at: string
           updated_at: string | null
         }
@@ -66,6 +67,7 @@ export type Database = {
           difficulty: string
           topic: string
           sub_skill: string
+          linked_passage_id?: string | null
           created_at?: string
           updated_at?: string | null
         }
@@ -82,11 +84,51 @@ export type Database = {
           difficulty?: string
           topic?: string
           sub_skill?: string
+          linked_passage_id?: string | null
           created_at?: string
           updated_at?: string | null
         }
         Relationships: []
       }
+      educoach_passages: {
+        Row: {
+          id: string
+          test_type: string
+          year_level: string | null
+          test_section: string
+          difficulty: number | null
+          title: string | null
+          text_type: string | null
+          passage: string
+          word_count: number | null
+          created_at: string
+        }
+        Insert: {
+          id: string
+          test_type: string
+          year_level?: string | null
+          test_section: string
+          difficulty?: number | null
+          title?: string | null
+          text_type?: string | null
+          passage: string
+          word_count?: number | null
+          created_at?: string
+        }
+        Update: {
+          id?: string
+          test_type?: string
+          year_level?: string | null
+          test_section?: string
+          difficulty?: number | null
+          title?: string | null
+          text_type?: string | null
+          passage?: string
+          word_count?: number | null
+          created_at?: string
+        }
+        Relationships: []
+      }
       student_question_attempts: {
         Row: {
           id: number
@@ -0,0 +1,17 @@
+-- Apply a whole set_id assignment map to educoach_questions in one transaction.
+-- assignments: {"<question id>": "<set_id>", ...}
+-- Returns the number of rows updated.
+create or replace function public.assign_question_sets(assignments jsonb)
+returns integer
+language sql
+as $$
+  with updated as (
+    update public.educoach_questions as q
+    set set_id = a.value,
+        updated_at = now()
+    from jsonb_each_text(assignments) as a(key, value)
+    where q.id = a.key::bigint
+    returning q.id
+  )
+  select count(*)::integer from updated;
+$$;
@@ -0,0 +1,12 @@
+-- Question counts per test_type x section x sub_skill x difficulty x set_id.
+-- Lets inventory tooling fetch every cell count in one small request.
+create or replace view public.educoach_question_inventory as
+select
+  test_type,
+  test_section,
+  sub_skill,
+  difficulty,
+  set_id,
+  count(*)::integer as question_count
+from public.educoach_questions
+group by test_type, test_section, sub_skill, difficulty, set_id;
@@ -0,0 +1,30 @@
+-- Apply a map of rendered diagram URLs to educoach_questions in one transaction.
+-- urls: {"<question id>": "<image_url>", ...}
+-- Returns the number of rows updated.
+create or replace function public.set_question_image_urls(urls jsonb)
+returns integer
+language sql
+as $$
+  with updated as (
+    update public.educoach_questions as q
+    set image_url = u.value,
+        updated_at = now()
+    from jsonb_each_text(urls) as u(key, value)
+    where q.id = u.key::bigint
+    returning q.id
+  )
+  select count(*)::integer from updated;
+$$;
+
+-- Questions whose diagram_spec is a JSON scene and that have no image yet.
+-- The generator uploads a missing image as "" (e.g. with --no-diagrams or after a
+-- failed render), so an empty image_url counts as missing, like a null one.
+-- Empty and free-text specs from older generations can never be rendered,
+-- so they are left out instead of being fetched again on every backfill.
+create or replace view public.educoach_question_diagrams_pending as
+select id, test_type, diagram_spec
+from public.educoach_questions
+where coalesce(image_url, '') = ''
+  and diagram_spec is not null
+  and btrim(diagram_spec::text) like '{%'
+  and diagram_spec::text like '%"shapes"%';
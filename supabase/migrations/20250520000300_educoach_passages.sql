@@ -0,0 +1,31 @@
+-- Reading passages shared by several questions.
+-- id is content-addressed ("psg_" + SHA-256 of the normalised text), so the
+-- generator can insert with on_conflict=id and a repeated passage is stored once.
+create table if not exists public.educoach_passages (
+  id text primary key,
+  test_type text not null,
+  year_level text,
+  test_section text not null,
+  difficulty integer,
+  title text,
+  text_type text,
+  passage text not null,
+  word_count integer,
+  created_at timestamptz not null default now()
+);
+
+create index if not exists educoach_passages_cell
+  on public.educoach_passages (test_type, test_section, difficulty);
+
+alter table public.educoach_passages enable row level security;
+
+create policy "Passages are readable by everyone"
+  on public.educoach_passages for select
+  using (true);
+
+-- Questions about a shared passage point at it; the frontend loads each passage once per group.
+alter table public.educoach_questions add column if not exists linked_passage_id text;
+
+create index if not exists educoach_questions_linked_passage
+  on public.educoach_questions (linked_passage_id)
+  where linked_passage_id is not null;
@@ -0,0 +1,27 @@
+-- Keep educoach_questions.updated_at current on the server, so incremental
+-- snapshot syncs (scripts/utils/snapshot.py) see every change, whoever makes it
+-- and whatever the client clock says.
+alter table public.educoach_questions
+  alter column updated_at set default now();
+
+-- Rows written before this migration get their creation time, so MAX(updated_at) is never null
+update public.educoach_questions
+set updated_at = coalesce(created_at, now())
+where updated_at is null;
+
+create or replace function public.educoach_touch_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.updated_at = now();
+  return new;
+end;
+$$;
+
+drop trigger if exists educoach_questions_updated_at on public.educoach_questions;
+
+create trigger educoach_questions_updated_at
+  before update on public.educoach_questions
+  for each row
+  execute function public.educoach_touch_updated_at();